@@ -0,0 +1,276 @@
+# Asyncio runtime of the gateway.
+# The Flask app, with the same swagger operations, views and templates, is served by an
+# aiohttp server on an event loop. Every request runs its view in a greenlet: when the view
+# calls a microservice through the client, the greenlet is suspended while the call is awaited
+# on an aiohttp session, so no thread is blocked on the network and a single process keeps
+# thousands of slow requests in flight.
+#
+#   python -m APIGateway.aio [host] [port]
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import io
+import sys
+import urllib.parse
+
+import aiohttp
+import greenlet
+import requests
+from aiohttp import web
+from requests.structures import CaseInsensitiveDict
+
+from APIGateway.client import client
+
+HOST = '127.0.0.1'
+PORT = 5000
+# Connections kept by the aiohttp pool of each service
+POOL_SIZE = 100
+# Largest request body accepted by the server
+MAX_BODY_SIZE = 1024 ** 2
+
+
+# A greenlet whose parent runs the event loop, the only place where await_only can be used
+class _RuntimeGreenlet(greenlet.greenlet):
+    pass
+
+
+def in_runtime():
+    return isinstance(greenlet.getcurrent(), _RuntimeGreenlet)
+
+
+# Runs the synchronous func in a new greenlet: each await_only inside it suspends the
+# greenlet until the awaited object is done, while the event loop keeps running
+async def greenlet_spawn(func, *args, **kwargs):
+    context = contextvars.copy_context()
+    g = _RuntimeGreenlet(lambda: context.run(func, *args, **kwargs), parent=greenlet.getcurrent())
+    result = g.switch()
+    while not g.dead:
+        try:
+            value = await result
+        except BaseException:
+            result = g.throw(*sys.exc_info())
+        else:
+            result = g.switch(value)
+    return result
+
+
+# Waits for awaitable from the synchronous code of a runtime greenlet
+def await_only(awaitable):
+    return greenlet.getcurrent().parent.switch(awaitable)
+
+
+# Future of a function spawned on the runtime, with the concurrent.futures.Future methods used by the views
+class GreenletFuture:
+
+    def __init__(self, task):
+        self.task = task
+
+    def done(self):
+        return self.task.done()
+
+    def cancel(self):
+        return self.task.cancel()
+
+    def result(self, timeout=None):
+        if not self.task.done():
+            try:
+                await_only(asyncio.wait_for(asyncio.shield(self.task), timeout))
+            except asyncio.TimeoutError:
+                raise concurrent.futures.TimeoutError()
+        return self.task.result()
+
+
+class AioRuntime:
+
+    def __init__(self, services, pool_size=POOL_SIZE):
+        self.services = services
+        self.pool_size = pool_size
+        self._sessions = {}
+
+    async def start(self):
+        for name in self.services:
+            self._sessions[name] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions = {}
+
+    def active(self):
+        return in_runtime()
+
+    def spawn(self, func, *args, **kwargs):
+        return GreenletFuture(asyncio.ensure_future(greenlet_spawn(func, *args, **kwargs)))
+
+    def wait(self, futures, timeout=None):
+        pending = [f.task for f in futures if not f.done()]
+        if pending:
+            await_only(asyncio.wait(pending, timeout=timeout))
+        done = {f for f in futures if f.done()}
+        return done, set(futures) - done
+
+    # A threading.Event may be set by another thread, so it's polled instead of waited on
+    def wait_event(self, event, timeout=None):
+        loop = asyncio.get_event_loop()
+        end = None if timeout is None else loop.time() + timeout
+        while not event.is_set():
+            if end is not None and loop.time() >= end:
+                return False
+            await_only(asyncio.sleep(0.005))
+        return True
+
+    def sleep(self, seconds):
+        await_only(asyncio.sleep(seconds))
+
+    # Runs the blocking func (e.g. a Redis call) in a thread of the loop's executor
+    def run_blocking(self, func, *args, **kwargs):
+        return await_only(asyncio.get_event_loop().run_in_executor(None, functools.partial(func, *args, **kwargs)))
+
+    # Same arguments and result as requests.Session.request, the call is awaited on the service pool.
+    # With stream=True the body is read when the caller reads it, see _StreamedBody
+    def request(self, service, method, url, params=None, data=None, json=None, headers=None, timeout=None,
+                stream=False, **kwargs):
+        return await_only(self._request(service, method, url, params=params, data=data, json=json,
+                                        headers=headers, timeout=timeout, stream=stream))
+
+    async def _request(self, service, method, url, timeout=None, stream=False, **kwargs):
+        if isinstance(timeout, tuple):
+            timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        else:
+            timeout = aiohttp.ClientTimeout(total=timeout)
+        kwargs = {k: v for k, v in kwargs.items() if v is not None}
+        try:
+            resp = await self._sessions[service].request(method, url, timeout=timeout, **kwargs)
+            if not stream:
+                async with resp:
+                    content = await resp.read()
+        except asyncio.TimeoutError as e:
+            raise requests.exceptions.ReadTimeout('{} {} timed out'.format(method, url)) from e
+        except aiohttp.ClientError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+        x = requests.Response()
+        x.status_code = resp.status
+        x.reason = resp.reason
+        x.headers = CaseInsensitiveDict(resp.headers)
+        x.url = str(resp.url)
+        x.encoding = resp.charset
+        if stream:
+            x.raw = _StreamedBody(resp)
+            x._content = False
+        else:
+            x._content = content
+        return x
+
+
+# Raw body of a streamed response, read like a file by requests from the synchronous code of a
+# runtime greenlet: each read is awaited on the aiohttp response
+class _StreamedBody:
+
+    def __init__(self, resp):
+        self._resp = resp
+
+    def read(self, size=-1):
+        try:
+            return await_only(self._resp.content.read(size))
+        except asyncio.TimeoutError as e:
+            raise requests.exceptions.ReadTimeout('{} timed out'.format(self._resp.url)) from e
+        except aiohttp.ClientError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+    def close(self):
+        self._resp.release()
+
+
+def _environ(request, body):
+    path = urllib.parse.unquote_to_bytes(request.raw_path.split('?', 1)[0]).decode('latin-1')
+    host, _, port = request.host.partition(':')
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': request.query_string,
+        'SERVER_NAME': host,
+        'SERVER_PORT': port or ('443' if request.scheme == 'https' else '80'),
+        'SERVER_PROTOCOL': 'HTTP/{}.{}'.format(*request.version),
+        'REMOTE_ADDR': request.remote or '',
+        'CONTENT_TYPE': request.headers.get('Content-Type', ''),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        if key in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+            continue
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+# Runs the WSGI app inside a runtime greenlet. The body is sent a chunk at a time, as the app
+# yields it: a streamed page leaves while it's rendered and is never held whole, like on a
+# WSGI server. The headers are sent with the first chunk, so an error before it is still a 500
+def _call_app(flask_app, request, environ):
+    response = web.StreamResponse()
+
+    def start_response(status, headers, exc_info=None):
+        code, _, reason = status.partition(' ')
+        response.set_status(int(code), reason or None)
+        response.headers.clear()
+        response.headers.extend(headers)
+
+    result = flask_app(environ, start_response)
+    try:
+        for chunk in result:
+            if not response.prepared:
+                await_only(response.prepare(request))
+            if chunk:
+                await_only(response.write(chunk))
+        if not response.prepared:
+            await_only(response.prepare(request))
+        await_only(response.write_eof())
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response
+
+
+# aiohttp application serving the swagger operations of flask_app
+def create_server(flask_app, pool_size=POOL_SIZE):
+    runtime = AioRuntime(client.services, pool_size)
+
+    async def handle(request):
+        body = await request.read()
+        return await greenlet_spawn(_call_app, flask_app, request, _environ(request, body))
+
+    async def start(server):
+        await runtime.start()
+        client.runtime = runtime
+
+    async def stop(server):
+        client.runtime = None
+        await runtime.close()
+
+    server = web.Application(client_max_size=MAX_BODY_SIZE)
+    # Swagger paths use the same {param} syntax as the aiohttp router
+    for bp in flask_app.blueprints.values():
+        for op in getattr(bp, 'ops', {}).values():
+            server.router.add_route(op['method'].upper(), op['path'], handle)
+    server.router.add_route('GET', flask_app.static_url_path + '/{filename:.*}', handle)
+    server.on_startup.append(start)
+    server.on_cleanup.append(stop)
+    return server
+
+
+if __name__ == '__main__':
+    from APIGateway.app import app
+
+    host = sys.argv[1] if len(sys.argv) > 1 else HOST
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else PORT
+    web.run_app(create_server(app), host=host, port=port)
@@ -1,11 +1,21 @@
+import time
+
 from flask import Flask
 
+from APIGateway import deadline, pagination, streaming, templating
+from APIGateway.assets import assets
 from APIGateway.auth import login_manager
+from APIGateway.catalogue import catalogue
+from APIGateway.client import client
 from APIGateway.urls import DEFAULT_DB
 from APIGateway.views import blueprints
 
+# Seconds create_app should take: a slower start is logged, the time taken is in GATEWAY_STARTUP_TIME
+STARTUP_BUDGET = 0.5
+
 
-def create_app(database=DEFAULT_DB, wtf=False, login_disabled=False):
+def create_app(database=DEFAULT_DB, wtf=False, login_disabled=False, stateless_identity=False):
+    start = time.perf_counter()
     flask_app = Flask(__name__)
     flask_app.config['TESTING'] = True
     flask_app.config['WTF_CSRF_SECRET_KEY'] = 'A SECRET KEY'
@@ -14,12 +24,30 @@ def create_app(database=DEFAULT_DB, wtf=False, login_disabled=False):
     flask_app.config['SQLALCHEMY_DATABASE_URI'] = database
     flask_app.config['WTF_CSRF_ENABLED'] = wtf
     flask_app.config['LOGIN_DISABLED'] = login_disabled
+    # Keep a signed identity claim in the session instead of asking the Users service on every request
+    flask_app.config['STATELESS_IDENTITY'] = stateless_identity
+    # Seconds after which the identity claim is revalidated against the Users service
+    flask_app.config['IDENTITY_REFRESH'] = 300
 
     for bp in blueprints:
         flask_app.register_blueprint(bp)
         bp.app = flask_app
 
     login_manager.init_app(flask_app)
+    client.init_app(flask_app)
+    deadline.init_app(flask_app)
+    catalogue.init_app(flask_app)
+    streaming.init_app(flask_app)
+    pagination.init_app(flask_app)
+    # Before anything else uses the Jinja environment of the app
+    templating.init_app(flask_app)
+    assets.init_app(flask_app)
+
+    flask_app.config.setdefault('GATEWAY_STARTUP_BUDGET', STARTUP_BUDGET)
+    flask_app.config['GATEWAY_STARTUP_TIME'] = time.perf_counter() - start
+    if flask_app.config['GATEWAY_STARTUP_TIME'] > flask_app.config['GATEWAY_STARTUP_BUDGET']:
+        flask_app.logger.warning('create_app took %.3fs, over the budget of %.3fs',
+                                 flask_app.config['GATEWAY_STARTUP_TIME'], flask_app.config['GATEWAY_STARTUP_BUDGET'])
 
     return flask_app
 
@@ -0,0 +1,188 @@
+# Static assets of the gateway.
+# At startup every file under static/ is fingerprinted with the hash of its content:
+# static_url() puts the hash in the name of the file (die0/bike.png -> die0/bike.1a2b3c4d.png),
+# so the browsers can keep it forever, a new content is a new url. The files are served by
+# StaticMiddleware before the request reaches Flask, with the precompressed (.br, .gz) or
+# WebP variant written by the build step (build_assets.py) when the browser accepts it, and
+# the file is handed to the server through wsgi.file_wrapper, which uses sendfile when it can.
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from werkzeug.wsgi import wrap_file
+
+STATIC_ROOT = os.path.join(os.path.dirname(__file__), 'static')
+DIST_DIR = 'dist'
+SPRITES_MANIFEST = os.path.join(DIST_DIR, 'sprites.json')
+
+# Default values, they can be overridden with the GATEWAY_STATIC_* keys of the Flask config
+STATIC_MAX_AGE = 3600
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+HASH_LENGTH = 8
+COMPRESSED_TYPES = ('.css', '.js', '.json', '.svg', '.html', '.txt', '.map')
+# Accept-Encoding value -> suffix of the precompressed variant, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+WEBP_TYPES = ('.png', '.jpg', '.jpeg')
+
+_HASHED = re.compile(r'^(.+)\.([0-9a-f]{%d})(\.[^./]+)$' % HASH_LENGTH)
+
+
+class Assets:
+
+    def __init__(self, root=STATIC_ROOT):
+        self.root = root
+        self.url_path = '/static'
+        self.max_age = STATIC_MAX_AGE
+        # path relative to root -> hash of its content
+        self.hashes = {}
+        # path relative to root -> {'.webp'/'.br'/'.gz': path of the variant}
+        self.variants = {}
+        self.sprites = {}
+
+    def init_app(self, app):
+        app.config.setdefault('GATEWAY_STATIC_MAX_AGE', STATIC_MAX_AGE)
+        self.root = app.static_folder
+        self.url_path = app.static_url_path
+        self.max_age = app.config['GATEWAY_STATIC_MAX_AGE']
+        self.load()
+        app.jinja_env.globals.update(static_url=self.url, dice_sprite=self.sprite)
+        app.wsgi_app = StaticMiddleware(app.wsgi_app, self)
+
+    # Fingerprints the files under root and reads the manifest of the sprites, if it was built
+    def load(self):
+        hashes = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, '/')
+                if os.path.splitext(path)[1] not in ('.br', '.gz'):
+                    hashes[path] = _file_hash(os.path.join(dirpath, filename))
+
+        variants = {}
+        for path in hashes:
+            found = {}
+            base, ext = os.path.splitext(path)
+            if ext in WEBP_TYPES and base + '.webp' in hashes:
+                found['.webp'] = base + '.webp'
+            for _, suffix in ENCODINGS:
+                if os.path.exists(os.path.join(self.root, path + suffix)):
+                    found[suffix] = path + suffix
+            if found:
+                variants[path] = found
+
+        sprites = {}
+        manifest = os.path.join(self.root, SPRITES_MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                sprites = json.load(f)
+
+        self.hashes, self.variants, self.sprites = hashes, variants, sprites
+
+    # Url of the static file path, with the hash of its content when the file exists
+    def url(self, path):
+        path = path.lstrip('/')
+        digest = self.hashes.get(path)
+        if digest is None:
+            return '{}/{}'.format(self.url_path, path)
+        base, ext = os.path.splitext(path)
+        return '{}/{}.{}{}'.format(self.url_path, base, digest, ext)
+
+    # Sprite sheet of the dice set name, with its url, or None if it wasn't built
+    def sprite(self, name):
+        sprite = self.sprites.get(name)
+        if sprite is None or sprite['image'] not in self.hashes:
+            return None
+        return dict(sprite, url=self.url(sprite['image']))
+
+    # (path, hash in the url or None) of the file at url path, None if it isn't a static file
+    def find(self, path):
+        if path in self.hashes:
+            return path, None
+        match = _HASHED.match(path)
+        if match is not None:
+            base, digest, ext = match.groups()
+            if base + ext in self.hashes:
+                return base + ext, digest
+        return None
+
+
+# Serves the static files before the request reaches the Flask app
+class StaticMiddleware:
+
+    def __init__(self, app, assets):
+        self.app = app
+        self.assets = assets
+
+    def __call__(self, environ, start_response):
+        prefix = self.assets.url_path + '/'
+        path = environ.get('PATH_INFO', '')
+        method = environ.get('REQUEST_METHOD')
+        found = self.assets.find(path[len(prefix):]) if path.startswith(prefix) else None
+        if found is None or method not in ('GET', 'HEAD'):
+            return self.app(environ, start_response)
+        return self.serve(environ, start_response, *found)
+
+    def serve(self, environ, start_response, path, digest):
+        assets = self.assets
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        variants = assets.variants.get(path, {})
+        vary = []
+        variant = ''
+        encoding = None
+
+        if '.webp' in variants:
+            vary.append('Accept')
+            if MIMEAccept(parse_accept_header(environ.get('HTTP_ACCEPT'))).quality('image/webp') > 0:
+                variant = '.webp'
+                content_type = 'image/webp'
+        if content_type.startswith('text/') or os.path.splitext(path)[1] in COMPRESSED_TYPES:
+            vary.append('Accept-Encoding')
+            accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+            for name, suffix in ENCODINGS:
+                if suffix in variants and accepted[name] > 0:
+                    variant = suffix
+                    encoding = name
+                    break
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+
+        if digest is None:
+            cache_control = 'public, max-age={}'.format(assets.max_age)
+        elif digest == assets.hashes[path]:
+            cache_control = 'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE)
+        else:
+            # A url of an older build, the browser must not keep what is served now under it
+            cache_control = 'no-cache'
+
+        etag = assets.hashes[path] + variant
+        headers = [('Cache-Control', cache_control), ('ETag', quote_etag(etag))]
+        if vary:
+            headers.append(('Vary', ', '.join(vary)))
+
+        if parse_etags(environ.get('HTTP_IF_NONE_MATCH')).contains(etag):
+            start_response('304 NOT MODIFIED', headers)
+            return []
+
+        filename = os.path.join(assets.root, variants[variant] if variant else path)
+        headers += [('Content-Type', content_type), ('Content-Length', str(os.path.getsize(filename)))]
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        return wrap_file(environ, open(filename, 'rb'))
+
+
+def _file_hash(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+assets = Assets()
@@ -1,13 +1,19 @@
 import functools
 
 import requests
+from flask import current_app, flash, session
 from flask_login import LoginManager, current_user
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 
 from APIGateway.classes.User import User
+from APIGateway.client import client
 from APIGateway.urls import USER_URL, check_service_up
 
 login_manager = LoginManager()
 
+# Version of the identity claim stored in the session: claims with another version are revalidated
+IDENTITY_VERSION = 1
+
 
 def admin_required(func):
     @functools.wraps(func)
@@ -21,11 +27,63 @@ def admin_required(func):
 
 @login_manager.user_loader
 def load_user(user_id):
-    user = None
-    x = requests.get(USER_URL + '/users/{}'.format(user_id))
+    # With the stateless identity the user is rebuilt from the signed claim,
+    # the Users microservice is called only when the claim is missing or stale
+    user = _load_identity(user_id)
+    if user is not None:
+        return user
+
+    try:
+        x = client.get(USER_URL + '/users/{}'.format(user_id))
+    except requests.exceptions.ConnectionError:
+        # Users service down (or its circuit open): the user is anonymous for this request
+        flash('A requested microservice is not up', 'error')
+        return None
+
     if check_service_up(x):
         body = x.json()
         if x.status_code < 300:
-            user = User(body['id'], body['firstname'], body['lastname'], body['email'])
-            user._authenticated = True
+            user = user_from_body(body)
+            store_identity(user)
     return user
+
+
+# Builds an authenticated User from the body returned by the Users microservice
+def user_from_body(body):
+    user = User(body['id'], body['firstname'], body['lastname'], body['email'])
+    user.is_admin = body.get('is_admin', False)
+    user._authenticated = True
+    return user
+
+
+# Stores in the session a signed claim with the identity of the logged user (if STATELESS_IDENTITY is on)
+def store_identity(user):
+    if not current_app.config.get('STATELESS_IDENTITY'):
+        return
+
+    claim = {'v': IDENTITY_VERSION, 'id': user.id, 'firstname': user.firstname, 'lastname': user.lastname,
+             'email': user.email, 'is_admin': user.is_admin}
+    session['identity'] = _identity_serializer().dumps(claim)
+
+
+def clear_identity():
+    session.pop('identity', None)
+
+
+# The user of a valid claim, None if the claim is missing, expired, tampered or of another version
+def _load_identity(user_id):
+    if not current_app.config.get('STATELESS_IDENTITY') or 'identity' not in session:
+        return None
+
+    try:
+        claim = _identity_serializer().loads(session['identity'], max_age=current_app.config['IDENTITY_REFRESH'])
+    except BadSignature:
+        return None
+
+    if claim.get('v') != IDENTITY_VERSION or str(claim.get('id')) != str(user_id):
+        return None
+    return user_from_body(claim)
+
+
+def _identity_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='gateway-identity')
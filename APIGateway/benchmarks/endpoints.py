@@ -0,0 +1,243 @@
+# Benchmark of the operations of the gateway:  python -m APIGateway.benchmarks.endpoints --help
+# The microservices are replaced by the stubs of stubs.py and the gateway runs in this process,
+# on a threaded WSGI server (or it's the one at --url). Every swagger operation is called
+# `requests` times by `concurrency` clients with their own logged session; the throughput and
+# the p50/p95/p99 latencies of every operation are printed and saved as JSON, with the
+# configuration of the run, so that runs can be compared (--compare). The response cache and
+# the single-flight of the gateway are off, otherwise most GETs wouldn't reach the stubs:
+# --cache turns them on, in this process only (the shared Redis is never used).
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from APIGateway.benchmarks.stubs import Latency, start_stubs, stop_stubs, LIST_SIZE, TEXT_SIZE
+
+CONCURRENCY = 8
+REQUESTS = 200
+PERCENTILES = (50, 95, 99)
+
+# Values of the path parameters of the operations
+PATH_ARGS = {'id_user': 2, 'id_story': 3, 'reaction_caption': 'like'}
+# Query string and form of the operations that need them
+QUERIES = {'stories.getRange': {'begin': '2019-01-01', 'end': '2019-12-31'}}
+FORMS = {
+    'gateway.register': {'firstname': 'Bench', 'lastname': 'Mark', 'email': 'bench@example.com',
+                         'password': 'bench', 'dateofbirth': '01/01/1990'},
+    'gateway.login': {'email': 'user1@example.com', 'password': 'bench'},
+    'gateway.search': {'query': 'moon'},
+    'dice.getRollPage': {'dice_number': '3', 'dice_img_set': '1_standard'},
+    'stories.writeNew': {'text': 'bike moon tree', 'as_draft': '0'},
+    'stories.completeDraft': {'text': 'bike moon tree', 'as_draft': '0'},
+}
+# Operations that end the session or use up the rolled dice: the session is set up again,
+# without timing it, before each of their requests
+RESET = {'gateway.logout', 'stories.writeNew', 'stories.completeDraft'}
+
+
+# (name, method, path, query, form) of every swagger operation of the gateway
+def operations():
+    from APIGateway.views import blueprints
+
+    ops = []
+    for bp in blueprints:
+        for op_id, op in bp.ops.items():
+            name = '{}.{}'.format(bp.name, op_id)
+            path = op['path'].format(**PATH_ARGS)
+            ops.append((name, op['method'], path, QUERIES.get(name), FORMS.get(name)))
+    return ops
+
+
+# Logs the session in and rolls the dice, as a user about to write a story
+def setup_session(session, url):
+    session.post(url + '/login', data=FORMS['gateway.login'], allow_redirects=False)
+    session.post(url + '/stories/new/roll', data=FORMS['dice.getRollPage'], allow_redirects=False)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+# Calls the operation `requests` times from `concurrency` threads, returns its measures
+def bench_operation(url, operation, concurrency=CONCURRENCY, requests_count=REQUESTS):
+    name, method, path, query, form = operation
+    latencies = []
+    codes = {}
+    errors = []
+    lock = threading.Lock()
+    remaining = [requests_count]
+
+    def worker():
+        session = requests.Session()
+        setup_session(session, url)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            if name in RESET:
+                setup_session(session, url)
+            start = time.perf_counter()
+            try:
+                x = session.request(method, url + path, params=query, data=form, allow_redirects=False)
+                x.content
+            except requests.exceptions.RequestException as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                codes[x.status_code] = codes.get(x.status_code, 0) + 1
+        session.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duration = time.perf_counter() - start
+
+    result = {'method': method, 'path': path, 'requests': len(latencies), 'errors': len(errors),
+              'server_errors': sum(n for code, n in codes.items() if code >= 500),
+              'codes': {str(code): n for code, n in sorted(codes.items())},
+              'duration': duration, 'throughput': len(latencies) / duration if duration else None,
+              'mean': sum(latencies) / len(latencies) if latencies else None}
+    for p in PERCENTILES:
+        result['p{}'.format(p)] = percentile(latencies, p)
+    return result
+
+
+# Runs the gateway app on a threaded server in this process, returns (url, server)
+def serve(app):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    # Without a line on stderr for every request
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='gateway', daemon=True).start()
+    return 'http://127.0.0.1:{}'.format(server.server_port), server
+
+
+def run(url=None, only=None, concurrency=CONCURRENCY, requests_count=REQUESTS, latencies=None,
+        list_size=LIST_SIZE, text_size=TEXT_SIZE, cache=False):
+    from APIGateway.client import client
+
+    stubs = start_stubs(latencies, list_size, text_size)
+    server = None
+    spool = tempfile.TemporaryDirectory()
+    saved = client.cache, client.flights
+    try:
+        if url is None:
+            from APIGateway import tasks
+            from APIGateway.app import create_app
+
+            # The reactions queued without a broker are spooled here, not in the real spool
+            tasks.publisher.spool_path = os.path.join(spool.name, 'reactions.spool')
+            app = create_app()
+            if cache:
+                client.cache.l2 = None
+                client.flights.redis = None
+            else:
+                client.cache = client.flights = None
+            url, server = serve(app)
+
+        results = {}
+        for operation in operations():
+            if only and operation[0] not in only:
+                continue
+            results[operation[0]] = bench_operation(url, operation, concurrency, requests_count)
+            print(format_result(operation[0], results[operation[0]]), flush=True)
+    finally:
+        if server is not None:
+            server.shutdown()
+        client.cache, client.flights = saved
+        stop_stubs(stubs)
+        spool.cleanup()
+
+    return {'benchmark': 'endpoints',
+            'date': datetime.datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'config': {'url': url if server is None else 'in-process', 'concurrency': concurrency,
+                       'requests': requests_count, 'list_size': list_size, 'text_size': text_size,
+                       'cache': cache if server is not None else None,
+                       'latency': {name or '*': str(l) for name, l in (latencies or {}).items()}},
+            'stubs': {name: {str(code): n for code, n in stub.requests.items()} for name, stub in stubs.items()},
+            'results': results}
+
+
+def _ms(seconds):
+    return '{:8.1f}'.format(seconds * 1000) if seconds is not None else '       -'
+
+
+def format_result(name, r, old=None):
+    line = '{:30} {:8.1f} req/s  p50 {} ms  p95 {} ms  p99 {} ms'.format(
+        name, r['throughput'] or 0, _ms(r['p50']), _ms(r['p95']), _ms(r['p99']))
+    if r['errors'] or r['server_errors']:
+        line += '  errors {} 5xx {}'.format(r['errors'], r['server_errors'])
+    if old is not None and old.get('throughput') and old.get('p99') and r['p99']:
+        line += '  ({:+.0%} req/s, {:+.0%} p99)'.format(r['throughput'] / old['throughput'] - 1,
+                                                         r['p99'] / old['p99'] - 1)
+    return line
+
+
+# Lines comparing the results of a run with the ones of an older run
+def compare(report, old_report):
+    old = old_report.get('results', {})
+    return [format_result(name, r, old.get(name)) for name, r in report['results'].items()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the operations of the gateway')
+    parser.add_argument('--url', help='gateway to benchmark, instead of one in this process')
+    parser.add_argument('--only', action='append', help='operation to run, e.g. stories.getAll (repeatable)')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--requests', type=int, default=REQUESTS, help='requests per operation')
+    parser.add_argument('--latency', action='append', default=[],
+                        help='[service=]kind:args of the stubs, e.g. lognormal:0.02:0.5 or stories=constant:0.1')
+    parser.add_argument('--list-size', type=int, default=LIST_SIZE, help='items in the lists of the stubs')
+    parser.add_argument('--text-size', type=int, default=TEXT_SIZE, help='characters of the stories')
+    parser.add_argument('--cache', action='store_true',
+                        help='with the response cache and single-flight of the gateway, in process only')
+    parser.add_argument('--output', help='JSON file of the results (default: a new timestamped file)')
+    parser.add_argument('--compare', help='JSON file of an older run to compare with')
+    args = parser.parse_args(argv)
+
+    latencies = {}
+    for spec in args.latency:
+        service, _, spec = spec.rpartition('=')
+        latencies[service or None] = Latency.parse(spec)
+
+    report = run(args.url, args.only, args.concurrency, args.requests, latencies, args.list_size, args.text_size,
+                 args.cache)
+
+    output = args.output or 'benchmark-endpoints-{}.json'.format(time.strftime('%Y%m%d-%H%M%S'))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('Results saved in', output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old_report = json.load(f)
+        print('Compared with', args.compare)
+        print('\n'.join(compare(report, old_report)))
+    return report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
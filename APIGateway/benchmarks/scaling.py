@@ -0,0 +1,181 @@
+# How the list pages scale with the size of the lists:  python -m APIGateway.benchmarks.scaling --help
+# The stubs of stubs.py run in another process and answer the lists with `size` items each.
+# For every page and size the page is asked to the gateway (through the Flask test client,
+# so only the gateway is measured) and read whole: the time it takes, the peak of the memory
+# allocated meanwhile (tracemalloc, in a separate run since tracing slows everything down) and
+# the size of the page are saved as JSON. The growth exponent between two sizes,
+# log(t2 / t1) / log(n2 / n1), is 1 for a linear page: above MAX_EXPONENT it's reported as
+# superlinear (and --check makes it an error).
+import argparse
+import datetime
+import json
+import math
+import multiprocessing
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+SIZES = (10, 1000, 10000, 100000)
+# (method, path, form) of the pages
+PAGES = {
+    'stories.html': ('GET', '/stories', None),
+    'users.html': ('GET', '/users', None),
+    'followers.html': ('GET', '/users/2/followers', None),
+    'search.html': ('POST', '/search', {'query': 'moon'}),
+}
+REPEAT = 3
+# Growth exponents are checked only from this size on, below it the fixed costs dominate
+MIN_CHECKED_SIZE = 1000
+MAX_EXPONENT = 1.2
+
+
+def _serve_stubs(size, text_size, ready, stop):
+    from APIGateway.benchmarks.stubs import start_stubs, stop_stubs
+
+    stubs = start_stubs(list_size=size, text_size=text_size, cache_answers=True)
+    ready.set()
+    stop.wait()
+    stop_stubs(stubs)
+
+
+# Runs the stubs in another process: their work and memory aren't part of what is measured
+class StubProcess:
+
+    def __init__(self, size, text_size):
+        context = multiprocessing.get_context('spawn')
+        self._ready = context.Event()
+        self._stop = context.Event()
+        self._process = context.Process(target=_serve_stubs, args=(size, text_size, self._ready, self._stop),
+                                        daemon=True)
+
+    def __enter__(self):
+        self._process.start()
+        if not self._ready.wait(30):
+            self._process.terminate()
+            raise RuntimeError('The stubs did not start')
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._process.join(10)
+
+
+# Status and size of the page, read a chunk at a time like a server would send it: a streamed
+# page is rendered while it's read, and only what the gateway holds is measured
+def _get_page(client, method, path, form):
+    resp = client.open(path, method=method, data=form, buffered=False)
+    size = 0
+    try:
+        for chunk in resp.response:
+            size += len(chunk)
+    finally:
+        resp.close()
+    return resp.status_code, size
+
+
+# Time, peak memory and size of the page at path, with the lists of the stubs of `size` items
+def measure_page(client, method, path, form, repeat=REPEAT):
+    # The first request loads the template and fills the pools
+    _get_page(client, method, path, form)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        code, size = _get_page(client, method, path, form)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        _get_page(client, method, path, form)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'status': code, 'time': statistics.median(times), 'time_min': min(times),
+            'peak_memory': peak, 'response_bytes': size}
+
+
+# Growth exponents of the field between consecutive sizes of the results of a page
+def exponents(results, field):
+    sizes = sorted(int(s) for s in results)
+    found = {}
+    for a, b in zip(sizes, sizes[1:]):
+        va, vb = results[str(a)][field], results[str(b)][field]
+        if va > 0 and vb > 0:
+            found['{}-{}'.format(a, b)] = math.log(vb / va) / math.log(b / a)
+    return found
+
+
+# Superlinear growths of the time of the pages, as (page, sizes, exponent)
+def superlinear(report, max_exponent=MAX_EXPONENT):
+    found = []
+    for page, scaling in report['scaling'].items():
+        for sizes, exponent in scaling['time'].items():
+            if int(sizes.split('-')[0]) >= MIN_CHECKED_SIZE and exponent > max_exponent:
+                found.append((page, sizes, exponent))
+    return found
+
+
+def run(pages=None, sizes=SIZES, repeat=REPEAT, text_size=None):
+    from APIGateway.app import create_app
+    from APIGateway.benchmarks.stubs import TEXT_SIZE
+    from APIGateway.client import client
+
+    text_size = TEXT_SIZE if text_size is None else text_size
+    pages = pages or list(PAGES)
+    app = create_app()
+    test_client = app.test_client()
+    # Every request goes to the stubs: the decoding of the lists is part of what is measured
+    cache, client.cache = client.cache, None
+
+    results = {page: {} for page in pages}
+    try:
+        for size in sizes:
+            with StubProcess(size, text_size):
+                for page in pages:
+                    result = measure_page(test_client, *PAGES[page], repeat=repeat)
+                    results[page][str(size)] = result
+                    print('{:15} {:>7} items  {:9.1f} ms  peak {:9.1f} KiB  page {:9.1f} KiB'.format(
+                        page, size, result['time'] * 1000, result['peak_memory'] / 1024,
+                        result['response_bytes'] / 1024), flush=True)
+    finally:
+        client.cache = cache
+
+    return {'benchmark': 'scaling',
+            'date': datetime.datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'config': {'sizes': list(sizes), 'repeat': repeat, 'text_size': text_size},
+            'results': results,
+            'scaling': {page: {field: exponents(r, field) for field in ('time', 'peak_memory', 'response_bytes')}
+                        for page, r in results.items()}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scaling of the list pages with the size of the lists')
+    parser.add_argument('--page', action='append', choices=list(PAGES), help='page to run (repeatable)')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES), help='comma separated list sizes')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='timed requests per page and size')
+    parser.add_argument('--text-size', type=int, help='characters of the stories')
+    parser.add_argument('--output', help='JSON file of the results (default: a new timestamped file)')
+    parser.add_argument('--check', action='store_true', help='exit with an error if a page grows superlinearly')
+    args = parser.parse_args(argv)
+
+    report = run(args.page, [int(s) for s in args.sizes.split(',')], args.repeat, args.text_size)
+
+    output = args.output or 'benchmark-scaling-{}.json'.format(time.strftime('%Y%m%d-%H%M%S'))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('Results saved in', output)
+
+    found = superlinear(report)
+    for page, sizes, exponent in found:
+        print('Superlinear: {} from {} items grows as n^{:.2f}'.format(page, sizes.replace('-', ' to '), exponent))
+    if args.check and found:
+        sys.exit(1)
+    return report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
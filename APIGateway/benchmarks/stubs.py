@@ -0,0 +1,223 @@
+# Stub microservices for the benchmarks.
+# Each stub is an HTTP server on the port the gateway calls the real service on (see urls.py),
+# answering the routes the gateway uses with synthetic JSON. Every answer waits for a delay
+# drawn from the latency distribution of the service, and the lists have list_size items of
+# text_size characters of text, so the cost of the payloads can be changed too.
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from APIGateway.urls import USER_URL, DICE_URL, STORY_URL, REACTION_URL
+
+SERVICES = {'users': USER_URL, 'dice': DICE_URL, 'stories': STORY_URL, 'reactions': REACTION_URL}
+
+LIST_SIZE = 50
+TEXT_SIZE = 200
+WORDS = ['bike', 'moon', 'tree', 'bridge', 'cat', 'house', 'key', 'ship', 'clock', 'storm']
+REACTIONS = ['like', 'dislike', 'love', 'shocked']
+
+
+# Delay of the answers of a stub: constant, uniform, lognormal or exponential.
+# A spec is 'kind:arg:arg', e.g. 'lognormal:0.02:0.5' has a median of 20ms and a sigma of 0.5
+class Latency:
+    KINDS = {'none': 0, 'constant': 1, 'uniform': 2, 'lognormal': 2, 'exponential': 1}
+
+    def __init__(self, kind='none', *args):
+        if kind not in self.KINDS or len(args) != self.KINDS[kind]:
+            raise ValueError('Unknown latency {}:{}'.format(kind, ':'.join(str(a) for a in args)))
+        self.kind = kind
+        self.args = [float(a) for a in args]
+        self._random = random.Random()
+
+    @classmethod
+    def parse(cls, spec):
+        parts = spec.split(':')
+        return cls(parts[0], *parts[1:])
+
+    def sample(self):
+        if self.kind == 'constant':
+            return self.args[0]
+        if self.kind == 'uniform':
+            return self._random.uniform(*self.args)
+        if self.kind == 'lognormal':
+            median, sigma = self.args
+            return median * self._random.lognormvariate(0, sigma)
+        if self.kind == 'exponential':
+            return self._random.expovariate(1 / self.args[0])
+        return 0
+
+    def __str__(self):
+        return ':'.join([self.kind] + [str(a) for a in self.args])
+
+
+# Synthetic entities, the same for the same id
+
+def user(i):
+    return {'id': i, 'firstname': 'Name{}'.format(i), 'lastname': 'Surname{}'.format(i),
+            'email': 'user{}@example.com'.format(i), 'dateofbirth': '1990-01-01', 'is_admin': i == 1}
+
+
+def story(i, text_size=TEXT_SIZE, author_id=None):
+    words = [WORDS[(i + k) % len(WORDS)] for k in range(3)]
+    text = ' '.join(words)
+    return {'id': i, 'text': (text + ' ') * (text_size // (len(text) + 1)) + text[:text_size % (len(text) + 1)],
+            'date': '2019-11-{:02d}'.format(i % 28 + 1), 'author_id': author_id or i % 10 + 1,
+            'likes': i % 7, 'dislikes': i % 3, 'figures': '#' + '#'.join(words) + '#', 'is_draft': False}
+
+
+def reaction_stats(i):
+    return {r: (i + k) % 5 for k, r in enumerate(REACTIONS)}
+
+
+# Routes of a stub: (method, regex of the path, function(match, query, body) returning (code, body))
+def service_routes(name, list_size=LIST_SIZE, text_size=TEXT_SIZE):
+    def ids(query, key='ids'):
+        return [int(i) for i in query.get(key, [''])[0].split(',') if i]
+
+    def stories(start=1):
+        return [story(start + k, text_size) for k in range(list_size)]
+
+    def users():
+        return [user(k + 1) for k in range(list_size)]
+
+    routes = {
+        'users': [
+            ('POST', r'/users/login', lambda m, q, b: (200, user(1))),
+            ('POST', r'/users/create', lambda m, q, b: (201, {'description': 'User created'})),
+            ('GET', r'/users', lambda m, q, b: (200, {str(i): user(i) for i in ids(q)} if 'ids' in q else users())),
+            ('GET', r'/users/(\d+)', lambda m, q, b: (200, user(int(m.group(1))))),
+            ('GET', r'/users/(\d+)/stats', lambda m, q, b: (200, {'num_followers': 3, 'followers_last_month': 1})),
+            ('GET', r'/users/(\d+)/followers', lambda m, q, b: (200, users())),
+            ('POST', r'/users/(\d+)/(follow|unfollow)', lambda m, q, b: (200, {'description': 'Done'})),
+            ('GET', r'/reactions/stats/user/(\d+)', lambda m, q, b: (200, {'tot_num_reactions': 4, 'avg_reactions': 1.0})),
+            ('GET', r'/search', lambda m, q, b: (200, users())),
+        ],
+        'dice': [
+            ('GET', r'/sets', lambda m, q, b: (200, [{'id': 1, 'name': 'standard'}, {'id': 2, 'name': 'animal'}])),
+            ('POST', r'/sets/(\d+)/roll', lambda m, q, b: (
+                200, {str(k + 1): WORDS[k] for k in range(min(6, (b or {}).get('dice_number', 3)))})),
+        ],
+        'stories': [
+            ('GET', r'/stories', lambda m, q, b: (200, stories())),
+            ('POST', r'/stories', lambda m, q, b: (201, {'description': 'Story created'})),
+            ('GET', r'/stories/(latest|range|drafts)', lambda m, q, b: (200, stories())),
+            ('GET', r'/stories/random', lambda m, q, b: (200, story(7, text_size))),
+            ('GET', r'/stories/users/(\d+)', lambda m, q, b: (200, [story(k + 1, text_size, int(m.group(1)))
+                                                                     for k in range(list_size)])),
+            ('GET', r'/stories/stats/(\d+)', lambda m, q, b: (200, {'num_stories': list_size, 'tot_num_dice': 3,
+                                                                    'avg_dice': 3.0})),
+            ('GET', r'/stories/(\d+)', lambda m, q, b: (200, story(int(m.group(1)), text_size, 1))),
+            ('PUT', r'/stories/(\d+)', lambda m, q, b: (200, {'description': 'Story updated'})),
+            ('DELETE', r'/stories/(\d+)', lambda m, q, b: (200, {'description': 'Story deleted'})),
+            ('GET', r'/search', lambda m, q, b: (200, stories())),
+        ],
+        'reactions': [
+            ('GET', r'/reactions/stats', lambda m, q, b: (200, {str(i): reaction_stats(i) for i in ids(q)})),
+            ('GET', r'/reactions/stats/(\d+)', lambda m, q, b: (200, reaction_stats(int(m.group(1))))),
+            ('POST', r'/react', lambda m, q, b: (200, {'description': 'Reaction created'})),
+            ('POST', r'/react/batch', lambda m, q, b: (200, {'description': 'Reactions created'})),
+        ],
+    }
+    return [(method, re.compile('^' + path + '$'), answer) for method, path, answer in routes[name]]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately: with Nagle the body of a small answer would
+    # wait for the delayed ACK of the headers, adding 40ms to it
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.answer()
+
+    do_POST = do_PUT = do_DELETE = do_GET
+
+    def answer(self):
+        stub = self.server.stub
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(data) if data else None
+        except ValueError:
+            body = None
+
+        code, payload = stub.answers.get((self.command, self.path), (None, None))
+        if payload is None:
+            code, result = 404, {'description': 'No stub for {} {}'.format(self.command, url.path)}
+            for method, path, answer in stub.routes:
+                match = path.match(url.path)
+                if method == self.command and match is not None:
+                    code, result = answer(match, parse_qs(url.query), body)
+                    break
+            payload = json.dumps(result).encode('utf-8')
+            if stub.cache_answers and self.command == 'GET':
+                stub.answers[(self.command, self.path)] = (code, payload)
+        stub.count(code)
+
+        time.sleep(stub.latency.sample())
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubService:
+
+    def __init__(self, name, port, latency=None, list_size=LIST_SIZE, text_size=TEXT_SIZE, cache_answers=False):
+        self.name = name
+        self.port = port
+        self.latency = latency or Latency()
+        self.routes = service_routes(name, list_size, text_size)
+        # With cache_answers a GET is encoded once, then the same bytes are sent again: the
+        # cost of the stub doesn't grow with the size of the lists
+        self.cache_answers = cache_answers
+        self.answers = {}
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def count(self, code):
+        with self._lock:
+            self.requests[code] = self.requests.get(code, 0) + 1
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', self.port), StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        threading.Thread(target=self._server.serve_forever, name='stub-' + self.name, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# Starts a stub for every microservice; latencies maps a service name (or None, for all
+# the others) to its Latency
+def start_stubs(latencies=None, list_size=LIST_SIZE, text_size=TEXT_SIZE, cache_answers=False):
+    latencies = latencies or {}
+    stubs = {}
+    try:
+        for name, url in SERVICES.items():
+            latency = latencies.get(name, latencies.get(None))
+            stubs[name] = StubService(name, urlsplit(url).port, latency, list_size, text_size, cache_answers).start()
+    except OSError:
+        stop_stubs(stubs)
+        raise
+    return stubs
+
+
+def stop_stubs(stubs):
+    for stub in stubs.values():
+        stub.stop()
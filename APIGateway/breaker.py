@@ -0,0 +1,102 @@
+# Circuit breaker of a microservice.
+# After FAILURE_THRESHOLD consecutive failures (connection errors, timeouts or 5xx responses)
+# the breaker opens: for RESET_TIMEOUT seconds the calls to the service fail at once with
+# CircuitOpenError, instead of each one waiting for a connect attempt or a timeout.
+# Then the breaker is half-open: a few probe calls go through, and their outcome
+# closes the breaker again or reopens it.
+import threading
+import time
+
+import requests
+
+# Default values, they can be overridden with the GATEWAY_BREAKER* keys of the Flask config
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+HALF_OPEN_CALLS = 1
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+# A ConnectionError, so the views handle it with the usual service_not_up() path
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT,
+                 half_open_calls=HALF_OPEN_CALLS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    # The ignored errors aren't failures of the service, e.g. the deadline of the caller expiring
+    def call(self, func, ignored=()):
+        self._before()
+        try:
+            x = func()
+        except ignored:
+            self._release_probe()
+            raise
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self._failure()
+            raise
+        except Exception:
+            self._release_probe()
+            raise
+
+        if x.status_code >= 500:
+            self._failure()
+        else:
+            self._success()
+        return x
+
+    def to_dict(self):
+        with self._lock:
+            return {'state': self._current_state(), 'failures': self.failures,
+                    'opened_at': self.opened_at, 'rejected': self.rejected}
+
+    def _current_state(self):
+        if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return self.state
+
+    def _before(self):
+        with self._lock:
+            self.state = self._current_state()
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return
+            self.rejected += 1
+        raise CircuitOpenError('The {} service is not available (circuit open)'.format(self.name))
+
+    def _success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probes = 0
+
+    def _failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+                self._probes = 0
+
+    def _release_probe(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(self._probes - 1, 0)
@@ -0,0 +1,86 @@
+# Build step of the static assets:  python -m APIGateway.build_assets
+# Packs the faces of every dice set into one sprite sheet, a row per die, with cells of
+# SPRITE_CELL pixels (the size the roll page shows them at), saved as PNG and WebP in
+# static/dist. Their offsets go in static/dist/sprites.json, which the templates read
+# through assets.dice_sprite(). The text assets get gzip (and brotli, when the module is
+# installed) variants next to them, which the static middleware sends to the browsers that
+# accept them. Pillow is needed only here, not by the running gateway.
+import gzip
+import json
+import os
+import sys
+
+from APIGateway.assets import STATIC_ROOT, DIST_DIR, SPRITES_MANIFEST, COMPRESSED_TYPES
+
+SPRITE_CELL = 160
+WEBP_QUALITY = 80
+
+
+# Packs the faces of the dice set in directory name into dist/<name>.png and dist/<name>.webp
+def build_sprite(root, name, cell=SPRITE_CELL):
+    from PIL import Image
+
+    path = os.path.join(root, name)
+    dice = sorted(d for d in os.listdir(path) if d.startswith('die') and os.path.isdir(os.path.join(path, d)))
+    faces = {d: sorted(f for f in os.listdir(os.path.join(path, d)) if f.endswith('.png')) for d in dice}
+    columns = max(len(f) for f in faces.values())
+
+    sheet = Image.new('RGBA', (columns * cell, len(dice) * cell), (0, 0, 0, 0))
+    offsets = {}
+    for row, die in enumerate(dice):
+        for column, filename in enumerate(faces[die]):
+            with Image.open(os.path.join(path, die, filename)) as img:
+                img = img.convert('RGBA')
+                img.thumbnail((cell, cell), Image.LANCZOS)
+                x, y = column * cell, row * cell
+                # Centered in its cell, if it isn't square
+                sheet.paste(img, (x + (cell - img.width) // 2, y + (cell - img.height) // 2))
+            offsets['{}/{}'.format(die, filename[:-len('.png')])] = [x, y]
+
+    dist = os.path.join(root, DIST_DIR)
+    os.makedirs(dist, exist_ok=True)
+    sheet.save(os.path.join(dist, name + '.png'), optimize=True)
+    sheet.save(os.path.join(dist, name + '.webp'), quality=WEBP_QUALITY, method=6)
+
+    return {'image': '{}/{}.png'.format(DIST_DIR, name), 'cell': cell,
+            'width': sheet.width, 'height': sheet.height, 'faces': offsets}
+
+
+# Writes the compressed variants of the text files under root, where they are smaller
+def precompress(root):
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if os.path.splitext(filename)[1] not in COMPRESSED_TYPES:
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, 'rb') as f:
+                data = f.read()
+            variants = {'.gz': gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                variants['.br'] = brotli.compress(data)
+            for suffix, compressed in variants.items():
+                if len(compressed) < len(data):
+                    with open(path + suffix, 'wb') as f:
+                        f.write(compressed)
+
+
+def build(root=STATIC_ROOT):
+    sprites = {}
+    for name in sorted(os.listdir(root)):
+        if name != DIST_DIR and os.path.isdir(os.path.join(root, name)):
+            sprites[name] = build_sprite(root, name)
+
+    with open(os.path.join(root, SPRITES_MANIFEST), 'w') as f:
+        json.dump(sprites, f, indent=2, sort_keys=True)
+
+    precompress(root)
+    return sprites
+
+
+if __name__ == '__main__':
+    build(sys.argv[1] if len(sys.argv) > 1 else STATIC_ROOT)
@@ -0,0 +1,362 @@
+# Two-tier cache of the GET responses of the microservices.
+# L1 is a small in-process LRU bounded by bytes, L2 is the shared Redis already used by Celery.
+# Every cached route has a TTL and a stale-while-revalidate window: a stale entry
+# is still served while a fresh copy is fetched in background.
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import redis
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# name: (service, path pattern, ttl, stale-while-revalidate), times in seconds
+ROUTES = {
+    'stories': ('stories', r'^/stories$', 10, 30),
+    'latest_stories': ('stories', r'^/stories/latest$', 10, 30),
+    'story': ('stories', r'^/stories/\d+$', 30, 120),
+    'users': ('users', r'^/users$', 30, 120),
+    'dice_sets': ('dice', r'^/sets$', 300, 3600),
+    'reaction_stats': ('reactions', r'^/reactions/stats/\d+$', 5, 30),
+}
+
+# Cached routes changed by the calls that aren't GETs: (service, method, path pattern, routes).
+# The read-like ones change nothing, a call that isn't listed drops all the routes of its service
+MUTATIONS = [
+    ('users', 'POST', r'^/users/login$', []),
+    ('users', 'POST', r'^/users/create$', ['users']),
+    ('users', 'POST', r'^/users/\d+/(follow|unfollow)$', []),
+    ('dice', 'POST', r'^/sets/\d+/roll$', []),
+    ('stories', 'POST', r'^/stories$', ['stories', 'latest_stories']),
+    ('stories', 'PUT', r'^/stories/\d+$', ['stories', 'latest_stories', 'story']),
+    ('stories', 'DELETE', r'^/stories/\d+$', ['stories', 'latest_stories', 'story']),
+    # The reaction counters are updated in place, see ResponseCache.update
+    ('reactions', 'POST', r'^/react(/batch)?$', []),
+]
+
+# Default values, they can be overridden with the GATEWAY_CACHE_* keys of the Flask config
+L1_MAX_BYTES = 16 * 1024 * 1024
+# Larger bodies aren't cached: a streamed body is only read whole when its declared size is below it
+MAX_ENTRY_BYTES = 1024 * 1024
+REDIS_URL = 'redis://localhost:6379/1'
+# Socket timeout of the Redis calls, a slow L2 is worse than a miss
+L2_TIMEOUT = 0.05
+# Seconds Redis is left alone after an error, so that a broken L2 doesn't slow every request
+L2_RETRY_AFTER = 30
+
+KEY_PREFIX = 'gateway:cache:'
+# Generation of a route in L2, an entry stored with an older one has been invalidated
+GENERATION_PREFIX = 'gateway:cache-generation:'
+
+
+class CacheStats:
+
+    FIELDS = ['l1_hits', 'l2_hits', 'stale_hits', 'misses', 'evictions', 'l2_errors']
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def add(self, route, field):
+        with self._lock:
+            counters = self._counters.setdefault(route, dict.fromkeys(self.FIELDS, 0))
+            counters[field] += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {route: dict(counters) for route, counters in self._counters.items()}
+
+
+# In-process LRU, bounded by the total size in bytes of the cached bodies
+class ByteLRU:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    # Returns the routes of the evicted entries
+    def set(self, key, entry):
+        size = _entry_size(key, entry)
+        if size > self.max_bytes:
+            return []
+
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= _entry_size(key, old)
+            self._entries[key] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                old_key, old = self._entries.popitem(last=False)
+                self.size -= _entry_size(old_key, old)
+                evicted.append(old['route'])
+        return evicted
+
+    def delete_if(self, predicate):
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self.size -= _entry_size(key, self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class ResponseCache:
+
+    def __init__(self, services, routes=None, l1_max_bytes=L1_MAX_BYTES, redis_url=REDIS_URL, spawn=None,
+                 max_entry_bytes=MAX_ENTRY_BYTES):
+        self.services = services
+        self.max_entry_bytes = max_entry_bytes
+        self.routes = {}
+        for name, (service, pattern, ttl, stale) in (routes or ROUTES).items():
+            self.routes[name] = (service, re.compile(pattern), ttl, stale)
+        self.mutations = [(service, method, re.compile(pattern), routes)
+                          for service, method, pattern, routes in MUTATIONS]
+        self.l1 = ByteLRU(l1_max_bytes)
+        self.l2 = None
+        if redis_url:
+            self.l2 = redis.Redis.from_url(redis_url, socket_timeout=L2_TIMEOUT, socket_connect_timeout=L2_TIMEOUT)
+        self._l2_down_until = 0
+        # Used to revalidate stale entries in background, defaults to a new thread
+        self._spawn = spawn or (lambda f: threading.Thread(target=f, daemon=True).start())
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.stats = CacheStats()
+        # How the Redis calls are made, replaced by the client when it runs on the asyncio runtime
+        self.run_blocking = run_blocking
+
+    # Changes TTL and stale window of the given routes: {name: (ttl, stale)}
+    def set_ttls(self, ttls):
+        for name, (ttl, stale) in ttls.items():
+            service, pattern, _, _ = self.routes[name]
+            self.routes[name] = (service, pattern, ttl, stale)
+
+    # Name of the cached route of an url, None if the url isn't cached
+    def route_of(self, service, url):
+        path = self._path(service, url)
+        if path is None:
+            return None
+        for name, (route_service, pattern, _, _) in self.routes.items():
+            if route_service == service and pattern.match(path):
+                return name
+        return None
+
+    # Cached routes changed by a call that isn't a GET, None if it isn't known (all of them may be)
+    def mutated_routes(self, service, method, url):
+        path = self._path(service, url)
+        for mutation_service, mutation_method, pattern, routes in self.mutations:
+            if (mutation_service, mutation_method) == (service, method) and path and pattern.match(path):
+                return routes
+        return None
+
+    def _path(self, service, url):
+        base = self.services.get(service)
+        if base is None:
+            return None
+        return urlsplit(url[len(base):]).path or '/'
+
+    # Response of url from the cache, calling load() to fetch it from the service when needed.
+    # With fresh=True it's always loaded, then cached
+    def fetch(self, service, url, load, fresh=False):
+        route = self.route_of(service, url)
+        if route is None:
+            return load()
+
+        key = KEY_PREFIX + route + ':' + url
+        if fresh:
+            self.stats.add(route, 'misses')
+            return self._load(route, key, load)
+
+        now = time.time()
+        generation = None
+        entry = self.l1.get(key)
+        if entry is not None and entry['stale_until'] > now:
+            field = 'l1_hits'
+        else:
+            entry, generation = self._l2_get(route, key)
+            field = 'l2_hits'
+            if entry is not None:
+                self._l1_set(key, entry)
+
+        if entry is not None and entry['fresh_until'] > now:
+            self.stats.add(route, field)
+            return to_response(entry, url)
+
+        if entry is not None and entry['stale_until'] > now:
+            self.stats.add(route, 'stale_hits')
+            self._revalidate(route, key, load)
+            return to_response(entry, url)
+
+        self.stats.add(route, 'misses')
+        return self._load(route, key, load, generation)
+
+    # Replaces the cached body of url with func(body), to show at once a change the service
+    # will only apply later. The entry keeps its TTL, returns False if url isn't cached
+    def update(self, service, url, func):
+        route = self.route_of(service, url)
+        if route is None:
+            return False
+
+        key = KEY_PREFIX + route + ':' + url
+        entry = self.l1.get(key) or self._l2_get(route, key)[0]
+        if entry is None or entry['stale_until'] <= time.time():
+            return False
+        body = func(json.loads(entry['content'].decode(entry['encoding'] or 'utf-8')))
+        self._store(route, key, dict(entry, content=json.dumps(body).encode('utf-8'), encoding='utf-8'))
+        return True
+
+    # Drops the cached responses of the given routes (by default all the routes of the service)
+    # after the service changed them. In L2 the generation of the routes is incremented instead
+    # of looking for their keys: the entries of an older generation are ignored, then expire
+    def invalidate(self, service, routes=None):
+        if routes is None:
+            routes = [name for name, (route_service, _, _, _) in self.routes.items() if route_service == service]
+        prefixes = tuple(KEY_PREFIX + route + ':' for route in routes)
+        if not prefixes:
+            return
+        self.l1.delete_if(lambda key: key.startswith(prefixes))
+        if self._l2_available():
+            try:
+                for route in routes:
+                    self.run_blocking(self.l2.incr, GENERATION_PREFIX + route)
+            except redis.RedisError:
+                self._l2_failed(None)
+
+    def clear(self):
+        self.l1.clear()
+
+    # The generation is read before the call: a response loaded while the route is
+    # invalidated is stored with the old generation, so it's never used
+    def _load(self, route, key, load, generation=None):
+        if generation is None:
+            generation = self._generation(route)
+        x = load()
+        if x.status_code == 200 and self._cacheable(x):
+            _, _, ttl, stale = self.routes[route]
+            now = time.time()
+            entry = dict(to_entry(x), route=route, generation=generation, fresh_until=now + ttl,
+                         stale_until=now + ttl + stale)
+            self._store(route, key, entry)
+        return x
+
+    def _revalidate(self, route, key, load):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def _refresh():
+            try:
+                x = self._load(route, key, load)
+                if x.raw is not None:
+                    x.close()
+            except requests.exceptions.RequestException:
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._spawn(_refresh)
+
+    # Whether the body of x is small enough to be cached, without reading a streamed body
+    # whose size isn't declared
+    def _cacheable(self, x):
+        if x._content is not False:
+            return len(x.content) <= self.max_entry_bytes
+        length = x.headers.get('Content-Length')
+        return length is not None and length.isdigit() and int(length) <= self.max_entry_bytes
+
+    def _store(self, route, key, entry):
+        self._l1_set(key, entry)
+        if self._l2_available():
+            ttl = int(entry['stale_until'] - time.time()) + 1
+            try:
+                self.run_blocking(self.l2.set, key, dumps_entry(entry), ex=max(ttl, 1))
+            except redis.RedisError:
+                self._l2_failed(route)
+
+    def _l1_set(self, key, entry):
+        for route in self.l1.set(key, entry):
+            self.stats.add(route, 'evictions')
+
+    # (entry, current generation of the route) from L2, the entry is None if it's missing or invalidated
+    def _l2_get(self, route, key):
+        if not self._l2_available():
+            return None, None
+        try:
+            data, generation = self.run_blocking(self.l2.mget, key, GENERATION_PREFIX + route)
+        except redis.RedisError:
+            self._l2_failed(route)
+            return None, None
+        generation = int(generation or 0)
+        entry = loads_entry(data) if data is not None else None
+        if entry is not None and entry.get('generation', 0) != generation:
+            entry = None
+        return entry, generation
+
+    def _generation(self, route):
+        if not self._l2_available():
+            return 0
+        try:
+            return int(self.run_blocking(self.l2.get, GENERATION_PREFIX + route) or 0)
+        except redis.RedisError:
+            self._l2_failed(route)
+            return 0
+
+    def _l2_available(self):
+        return self.l2 is not None and time.time() >= self._l2_down_until
+
+    def _l2_failed(self, route):
+        self._l2_down_until = time.time() + L2_RETRY_AFTER
+        if route is not None:
+            self.stats.add(route, 'l2_errors')
+
+
+# Runs func(*args, **kwargs) right away
+def run_blocking(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def _entry_size(key, entry):
+    return len(key) + len(entry['content'])
+
+
+# Helpers to store a response, shared with the single-flight layer
+
+def to_entry(x):
+    return {'status': x.status_code, 'headers': dict(x.headers), 'encoding': x.encoding, 'content': x.content}
+
+
+def dumps_entry(entry):
+    return json.dumps(dict(entry, content=entry['content'].decode('latin-1')))
+
+
+def loads_entry(data):
+    entry = json.loads(data)
+    entry['content'] = entry['content'].encode('latin-1')
+    return entry
+
+
+def to_response(entry, url):
+    x = requests.Response()
+    x.status_code = entry['status']
+    x.headers = CaseInsensitiveDict(entry['headers'])
+    x.encoding = entry['encoding']
+    x._content = entry['content']
+    x.url = url
+    return x
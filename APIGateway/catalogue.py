@@ -0,0 +1,91 @@
+# In-memory catalogue of the dice sets of the Dice microservice.
+# The set list almost never changes, so it's loaded at startup and refreshed by a background
+# thread: the settings page is rendered from memory, and the last good catalogue keeps
+# being served while the Dice service is down.
+import logging
+import os
+import threading
+
+import requests
+
+from APIGateway.client import client
+from APIGateway.urls import DICE_URL
+
+# Default values, they can be overridden with the GATEWAY_DICE_* keys of the Flask config
+# Seconds between two refreshes
+REFRESH_INTERVAL = 60
+# Whether the refresher runs at all: without it the catalogue is only loaded by the views
+# (the tests turn it off, it would call the services they fake)
+PRELOAD = True
+
+logger = logging.getLogger(__name__)
+
+
+class DiceCatalogue:
+
+    def __init__(self, interval=REFRESH_INTERVAL):
+        self.interval = interval
+        self.preload = PRELOAD
+        # None until the catalogue has been loaded once
+        self.sets = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('GATEWAY_DICE_REFRESH', REFRESH_INTERVAL)
+        app.config.setdefault('GATEWAY_DICE_PRELOAD', PRELOAD)
+        self.interval = app.config['GATEWAY_DICE_REFRESH']
+        self.preload = app.config['GATEWAY_DICE_PRELOAD']
+        if self.preload:
+            self.start()
+        else:
+            self.stop()
+
+    # The dice sets, None if they have never been loaded
+    def get(self):
+        # Threads don't survive a fork, so a forked worker starts its own refresher
+        if self.preload and self._pid != os.getpid():
+            self.start()
+        return self.sets
+
+    # Loads the sets from the Dice service, keeping the old ones if it fails. The cached
+    # response isn't used, it may be older than the catalogue
+    def refresh(self):
+        try:
+            x = client.get(DICE_URL + '/sets', fresh=True)
+        except requests.exceptions.RequestException:
+            return False
+
+        if x.status_code == 204:
+            self.sets = []
+        elif x.status_code < 300:
+            self.sets = x.json()
+        else:
+            return False
+        return True
+
+    # Starts the background refresher, the first load is done right away
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='dice-catalogue', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Dice catalogue refresh failed')
+            self._stop.wait(self.interval)
+
+
+catalogue = DiceCatalogue()
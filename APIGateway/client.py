@@ -0,0 +1,338 @@
+# Pooled, keep-alive HTTP client used for every call to the microservices.
+# Each service gets its own requests.Session (so its own urllib3 connection pool):
+# consecutive calls to the same service reuse an already open TCP connection
+# instead of paying the connection setup every time.
+import contextvars
+import functools
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from APIGateway import breaker, cache, deadline, jsonstream, singleflight
+from APIGateway.urls import USER_URL, DICE_URL, STORY_URL, REACTION_URL
+
+SERVICES = {'users': USER_URL, 'dice': DICE_URL, 'stories': STORY_URL, 'reactions': REACTION_URL}
+
+# Default values, they can be overridden with the GATEWAY_* keys of the Flask config
+POOL_SIZE = 10
+KEEP_ALIVE = True
+# Threads used to run concurrent calls (fan-out) to the microservices
+FANOUT_WORKERS = 20
+# (connect, read) timeout in seconds for each service
+TIMEOUTS = {'users': (3.05, 10), 'dice': (3.05, 10), 'stories': (3.05, 10), 'reactions': (3.05, 10)}
+
+
+# Counters of a single service pool: a miss is a request that had to open a new connection
+class PoolStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.misses = 0
+
+    def add_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def add_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {'requests': self.requests, 'hits': max(self.requests - self.misses, 0),
+                    'misses': self.misses}
+
+
+# Every TCP connect of the pool's connections is counted as a miss
+def _counting_pool(base, stats):
+    class _CountingConnection(base.ConnectionCls):
+        def connect(self):
+            stats.add_miss()
+            return super().connect()
+
+    class _CountingPool(base):
+        ConnectionCls = _CountingConnection
+
+    return _CountingPool
+
+
+class _PoolAdapter(HTTPAdapter):
+
+    def __init__(self, stats, **kwargs):
+        # Must be set before HTTPAdapter.__init__, which builds the pool manager
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _counting_pool(HTTPConnectionPool, self.stats),
+                                                   'https': _counting_pool(HTTPSConnectionPool, self.stats)}
+
+    def send(self, request, **kwargs):
+        self.stats.add_request()
+        return super().send(request, **kwargs)
+
+
+class GatewayClient:
+
+    def __init__(self, services=None, pool_size=POOL_SIZE, keep_alive=KEEP_ALIVE, timeouts=None):
+        self.services = dict(SERVICES if services is None else services)
+        self._sessions = {}
+        self._stats = {}
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.fanout_workers = FANOUT_WORKERS
+        self.max_response_bytes = jsonstream.MAX_RESPONSE_BYTES
+        self.cache = None
+        self.flights = None
+        self.breakers = {}
+        # Set by the asyncio runtime (aio.py) while it serves the app
+        self.runtime = None
+        self.configure(pool_size, keep_alive, timeouts)
+        self.configure_breakers()
+
+    # Reads the pool configuration from the Flask config, like login_manager.init_app
+    def init_app(self, app):
+        app.config.setdefault('GATEWAY_POOL_SIZE', POOL_SIZE)
+        app.config.setdefault('GATEWAY_KEEP_ALIVE', KEEP_ALIVE)
+        app.config.setdefault('GATEWAY_TIMEOUTS', {})
+        app.config.setdefault('GATEWAY_FANOUT_WORKERS', FANOUT_WORKERS)
+        self.fanout_workers = app.config['GATEWAY_FANOUT_WORKERS']
+        app.config.setdefault('GATEWAY_MAX_RESPONSE_BYTES', jsonstream.MAX_RESPONSE_BYTES)
+        self.max_response_bytes = app.config['GATEWAY_MAX_RESPONSE_BYTES']
+        self.configure(app.config['GATEWAY_POOL_SIZE'], app.config['GATEWAY_KEEP_ALIVE'],
+                       app.config['GATEWAY_TIMEOUTS'])
+
+        app.config.setdefault('GATEWAY_CACHE_ENABLED', True)
+        app.config.setdefault('GATEWAY_CACHE_L1_MAX_BYTES', cache.L1_MAX_BYTES)
+        app.config.setdefault('GATEWAY_CACHE_REDIS_URL', cache.REDIS_URL)
+        app.config.setdefault('GATEWAY_CACHE_TTLS', {})
+        app.config.setdefault('GATEWAY_CACHE_MAX_ENTRY_BYTES', cache.MAX_ENTRY_BYTES)
+        self.cache = None
+        if app.config['GATEWAY_CACHE_ENABLED']:
+            self.cache = cache.ResponseCache(self.services, l1_max_bytes=app.config['GATEWAY_CACHE_L1_MAX_BYTES'],
+                                             redis_url=app.config['GATEWAY_CACHE_REDIS_URL'], spawn=self.spawn,
+                                             max_entry_bytes=app.config['GATEWAY_CACHE_MAX_ENTRY_BYTES'])
+            self.cache.set_ttls(app.config['GATEWAY_CACHE_TTLS'])
+            self.cache.run_blocking = self.run_blocking
+
+        app.config.setdefault('GATEWAY_SINGLE_FLIGHT', True)
+        app.config.setdefault('GATEWAY_SINGLE_FLIGHT_REDIS_URL', singleflight.REDIS_URL)
+        self.flights = None
+        if app.config['GATEWAY_SINGLE_FLIGHT']:
+            self.flights = singleflight.SingleFlight(app.config['GATEWAY_SINGLE_FLIGHT_REDIS_URL'])
+            self.flights.wait_event = self.wait_event
+            self.flights.sleep = self.sleep
+            self.flights.run_blocking = self.run_blocking
+
+        app.config.setdefault('GATEWAY_BREAKER_THRESHOLD', breaker.FAILURE_THRESHOLD)
+        app.config.setdefault('GATEWAY_BREAKER_RESET', breaker.RESET_TIMEOUT)
+        # Per service overrides, e.g. {'reactions': {'failure_threshold': 10}}
+        app.config.setdefault('GATEWAY_BREAKERS', {})
+        self.configure_breakers(app.config['GATEWAY_BREAKER_THRESHOLD'], app.config['GATEWAY_BREAKER_RESET'],
+                                app.config['GATEWAY_BREAKERS'])
+        app.extensions['gateway_client'] = self
+
+    def configure(self, pool_size=POOL_SIZE, keep_alive=KEEP_ALIVE, timeouts=None):
+        self.close()
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeouts = dict(TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+
+        for name in self.services:
+            stats = PoolStats()
+            session = requests.Session()
+            adapter = _PoolAdapter(stats, pool_connections=1, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            if not keep_alive:
+                session.headers['Connection'] = 'close'
+            self._sessions[name] = session
+            self._stats[name] = stats
+
+    def configure_breakers(self, failure_threshold=breaker.FAILURE_THRESHOLD, reset_timeout=breaker.RESET_TIMEOUT,
+                           overrides=None):
+        overrides = overrides or {}
+        self.breakers = {}
+        for name in self.services:
+            options = {'failure_threshold': failure_threshold, 'reset_timeout': reset_timeout}
+            options.update(overrides.get(name, {}))
+            self.breakers[name] = breaker.CircuitBreaker(name, **options)
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions = {}
+        self._stats = {}
+
+    # Name of the service a url belongs to, None if it isn't one of ours
+    def service_of(self, url):
+        for name, base in self.services.items():
+            if url == base or url.startswith(base + '/') or url.startswith(base + '?'):
+                return name
+        return None
+
+    # With fresh=True a GET skips the response cache (its response is still cached for the next ones)
+    def request(self, method, url, fresh=False, **kwargs):
+        service = self.service_of(url)
+        if service is None:
+            return requests.request(method, url, **kwargs)
+
+        kwargs.setdefault('timeout', self.timeouts.get(service))
+        session = self._sessions[service]
+
+        # The call may only use the time left to the deadline of the incoming request, and while
+        # the breaker of the service is open it fails at once with CircuitOpenError
+        def send():
+            options = dict(kwargs)
+            options['timeout'], options['headers'] = deadline.limit(options['timeout'], options.get('headers'))
+
+            # A timeout cut short by the deadline is the budget of the caller running out, not a
+            # slow service: it's a DeadlineExceeded, which the breaker doesn't count
+            def call():
+                try:
+                    if self._on_runtime():
+                        return self.runtime.request(service, method, url, **options)
+                    return session.request(method, url, **options)
+                except requests.exceptions.Timeout as e:
+                    if _cut_by_deadline(e, kwargs['timeout'], options['timeout']):
+                        raise deadline.DeadlineExceeded(str(e)) from e
+                    raise
+
+            try:
+                return self.breakers[service].call(call, ignored=deadline.DeadlineExceeded)
+            except requests.exceptions.ReadTimeout as e:
+                raise deadline.GatewayTimeout(str(e)) from e
+
+        if method != 'GET':
+            x = send()
+            # The cached responses the call may have changed are dropped, see cache.MUTATIONS
+            if self.cache is not None:
+                self.cache.invalidate(service, self.cache.mutated_routes(service, method, url))
+            return x
+
+        # A streamed body is read by the caller while it's decoded, so identical calls in flight
+        # can't share it. On the cached routes it's served from the cache when it's there,
+        # otherwise it's kept only if its declared size is small (see ResponseCache._cacheable)
+        if kwargs.get('stream'):
+            def load():
+                x = send()
+                jsonstream.check_size(x, self.max_response_bytes)
+                return x
+
+            if self.cache is None or 'params' in kwargs:
+                return load()
+            return self.cache.fetch(service, url, load, fresh)
+
+        # A GET goes through the cache, then identical GETs in flight are coalesced into one
+        load = send
+        if self.flights is not None:
+            key = self.flights.key(url, kwargs.get('params'), kwargs.get('headers'))
+            load = functools.partial(self.flights.do, key, url, send)
+        if self.cache is not None and 'params' not in kwargs:
+            return self.cache.fetch(service, url, load, fresh)
+        return load()
+
+    # Optimistic update of the cached response of url, see ResponseCache.update
+    def update_cached(self, url, func):
+        service = self.service_of(url)
+        if self.cache is None or service is None:
+            return False
+        return self.cache.update(service, url, func)
+
+    # Items of the JSON array in the body of x, decoded one at a time, see jsonstream.
+    # Get x with stream=True so that its body isn't read all at once
+    def iter_json(self, x):
+        if x.status_code == 204:
+            return iter(())
+        return jsonstream.iter_array(x, self.max_response_bytes)
+
+    # Starts the request in the fan-out pool and returns its Future, so that
+    # independent calls can be waited on together instead of one after the other
+    def submit(self, method, url, **kwargs):
+        return self.spawn(self.request, method, url, **kwargs)
+
+    # Runs func in the fan-out pool with the context of the caller, returns its Future
+    def spawn(self, func, *args, **kwargs):
+        if self._on_runtime():
+            return self.runtime.spawn(func, *args, **kwargs)
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.fanout_workers,
+                                                        thread_name_prefix='gateway-fanout')
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, func, *args, **kwargs)
+
+    # Waits for the Futures returned by submit or spawn, like concurrent.futures.wait
+    def wait(self, futures, timeout=None):
+        if self._on_runtime():
+            return self.runtime.wait(futures, timeout)
+        return wait(futures, timeout)
+
+    def wait_event(self, event, timeout=None):
+        if self._on_runtime():
+            return self.runtime.wait_event(event, timeout)
+        return event.wait(timeout)
+
+    def sleep(self, seconds):
+        if self._on_runtime():
+            return self.runtime.sleep(seconds)
+        time.sleep(seconds)
+
+    # Makes a blocking call that isn't to a microservice (e.g. to Redis), on the asyncio runtime
+    # it runs in a thread so that the event loop isn't blocked
+    def run_blocking(self, func, *args, **kwargs):
+        if self._on_runtime():
+            return self.runtime.run_blocking(func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    # True inside a request served by the asyncio runtime, where waiting must not block the event loop
+    def _on_runtime(self):
+        return self.runtime is not None and self.runtime.active()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    # Hit/miss counters of every service pool
+    def stats(self):
+        return {name: stats.to_dict() for name, stats in self._stats.items()}
+
+    # State of the circuit breaker of every service
+    def breaker_states(self):
+        return {name: b.to_dict() for name, b in self.breakers.items()}
+
+    # Hit/miss/eviction counters of every cached route
+    def cache_stats(self):
+        return self.cache.stats.to_dict() if self.cache is not None else {}
+
+
+# Whether the timeout error e happened because the deadline made the timeout of the service shorter
+def _cut_by_deadline(e, timeout, limited):
+    index = 0 if isinstance(e, requests.exceptions.ConnectTimeout) else 1
+
+    def seconds(t):
+        if t is None:
+            return math.inf
+        return t[index] if isinstance(t, tuple) else t
+
+    return seconds(limited) < seconds(timeout)
+
+
+client = GatewayClient()
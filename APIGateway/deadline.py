@@ -0,0 +1,93 @@
+# End-to-end deadlines of the gateway requests.
+# Every incoming request gets a total time budget (per swagger operation if configured):
+# each call to a microservice may only use the time that is left, and the remaining
+# milliseconds travel in the DEADLINE_HEADER so that cooperating services can drop
+# work whose answer would arrive too late anyway.
+import contextvars
+import time
+
+import requests
+from flask import request
+
+DEADLINE_HEADER = 'X-Deadline-Ms'
+
+# Default values, they can be overridden with the GATEWAY_* keys of the Flask config
+REQUEST_BUDGET = 10
+# Budgets of specific operations, keyed by "operationId" or "blueprint.operationId"
+OPERATION_BUDGETS = {}
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+# A ConnectionError, so the views handle it with the usual service_not_up() path
+class GatewayTimeout(requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+    pass
+
+
+class DeadlineExceeded(GatewayTimeout):
+    pass
+
+
+def init_app(app):
+    app.config.setdefault('GATEWAY_REQUEST_BUDGET', REQUEST_BUDGET)
+    app.config.setdefault('GATEWAY_OPERATION_BUDGETS', OPERATION_BUDGETS)
+
+    # (rule, method) -> operation names, to find the budget of the incoming request
+    operations = {}
+    for bp in app.blueprints.values():
+        for operation_id, op in getattr(bp, 'ops', {}).items():
+            rule = op['path'].replace('{', '<').replace('}', '>')
+            operations[(rule, op['method'])] = [bp.name + '.' + operation_id, operation_id]
+
+    @app.before_request
+    def _start_deadline():
+        budget = app.config['GATEWAY_REQUEST_BUDGET']
+        if request.url_rule is not None:
+            budgets = app.config['GATEWAY_OPERATION_BUDGETS']
+            for name in operations.get((request.url_rule.rule, request.method), []):
+                if name in budgets:
+                    budget = budgets[name]
+                    break
+
+        # A deadline coming from upstream is honoured when it's shorter
+        upstream = request.headers.get(DEADLINE_HEADER, type=int)
+        if upstream is not None:
+            budget = min(budget, upstream / 1000)
+        set_deadline(budget)
+
+    @app.teardown_request
+    def _end_deadline(exc=None):
+        _deadline.set(None)
+
+
+# Starts a deadline of budget seconds from now, None removes it
+def set_deadline(budget):
+    _deadline.set(time.time() + budget if budget is not None else None)
+
+
+# Seconds left before the deadline of the current request, None if there's no deadline
+def remaining():
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+# Timeout and headers of a call to a microservice, limited to the time left
+def limit(timeout, headers=None):
+    left = remaining()
+    if left is None:
+        return timeout, headers
+    if left <= 0:
+        raise DeadlineExceeded('The deadline of the request has expired')
+
+    if timeout is None:
+        timeout = left
+    elif isinstance(timeout, tuple):
+        timeout = tuple(min(t, left) for t in timeout)
+    else:
+        timeout = min(timeout, left)
+
+    headers = dict(headers or {})
+    headers[DEADLINE_HEADER] = str(int(left * 1000))
+    return timeout, headers
@@ -0,0 +1,126 @@
+# Incremental decoding of the JSON arrays returned by the microservices.
+# The body is read a chunk at a time and every item of the array is yielded as soon as
+# it has been decoded: the whole body is never held as bytes, text and list at the same
+# time. A body larger than the max response size stops the decoding with ResponseTooLarge.
+import codecs
+import json
+
+import requests
+
+# Default values, they can be overridden with the GATEWAY_* keys of the Flask config
+MAX_RESPONSE_BYTES = 64 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+
+# A ConnectionError, so the views handle it with the usual service_not_up() path
+class ResponseTooLarge(requests.exceptions.ConnectionError):
+    pass
+
+
+# Yields the items of the JSON array in the body of x
+def iter_array(x, max_bytes=MAX_RESPONSE_BYTES, chunk_size=CHUNK_SIZE):
+    check_size(x, max_bytes)
+    return _items(_chunks(x, max_bytes, chunk_size))
+
+
+# Raises ResponseTooLarge if the declared size of the body of x is larger than max_bytes
+def check_size(x, max_bytes=MAX_RESPONSE_BYTES):
+    length = x.headers.get('Content-Length')
+    if length is not None and length.isdigit() and int(length) > max_bytes:
+        _close(x)
+        raise ResponseTooLarge('The response of {} is too large ({} bytes)'.format(x.url, length))
+
+
+# Text of the body, a chunk at a time, counting the bytes read
+def _chunks(x, max_bytes, chunk_size):
+    decoder = codecs.getincrementaldecoder(x.encoding or 'utf-8')()
+    if x._content is False:
+        body = x.iter_content(chunk_size)
+    else:
+        # Already read, e.g. a response from the cache
+        body = (x.content[i:i + chunk_size] for i in range(0, len(x.content), chunk_size))
+
+    size = 0
+    try:
+        for chunk in body:
+            size += len(chunk)
+            if size > max_bytes:
+                raise ResponseTooLarge('The response of {} is larger than {} bytes'.format(x.url, max_bytes))
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+    finally:
+        # Gives the connection back to the pool even if the decoding stops halfway
+        _close(x)
+
+
+def _close(x):
+    if x.raw is not None:
+        x.close()
+
+
+def _items(chunks):
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    started = False
+
+    # Reads the next chunk of text, dropping what has already been decoded
+    def more():
+        nonlocal buf, pos, eof
+        text = next(chunks, None)
+        if text is None:
+            eof = True
+        else:
+            buf = buf[pos:] + text
+            pos = 0
+
+    # Next non whitespace char from pos, reading more text if needed ('' at the end of the body)
+    def peek():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                return buf[pos:pos + 1]
+            more()
+
+    while True:
+        c = peek()
+        if not started:
+            if c != '[':
+                raise ValueError('The response is not a JSON array')
+            pos += 1
+            started = True
+            if peek() == ']':
+                return
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more()
+            continue
+
+        # An item at the end of the text may be incomplete (e.g. a number), it's
+        # only taken once the following separator has been read
+        after = end
+        while after < len(buf) and buf[after] in _WHITESPACE:
+            after += 1
+        if after == len(buf) and not eof:
+            more()
+            continue
+
+        yield item
+        pos = after
+        c = peek()
+        if c == ',':
+            pos += 1
+        elif c == ']':
+            return
+        else:
+            raise ValueError('Malformed JSON array at char {}'.format(pos))
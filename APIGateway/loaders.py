@@ -0,0 +1,150 @@
+# Per-request batching loaders, in the style of DataLoader.
+# While handling a request the views declare the ids they need (want), then a single
+# dispatch resolves all of them: duplicates are dropped and every service gets one bulk
+# call. Services without a bulk endpoint are called once per id, a few ids at a time.
+#
+# A bulk endpoint receives the comma separated ids and answers with an object
+# that maps each id to its item, e.g. GET /users?ids=1,2 -> {"1": {...}, "2": {...}}
+import time
+
+import requests
+from flask import g
+
+from APIGateway.client import client
+from APIGateway.urls import USER_URL, REACTION_URL
+
+# Single calls made at the same time by a loader without bulk endpoint
+MAX_CONCURRENCY = 8
+
+# Seconds a loader whose bulk endpoint turned out not to exist goes straight to single
+# calls, before trying the bulk endpoint again (the service may have been updated)
+NO_BULK_RETRY = 300
+
+# Loader name -> time until which its bulk endpoint is skipped
+_NO_BULK = {}
+
+
+# A ConnectionError, so the views handle it with the usual service_not_up() path
+class ServiceError(requests.exceptions.ConnectionError):
+    pass
+
+
+class BatchLoader:
+
+    def __init__(self, name, single_url, bulk_url=None, max_concurrency=MAX_CONCURRENCY):
+        self.name = name
+        self.single_url = single_url
+        self.bulk_url = bulk_url
+        self.max_concurrency = max_concurrency
+        self._pending = []
+        self._results = {}
+        self._errors = {}
+
+    # Declares the ids that will be needed, without calling the service yet
+    def want(self, *keys):
+        self._pending.extend(keys)
+
+    # Item of key (None if the service doesn't have it), raises the error of its call if it failed
+    def get(self, key):
+        self.want(key)
+        self.dispatch()
+        if key in self._errors:
+            raise self._errors[key]
+        return self._results.get(key)
+
+    def get_many(self, keys):
+        self.want(*keys)
+        self.dispatch()
+        return {key: self.get(key) for key in keys}
+
+    def dispatch(self):
+        dispatch_all(self)
+
+    # Starts the calls for the pending ids, see dispatch_all
+    def _start(self):
+        keys = [k for k in dict.fromkeys(self._pending) if k not in self._results and k not in self._errors]
+        self._pending = []
+        if not keys:
+            return None
+
+        # A single id goes to the single endpoint, whose responses can be cached
+        if self.bulk_url is not None and _NO_BULK.get(self.name, 0) <= time.time() and len(keys) > 1:
+            ids = ','.join(str(k) for k in keys)
+            return keys, client.submit('GET', self.bulk_url.format(ids)), []
+        return keys, None, self._submit_singles(keys[:self.max_concurrency])
+
+    def _finish(self, started):
+        keys, bulk, singles = started
+        if bulk is not None:
+            try:
+                x = bulk.result()
+            except requests.exceptions.RequestException as e:
+                self._errors.update(dict.fromkeys(keys, e))
+                return
+
+            if x.status_code >= 500 and x.status_code != 501:
+                error = ServiceError('{} answered {} to {}'.format(self.name, x.status_code, x.url))
+                self._errors.update(dict.fromkeys(keys, error))
+                return
+
+            body = _json(x) if x.status_code == 200 else None
+            if isinstance(body, dict):
+                for key in keys:
+                    self._results[key] = body.get(str(key))
+                return
+
+            # No bulk endpoint (or one that ignores ids, e.g. a plain list of all the users):
+            # fall back to the single calls for a while
+            if x.status_code in (200, 404, 405, 501):
+                _NO_BULK[self.name] = time.time() + NO_BULK_RETRY
+            singles = self._submit_singles(keys[:self.max_concurrency])
+
+        self._collect(keys[:self.max_concurrency], singles)
+        for i in range(self.max_concurrency, len(keys), self.max_concurrency):
+            chunk = keys[i:i + self.max_concurrency]
+            self._collect(chunk, self._submit_singles(chunk))
+
+    def _submit_singles(self, keys):
+        return [client.submit('GET', self.single_url.format(key)) for key in keys]
+
+    def _collect(self, keys, futures):
+        for key, future in zip(keys, futures):
+            try:
+                x = future.result()
+            except requests.exceptions.RequestException as e:
+                self._errors[key] = e
+                continue
+            self._results[key] = x.json() if x.status_code < 300 else None
+
+
+def _json(x):
+    try:
+        return x.json()
+    except ValueError:
+        return None
+
+
+# Resolves the pending ids of all the given loaders, with their calls running at the same time
+def dispatch_all(*loaders):
+    started = [(loader, loader._start()) for loader in loaders]
+    for loader, calls in started:
+        if calls is not None:
+            loader._finish(calls)
+
+
+# Loaders of the current request
+
+def users():
+    return _loader('users', USER_URL + '/users/{}', USER_URL + '/users?ids={}')
+
+
+def reaction_stats():
+    return _loader('reaction_stats', REACTION_URL + '/reactions/stats/{}', REACTION_URL + '/reactions/stats?ids={}')
+
+
+def _loader(name, single_url, bulk_url):
+    if 'loaders' not in g:
+        g.loaders = {}
+    if name not in g.loaders:
+        g.loaders[name] = BatchLoader(name, single_url, bulk_url)
+    return g.loaders[name]
@@ -0,0 +1,49 @@
+# Cursor (keyset) pagination of the list pages.
+# The gateway passes limit and cursor on to the microservices, which answer with one page of
+# the list, ordered by id or date, and put the cursors of the next and previous pages in the
+# NEXT_HEADER and PREV_HEADER headers. A cursor is opaque to the gateway: it only moves it
+# from those headers to the links of the page and back to the service.
+from urllib.parse import urlencode
+
+from flask import current_app, request, url_for
+
+# Default values, they can be overridden with the GATEWAY_PAGE_SIZE* keys of the Flask config
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+NEXT_HEADER = 'X-Next-Cursor'
+PREV_HEADER = 'X-Prev-Cursor'
+
+
+def init_app(app):
+    app.config.setdefault('GATEWAY_PAGE_SIZE', PAGE_SIZE)
+    app.config.setdefault('GATEWAY_MAX_PAGE_SIZE', MAX_PAGE_SIZE)
+
+
+# limit and cursor of the page asked by the incoming request
+def page_args():
+    limit = request.args.get('limit', type=int)
+    if limit is None or limit < 1:
+        limit = current_app.config['GATEWAY_PAGE_SIZE']
+    limit = min(limit, current_app.config['GATEWAY_MAX_PAGE_SIZE'])
+    return limit, request.args.get('cursor')
+
+
+# url of a microservice list, with the page asked by the incoming request
+def paged(url):
+    limit, cursor = page_args()
+    query = {'limit': limit}
+    if cursor:
+        query['cursor'] = cursor
+    return url + ('&' if '?' in url else '?') + urlencode(query)
+
+
+# Links to the next and previous pages, from the cursors in the response x of the microservice
+def page_links(x):
+    links = {}
+    args = dict(request.view_args or {}, **request.args.to_dict())
+    for rel, header in (('next', NEXT_HEADER), ('prev', PREV_HEADER)):
+        cursor = x.headers.get(header) if x is not None else None
+        if cursor:
+            links[rel] = url_for(request.endpoint, **dict(args, cursor=cursor))
+    return links
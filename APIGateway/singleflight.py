@@ -0,0 +1,155 @@
+# Single-flight coalescing of identical GETs to the microservices.
+# When the same GET is already in flight in this process, the new callers wait for it
+# and share its response instead of sending their own. With a Redis url, a short lock
+# extends this across the gateway workers: only the worker holding it calls the service,
+# the others wait for the response it publishes. A waiting caller gives up when the deadline
+# of its own request expires, whatever the caller it waits for has left.
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+import redis
+
+from APIGateway import deadline
+from APIGateway.cache import to_entry, to_response, dumps_entry, loads_entry, run_blocking
+
+# Default values, they can be overridden with the GATEWAY_SINGLE_FLIGHT_* keys of the Flask config
+REDIS_URL = None
+# Seconds a worker holds the Redis lock at most, and so the most the others wait for it
+LOCK_TTL = 5
+# Seconds the published response stays in Redis for the workers that are waiting
+RESULT_TTL = 1
+POLL_INTERVAL = 0.01
+# Socket timeout of the Redis calls, and seconds Redis is left alone after an error
+REDIS_TIMEOUT = 0.05
+REDIS_RETRY_AFTER = 30
+
+KEY_PREFIX = 'gateway:flight:'
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self, redis_url=REDIS_URL, lock_ttl=LOCK_TTL):
+        self.lock_ttl = lock_ttl
+        self.redis = None
+        if redis_url:
+            self.redis = redis.Redis.from_url(redis_url, socket_timeout=REDIS_TIMEOUT,
+                                              socket_connect_timeout=REDIS_TIMEOUT)
+        self._redis_down_until = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'flights': 0, 'coalesced': 0, 'remote_coalesced': 0}
+        # How a waiting caller blocks, replaced by the client when it runs on the asyncio runtime
+        self.wait_event = threading.Event.wait
+        self.sleep = time.sleep
+        self.run_blocking = run_blocking
+
+    # Key of a GET: the url plus the parameters and headers that change its response
+    @staticmethod
+    def key(url, params=None, headers=None):
+        return json.dumps([url, params, sorted((headers or {}).items())], sort_keys=True, default=str)
+
+    # Calls func() unless a call with the same key is in flight, in that case its response is shared
+    def do(self, key, url, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats['flights'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            if not self.wait_event(call.done, _left()):
+                raise deadline.DeadlineExceeded('The deadline of the request expired waiting for the call in flight')
+            if call.error is not None:
+                raise call.error
+            return to_response(call.result, url)
+
+        try:
+            x = self._lead(key, url, func)
+            call.result = to_entry(x)
+            return x
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _lead(self, key, url, func):
+        if self.redis is None or time.time() < self._redis_down_until:
+            return func()
+
+        rkey = KEY_PREFIX + hashlib.sha1(key.encode('utf-8')).hexdigest()
+        token = uuid.uuid4().hex
+        try:
+            acquired = self.run_blocking(self.redis.set, rkey + ':lock', token, nx=True, px=int(self.lock_ttl * 1000))
+            if acquired:
+                self.run_blocking(self.redis.delete, rkey + ':result')
+        except redis.RedisError:
+            self._redis_failed()
+            return func()
+
+        if acquired:
+            try:
+                x = func()
+                if x.status_code < 500:
+                    self.run_blocking(self.redis.set, rkey + ':result', dumps_entry(to_entry(x)), px=int(RESULT_TTL * 1000))
+                return x
+            except redis.RedisError:
+                self._redis_failed()
+                return x
+            finally:
+                self._release(rkey + ':lock', token)
+
+        # Another worker is calling the service: wait for the response it publishes. Once the deadline
+        # has expired, func() raises DeadlineExceeded
+        left = _left()
+        end = time.time() + (self.lock_ttl if left is None else min(self.lock_ttl, left))
+        try:
+            while time.time() < end:
+                data = self.run_blocking(self.redis.get, rkey + ':result')
+                if data is not None:
+                    with self._lock:
+                        self._stats['remote_coalesced'] += 1
+                    return to_response(loads_entry(data), url)
+                if not self.run_blocking(self.redis.exists, rkey + ':lock'):
+                    break
+                self.sleep(POLL_INTERVAL)
+        except redis.RedisError:
+            self._redis_failed()
+        return func()
+
+    # Deletes the lock only if it's still ours
+    def _release(self, lock_key, token):
+        try:
+            if self.run_blocking(self.redis.get, lock_key) == token.encode('utf-8'):
+                self.run_blocking(self.redis.delete, lock_key)
+        except redis.RedisError:
+            self._redis_failed()
+
+    def _redis_failed(self):
+        self._redis_down_until = time.time() + REDIS_RETRY_AFTER
+
+
+# Seconds the caller may wait for, None without a deadline
+def _left():
+    left = deadline.remaining()
+    return None if left is None else max(left, 0)
@@ -0,0 +1,104 @@
+# Swagger specs of the blueprints, parsed once per version of the YAML file.
+# flakon's SwaggerBlueprint loads and validates its YAML every time a process starts. The
+# SwaggerBlueprint here keeps the parsed and validated specification in SPEC_CACHE_DIR, as
+# JSON named by the hash of the YAML: a process started with the same file only reads the
+# JSON. A changed file has another hash, so it's parsed and validated again.
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import yaml
+from flakon import SwaggerBlueprint as FlakonSwaggerBlueprint
+from flakon.blueprints import JsonBlueprint
+from swagger_parser import SwaggerParser
+
+from APIGateway.templating import private_dir, user_dir
+
+# The blueprints are built at import time, before the Flask config: the directory can be
+# changed with the GATEWAY_SPEC_CACHE_DIR environment variable ('' turns the cache off). Like
+# the template cache it must be a private directory of the user, otherwise it isn't used
+SPEC_CACHE_DIR = os.environ.get('GATEWAY_SPEC_CACHE_DIR', user_dir('gateway-specs'))
+# Part of the key, to be changed with what is kept in the cached files
+SPEC_CACHE_VERSION = b'1'
+
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class SpecStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load_time = 0
+
+    def add(self, hit, seconds):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.load_time += seconds
+
+    def to_dict(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'load_time': self.load_time}
+
+
+stats = SpecStats()
+
+
+# Like flakon's SwaggerBlueprint, with the specification read from the cache (and no _parser)
+class SwaggerBlueprint(FlakonSwaggerBlueprint):
+
+    def __init__(self, name, import_name, swagger_spec, **kwargs):
+        JsonBlueprint.__init__(self, name, import_name, **kwargs)
+        self.spec = load_spec(swagger_spec)
+        self._content = self.spec
+        self.ops = self._get_operations()
+
+
+# Parsed and validated specification of the YAML file at path
+def load_spec(path, cache_dir=None):
+    cache_dir = SPEC_CACHE_DIR if cache_dir is None else cache_dir
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    cached = None
+    if cache_dir and private_dir(cache_dir):
+        key = hashlib.sha256(SPEC_CACHE_VERSION + b'\0' + data).hexdigest()
+        cached = os.path.join(cache_dir, '{}-{}.json'.format(os.path.basename(path), key[:16]))
+        try:
+            with open(cached) as f:
+                spec = json.load(f)
+            stats.add(True, time.perf_counter() - start)
+            return spec
+        except (OSError, ValueError):
+            pass
+
+    # Raises ValueError if the spec isn't valid
+    spec = SwaggerParser(swagger_dict=yaml.load(data, Loader=_Loader)).specification
+    if cached is not None:
+        _write(cached, spec)
+    stats.add(False, time.perf_counter() - start)
+    return spec
+
+
+# Written to a temporary file renamed into place, another process never reads it half written
+def _write(filename, spec):
+    directory = os.path.dirname(filename)
+    try:
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(spec, f)
+        os.replace(tmp, filename)
+    except (OSError, TypeError, ValueError):
+        # Not writable, or not JSON (e.g. a date in the YAML): it's parsed at every start
+        os.remove(tmp)
@@ -0,0 +1,73 @@
+# Streaming rendering of the list pages.
+# The page is sent while it's being rendered, a chunk every STREAM_BUFFER pieces of template
+# output: the first bytes leave the gateway before the whole list is turned into HTML, and
+# the page never sits in memory as one big string. The items can be given as an iterator,
+# so they are consumed one at a time while the page is written.
+import itertools
+from collections.abc import Iterator
+
+import requests
+from flask import current_app, render_template, Response, stream_with_context, get_flashed_messages
+from flask.signals import before_render_template, template_rendered
+from flask_login import current_user
+
+from APIGateway.urls import service_not_up
+
+# Default values, they can be overridden with the GATEWAY_STREAM_* keys of the Flask config
+STREAM_TEMPLATES = True
+STREAM_BUFFER = 100
+
+# Written at the end of a page whose items stopped coming halfway: the 200 has already
+# been sent, so the page can't be replaced by service_not_up() anymore
+STREAM_ERROR = '<div class="error text-danger" style="text-align: center;">' \
+               'A requested microservice is not up, the list is incomplete</div>'
+
+# Errors of the items read from a microservice (a broken connection, the deadline,
+# ResponseTooLarge or a malformed body)
+ITEM_ERRORS = (requests.exceptions.RequestException, ValueError)
+
+
+def init_app(app):
+    app.config.setdefault('GATEWAY_STREAM_TEMPLATES', STREAM_TEMPLATES)
+    app.config.setdefault('GATEWAY_STREAM_BUFFER', STREAM_BUFFER)
+
+
+# Like render_template, but the page is streamed when GATEWAY_STREAM_TEMPLATES is on
+def render_list(template_name, **context):
+    app = current_app._get_current_object()
+    if not app.config['GATEWAY_STREAM_TEMPLATES']:
+        try:
+            context = {k: list(v) if isinstance(v, Iterator) else v for k, v in context.items()}
+        except ITEM_ERRORS:
+            return service_not_up()
+        return render_template(template_name, **context)
+
+    # The session is saved before the body is sent: what the page takes from it
+    # (the flashed messages and the logged user) is read now, while it can still change
+    get_flashed_messages(with_categories=True)
+    current_user._get_current_object()
+
+    app.update_template_context(context)
+    template = app.jinja_env.get_or_select_template(template_name)
+    before_render_template.send(app, template=template, context=context)
+
+    def generate():
+        stream = template.stream(context)
+        stream.enable_buffering(app.config['GATEWAY_STREAM_BUFFER'])
+        try:
+            yield from stream
+        except ITEM_ERRORS as e:
+            app.logger.warning('The list of %s was cut off: %s', template_name, e)
+            yield STREAM_ERROR
+            return
+        template_rendered.send(app, template=template, context=context)
+
+    return Response(stream_with_context(generate()), mimetype='text/html')
+
+
+# Whether items is empty, and an iterator over all of them, without consuming the iterator
+def peek(items):
+    items = iter(items)
+    for first in items:
+        return False, itertools.chain([first], items)
+    return True, iter(())
@@ -1,20 +1,401 @@
+import datetime
+import glob
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
 import requests
-from celery import Celery
 
-from APIGateway.urls import HOME_URL, REACTION_PORT
+from APIGateway.client import client
+from APIGateway.templating import private_dir, user_dir
+from APIGateway.urls import REACTION_URL
 
 _APP = None
 
+logger = logging.getLogger(__name__)
+
 BACKEND = BROKER = 'redis://localhost:6379'
-celery = Celery(__name__, backend=BACKEND, broker=BROKER)
+# The Celery app is created by get_celery() when the first reaction is queued, or when the
+# worker looks for tasks.celery: a gateway process that never queues one doesn't even import
+# Celery, and doesn't connect to the broker
+_celery = None
+_reaction_task = None
+_celery_lock = threading.Lock()
+
+# Reactions are buffered in the worker and sent to the Reactions service in batches:
+# a batch is flushed when it has BATCH_SIZE reactions or BATCH_WINDOW seconds after its first one
+BATCH_SIZE = 50
+BATCH_WINDOW = 0.5
+BATCH_URL = REACTION_URL + '/react/batch'
+
+# Failed deliveries are retried MAX_RETRIES times, waiting a random time up to
+# RETRY_BACKOFF * 2^retry seconds (at most RETRY_BACKOFF_MAX) so that the retries
+# of many reactions don't hit the service all together
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1
+RETRY_BACKOFF_MAX = 60
+# Seconds after which a queued reaction is dropped instead of delivered, so that
+# the backlog of an outage doesn't replay stale reactions
+TASK_EXPIRES = 300
+
+# Reactions are handed to the broker by a background thread, so a request never waits for it.
+# While the broker can't be reached they are appended to SPOOL_PATH, with the time they were
+# queued at, and replayed once it's back: the ones older than TASK_EXPIRES are dropped. Like the
+# template cache, the directory of the spool must be a private directory of the user: otherwise
+# reactions are dropped instead of spooled, and nothing found there is replayed
+SPOOL_PATH = os.path.join(user_dir('gateway-reactions'), 'reactions.spool')
+# Seconds the broker is left alone after an error, before the spool is replayed
+SPOOL_RETRY = 5
+# Reactions waiting for the background thread at most, the others go straight to the spool
+PUBLISH_QUEUE_SIZE = 1000
+
+
+# The Reactions service was unreachable, too slow or failing: the delivery can be retried
+class RetryableError(Exception):
+    pass
+
+
+class ReactionBuffer:
+
+    def __init__(self, size=BATCH_SIZE, window=BATCH_WINDOW):
+        self.size = size
+        self.window = window
+        # False once the service has shown it has no batch endpoint, then reactions are sent one by one
+        self.batch_supported = True
+        self.stats = {'reactions': 0, 'duplicates': 0, 'batches': 0, 'single': 0}
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # (story, user, reaction) -> (reaction, attempt), the same reaction twice in a window is sent once
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, data, attempt=0):
+        # Threads and locks don't survive the fork of the worker processes
+        if self._pid != os.getpid():
+            self._reset()
+
+        key = (data['story_id'], data['current_user'], data['reaction_caption'])
+        with self._lock:
+            self.stats['reactions'] += 1
+            if key in self._pending:
+                self.stats['duplicates'] += 1
+                return
+            self._pending[key] = (data, attempt)
+            full = len(self._pending) >= self.size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    # Sends the buffered reactions
+    def flush(self):
+        with self._lock:
+            reactions = list(self._pending.values())
+            self._pending = {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if reactions:
+            self._send(reactions)
+
+    def _send(self, reactions):
+        if self.batch_supported and len(reactions) > 1:
+            try:
+                x = client.post(BATCH_URL, json={'reactions': [data for data, _ in reactions]})
+                if _retryable(x):
+                    raise RetryableError('Reaction batch failed with {}'.format(x.status_code))
+            except (requests.exceptions.RequestException, RetryableError) as e:
+                for data, attempt in reactions:
+                    retry_later(data, attempt, e)
+                return
+            if x.status_code < 400:
+                self.stats['batches'] += 1
+                return
+            if x.status_code in (404, 405, 501):
+                self.batch_supported = False
+            else:
+                # The batch was refused as a whole (e.g. a 400 or 422): its reactions are sent one by
+                # one, so that a bad reaction doesn't take the others with it
+                logger.warning('Reaction batch refused with %s, its reactions are sent one by one', x.status_code)
+
+        for data, attempt in reactions:
+            try:
+                send_reaction(data)
+            except (requests.exceptions.RequestException, RetryableError) as e:
+                retry_later(data, attempt, e)
+            self.stats['single'] += 1
+
+
+reactions = ReactionBuffer()
+
+
+class ReactionPublisher:
+
+    def __init__(self, spool_path=SPOOL_PATH, retry_after=SPOOL_RETRY, queue_size=PUBLISH_QUEUE_SIZE):
+        self.spool_path = spool_path
+        self.retry_after = retry_after
+        self.queue_size = queue_size
+        self.broker_down_until = 0
+        self.stats = {'published': 0, 'spooled': 0, 'replayed': 0, 'expired': 0, 'dropped': 0}
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+
+    # Queues reaction_task(*args, **kwargs) without blocking
+    def enqueue(self, args, kwargs=None, countdown=None):
+        self.start()
+        try:
+            self._queue.put_nowait((args, kwargs or {}, countdown, time.time()))
+        except queue.Full:
+            self._spool(args, kwargs or {}, time.time())
+
+    # Starts the background thread, again in a forked process since threads don't survive the fork,
+    # or if it has stopped
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue(self.queue_size)
+            self._thread = threading.Thread(target=self._run, name='reaction-publisher', daemon=True)
+            self._thread.start()
+
+    # An unexpected error loses at most the reaction at hand, the thread keeps going
+    def _run(self):
+        try:
+            self.recover()
+        except Exception:
+            logger.exception('Could not recover the spooled reactions')
+        while True:
+            try:
+                self._publish_next()
+            except Exception:
+                logger.exception('Reaction publisher failed')
+
+    def _publish_next(self):
+        try:
+            self.publish(*self._queue.get(timeout=self.retry_after))
+        except queue.Empty:
+            pass
+        if time.time() >= self.broker_down_until:
+            self.replay()
+
+    # Sends a reaction queued at queued_at (by default now) to the broker, it goes to the spool if
+    # the broker isn't available. It expires TASK_EXPIRES seconds after it was queued, not published
+    def publish(self, args, kwargs, countdown=None, queued_at=None):
+        queued_at = time.time() if queued_at is None else queued_at
+        expires = queued_at + TASK_EXPIRES
+        if expires <= time.time():
+            logger.warning('Reaction %s expired before reaching the broker', args)
+            self.stats['expired'] += 1
+            return False
+        if time.time() < self.broker_down_until:
+            self._spool(args, kwargs, queued_at)
+            return False
+        try:
+            get_reaction_task().apply_async(args, kwargs, countdown=countdown, retry=False,
+                                            expires=datetime.datetime.fromtimestamp(expires, datetime.timezone.utc))
+        except _broker_errors() as e:
+            logger.warning('Broker not available, reactions are spooled: %s', e)
+            self.broker_down_until = time.time() + self.retry_after
+            self._spool(args, kwargs, queued_at)
+            return False
+        self.stats['published'] += 1
+        return True
+
+    # Sends the spooled reactions to the broker, returns how many of them made it
+    def replay(self):
+        if not self._private():
+            return 0
+        replay_path = '{}.{}.replay'.format(self.spool_path, os.getpid())
+        # The spool is moved away first, so the reactions spooled meanwhile go to a new one
+        # and a single process replays each reaction
+        with self._spool_lock:
+            try:
+                os.rename(self.spool_path, replay_path)
+            except FileNotFoundError:
+                return 0
+
+        return self._replay_file(replay_path)
+
+    # Replays the files left by processes that stopped halfway through a replay (the ones of
+    # processes that are gone, or with the pid of this one, which isn't replaying yet)
+    def recover(self):
+        if not self._private():
+            return 0
+        replayed = 0
+        for path in glob.glob(glob.escape(self.spool_path) + '.*.replay'):
+            pid = path[len(self.spool_path) + 1:-len('.replay')].split('-')[0]
+            if not pid.isdigit() or (int(pid) != os.getpid() and _alive(int(pid))):
+                continue
+            # Renamed first, so that a single process takes it
+            claimed = '{}.{}-{}.replay'.format(self.spool_path, os.getpid(), uuid.uuid4().hex)
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            replayed += self._replay_file(claimed)
+        return replayed
+
+    # A line that can't be read (e.g. cut short by a crash while it was written) or published is
+    # logged and skipped, so that it doesn't hold back the others
+    def _replay_file(self, path):
+        replayed = 0
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.error('Spooled reaction %r dropped, it could not be read', line)
+                    continue
+                # Lines spooled before the time was saved have only args and kwargs
+                queued_at = entry[2] if len(entry) > 2 else None
+                try:
+                    if self.publish(entry[0], entry[1], queued_at=queued_at):
+                        replayed += 1
+                except Exception:
+                    logger.exception('Spooled reaction %s dropped', entry)
+        os.remove(path)
+        self.stats['replayed'] += replayed
+        return replayed
+
+    def _spool(self, args, kwargs, queued_at):
+        if not self._private():
+            logger.error('Reaction %s dropped, the spool directory of %s is not private', args, self.spool_path)
+            self.stats['dropped'] += 1
+            return
+        line = json.dumps([list(args), kwargs, queued_at]) + '\n'
+        with self._spool_lock:
+            fd = os.open(self.spool_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            with os.fdopen(fd, 'a') as f:
+                f.write(line)
+        self.stats['spooled'] += 1
 
+    def _private(self):
+        return private_dir(os.path.dirname(os.path.abspath(self.spool_path)))
 
-@celery.task
-def reaction_task(id_story, reaction_caption, id_user):
+
+publisher = ReactionPublisher()
+
+
+# Used by the views to queue a reaction, it never waits for the broker
+def queue_reaction(id_story, reaction_caption, id_user):
+    publisher.enqueue((id_story, reaction_caption, id_user))
+
+
+# The Celery app of the reactions, with its task and the signals of the worker
+def get_celery():
+    global _celery, _reaction_task
+    with _celery_lock:
+        if _celery is None:
+            from celery import Celery
+            from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+
+            app = Celery(__name__, backend=BACKEND, broker=BROKER)
+            # Nobody reads the outcome of a reaction, so results aren't stored: a caller that needs
+            # it can ask with apply_async(ignore_result=False)
+            _reaction_task = app.task(bind=True, ignore_result=True, expires=TASK_EXPIRES,
+                                      name=__name__ + '.reaction_task')(_deliver_reaction)
+            worker_process_init.connect(_new_pools, weak=False)
+            worker_process_shutdown.connect(_flush_reactions, weak=False)
+            worker_shutdown.connect(_flush_reactions, weak=False)
+            _celery = app
+    return _celery
+
+
+def get_reaction_task():
+    get_celery()
+    return _reaction_task
+
+
+# tasks.celery (what the worker looks for) and tasks.reaction_task create the app on first use
+def __getattr__(name):
+    if name == 'celery':
+        return get_celery()
+    if name == 'reaction_task':
+        return get_reaction_task()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Errors of a broker that can't be reached, imported only once a reaction is published
+def _broker_errors():
+    import redis
+    from kombu.exceptions import OperationalError
+
+    return OperationalError, redis.RedisError, OSError
+
+
+# Each worker process gets its own connection pools, the ones created before the fork can't be shared
+def _new_pools(**kwargs):
+    client.configure(client.pool_size, client.keep_alive, client.timeouts)
+
+
+def _flush_reactions(**kwargs):
+    reactions.flush()
+
+
+def send_reaction(data):
+    x = client.post(REACTION_URL + "/react", json=data)
+    if _retryable(x):
+        raise RetryableError('Reaction failed with {}'.format(x.status_code))
+    return (x.json())['description']
+
+
+def _retryable(x):
+    return x.status_code >= 500 and x.status_code != 501
+
+
+# Random wait before the given retry, with exponential backoff and full jitter
+def backoff(retry):
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** retry))
+
+
+# Queues again a reaction whose delivery failed, or drops it after MAX_RETRIES retries
+def retry_later(data, attempt, error):
+    if attempt >= MAX_RETRIES:
+        logger.error('Reaction %s dropped after %d attempts: %s', data, attempt + 1, error)
+        return
+    publisher.enqueue((data['story_id'], data['reaction_caption'], data['current_user']),
+                      {'attempt': attempt + 1}, countdown=backoff(attempt))
+
+
+# Body of reaction_task, registered by get_celery()
+def _deliver_reaction(self, id_story, reaction_caption, id_user, attempt=0):
     data = {"story_id": id_story, "reaction_caption": reaction_caption, "current_user": id_user}
 
-    x = requests.post(HOME_URL + REACTION_PORT + "/react", json=data)
-    if x.status_code == 500:
+    # With batches of one there is nothing to wait for, the reaction is sent at once
+    if reactions.size > 1:
+        reactions.add(data, attempt)
         return None
-    else:
-        return (x.json())['description']
+
+    attempt += self.request.retries
+    try:
+        return send_reaction(data)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, RetryableError) as e:
+        if attempt >= MAX_RETRIES:
+            logger.error('Reaction %s dropped after %d attempts: %s', data, attempt + 1, e)
+            return None
+        raise self.retry(exc=e, countdown=backoff(attempt), max_retries=None)
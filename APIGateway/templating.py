@@ -0,0 +1,154 @@
+# Compiled templates of the gateway.
+# The bytecode of the compiled templates is kept on disk, in GATEWAY_TEMPLATE_CACHE_DIR, and
+# shared by all the workers: a template is compiled once per change of its source, not once
+# per process. All the templates are compiled when the app is created (or before the deploy,
+# with python -m APIGateway.templating), so no request pays for it. The time spent compiling
+# and rendering every template is counted in stats, shown by the status operation.
+import getpass
+import os
+import stat
+import tempfile
+import threading
+import time
+
+from flask import g
+from flask.signals import before_render_template, template_rendered
+from flask.templating import Environment as FlaskEnvironment
+from jinja2 import FileSystemBytecodeCache
+
+# Default values, they can be overridden with the GATEWAY_TEMPLATE_* keys of the Flask config.
+# The cache directory defaults to a private directory of the user, see user_dir
+TEMPLATE_CACHE_DIR = None
+TEMPLATE_PRECOMPILE = True
+
+
+class TemplateStats:
+
+    FIELDS = ['compiles', 'compile_time', 'bytecode_hits', 'renders', 'render_time']
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def add(self, name, field, value=1):
+        with self._lock:
+            counters = self._counters.setdefault(name, dict.fromkeys(self.FIELDS, 0))
+            counters[field] += value
+
+    def to_dict(self):
+        with self._lock:
+            return {name: dict(counters) for name, counters in self._counters.items()}
+
+    def clear(self):
+        with self._lock:
+            self._counters = {}
+
+
+stats = TemplateStats()
+
+
+# The Jinja environment of the app, timing the compilation of the templates
+class Environment(FlaskEnvironment):
+
+    def compile(self, source, name=None, filename=None, raw=False, defer_init=False):
+        start = time.perf_counter()
+        try:
+            return super().compile(source, name, filename, raw, defer_init)
+        finally:
+            if name is not None:
+                stats.add(name, 'compile_time', time.perf_counter() - start)
+                stats.add(name, 'compiles')
+
+
+# Bytecode on disk, written atomically: a worker never reads the half written file of another one
+class BytecodeCache(FileSystemBytecodeCache):
+
+    def get_bucket(self, environment, name, filename, source):
+        bucket = super().get_bucket(environment, name, filename, source)
+        if bucket.code is not None:
+            stats.add(name, 'bytecode_hits')
+        return bucket
+
+    def dump_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp, filename)
+        except OSError:
+            # The cache is only an optimization, the template is used anyway
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+# Must be called before anything uses app.jinja_env, which is created with the class set here
+def init_app(app):
+    app.config.setdefault('GATEWAY_TEMPLATE_CACHE_DIR', TEMPLATE_CACHE_DIR or user_dir('gateway-templates'))
+    app.config.setdefault('GATEWAY_TEMPLATE_PRECOMPILE', TEMPLATE_PRECOMPILE)
+    app.jinja_environment = Environment
+
+    directory = app.config['GATEWAY_TEMPLATE_CACHE_DIR']
+    if directory and not private_dir(directory):
+        app.logger.warning('The template cache is off, %s is not a private directory of this user', directory)
+    elif directory:
+        app.jinja_env.bytecode_cache = BytecodeCache(directory)
+
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+
+    if app.config['GATEWAY_TEMPLATE_PRECOMPILE']:
+        precompile(app)
+
+
+# Directory of this user in the temp directory, e.g. /tmp/gateway-templates-1000
+def user_dir(name):
+    user = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+    return os.path.join(tempfile.gettempdir(), '{}-{}'.format(name, user))
+
+
+# Creates path if needed, then checks that only this user can use it: the bytecode in the
+# cache is executed, like Jinja's default cache directory it must be 0700 and ours
+def private_dir(path):
+    try:
+        os.makedirs(path, mode=stat.S_IRWXU, exist_ok=True)
+        info = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(info.st_mode):
+        return False
+    if hasattr(os, 'getuid'):
+        if info.st_uid != os.getuid():
+            return False
+        if stat.S_IMODE(info.st_mode) != stat.S_IRWXU:
+            try:
+                os.chmod(path, stat.S_IRWXU)
+            except OSError:
+                return False
+    return True
+
+
+# Loads every template of app, compiling the ones not in the bytecode cache
+def precompile(app):
+    names = app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html'))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+def _render_started(app, template, context):
+    g.setdefault('_template_render_start', {})[template.name] = time.perf_counter()
+
+
+def _render_finished(app, template, context):
+    start = g.get('_template_render_start', {}).pop(template.name, None)
+    if start is not None:
+        stats.add(template.name, 'render_time', time.perf_counter() - start)
+        stats.add(template.name, 'renders')
+
+
+if __name__ == '__main__':
+    # Creating the app compiles the templates into the cache
+    from APIGateway.app import app
+
+    print('{} templates compiled in {}'.format(len(precompile(app)), app.config['GATEWAY_TEMPLATE_CACHE_DIR']))
@@ -1,16 +1,22 @@
 import json
 
 import requests
-from flakon import SwaggerBlueprint
 from flask import render_template, request
 from flask_login import current_user, logout_user, login_required, login_user
 
-from APIGateway.classes.User import User
+from APIGateway import templating
+from APIGateway.auth import user_from_body, store_identity, clear_identity
+from APIGateway.client import client
 from APIGateway.forms import UserForm, LoginForm
+from APIGateway.specs import SwaggerBlueprint
+from APIGateway.streaming import ITEM_ERRORS
 from APIGateway.urls import *
 
 authapi = SwaggerBlueprint('gateway', '__name__', swagger_spec=os.path.join(YML_PATH, 'auth-api.yaml'))
 
+# Seconds the search page waits for the users and stories searches
+SEARCH_TIMEOUT = 3
+
 
 # Renders the Home page (index.html).
 # It renders different data, depending whether an user is logged or not.
@@ -19,13 +25,18 @@ def _home():
     # Stories is an empty list, so it can be iterated in the HTML
     stories = []
 
-    # If there's a logged user, we get his stories
+    # If there's a logged user, we get his stories, decoded a chunk at a time up to
+    # GATEWAY_MAX_RESPONSE_BYTES. This is where service_not_up() redirects, so with the
+    # Stories service down (or its breaker open) the page is shown without them
     if current_user is not None and hasattr(current_user, 'id'):
-        s = requests.get(STORY_URL + '/stories/users/{}'.format(current_user.id))
+        try:
+            s = client.get(STORY_URL + '/stories/users/{}'.format(current_user.id), stream=True)
 
-        if check_service_up(s):
-            if s.status_code < 300:
-                stories = s.json()
+            if check_service_up(s):
+                if s.status_code < 300:
+                    stories = list(client.iter_json(s))
+        except ITEM_ERRORS:
+            flash('A requested microservice is not up', 'error')
 
     return render_template("index.html", stories=stories, home_url=GATEWAY_URL)
 
@@ -50,7 +61,7 @@ def _register():
                  "email": form.data['email'],
                  "dateofbirth": str(form.data['dateofbirth'])})
         try:
-            x = requests.post(USER_URL + '/users/create', data=json.dumps(data))
+            x = client.post(USER_URL + '/users/create', data=json.dumps(data))
         except requests.exceptions.ConnectionError:
             return service_not_up()
 
@@ -84,7 +95,7 @@ def _login():
     data = ({"email": form['email'],
              "password": form['password']})
     try:
-        x = requests.post(USER_URL + '/users/login', data=json.dumps(data))
+        x = client.post(USER_URL + '/users/login', data=json.dumps(data))
     except requests.exceptions.ConnectionError:
         return service_not_up()
 
@@ -95,8 +106,9 @@ def _login():
         if x.status_code < 300:
 
             # flask_login requires an instance of a class User, then redirect to the Home
-            user = User(body['id'], body['firstname'], body['lastname'], body['email'])
+            user = user_from_body(body)
             login_user(user)
+            store_identity(user)
             return redirect(url_for('gateway._home'))
 
         # Else flash the returned error and refresh the login page to retry the login
@@ -112,9 +124,19 @@ def _login():
 @login_required
 def _logout():
     logout_user()
+    clear_identity()
     return redirect(url_for("gateway._home"))
 
 
+# State of the gateway for monitoring: pools, caches and circuit breakers of the microservices,
+# compile and render times of the templates
+@authapi.operation('status')
+def _status():
+    return {"breakers": client.breaker_states(), "pools": client.stats(), "cache": client.cache_stats(),
+            "single_flight": client.flights.stats() if client.flights is not None else {},
+            "templates": templating.stats.to_dict()}
+
+
 @authapi.operation('getSearchPage')
 def _get_search():
     return render_template('search.html', home_url=GATEWAY_URL)
@@ -124,34 +146,40 @@ def _get_search():
 def _search():
     form = request.form
     query = form['query']
-    users_data = []
-    stories_data = []
 
-    try:
-        # Search in users
-        users_req = requests.get(USER_URL + '/search?query=' + query)
-        if users_req.status_code != 204 and users_req.status_code < 300:
-            users_data = users_req.json()
-        # Search in stories
-        stories_req = requests.get(STORY_URL + '/search?query=' + query)
-        if stories_req.status_code != 204 and stories_req.status_code < 300:
-            stories_data = stories_req.json()
-    except requests.exceptions.ConnectionError:
-        return service_not_up()
+    # Users and stories are searched at the same time, under a shared deadline
+    users_req = client.submit('GET', USER_URL + '/search?query=' + query, timeout=SEARCH_TIMEOUT, stream=True)
+    stories_req = client.submit('GET', STORY_URL + '/search?query=' + query, timeout=SEARCH_TIMEOUT, stream=True)
+    client.wait([users_req, stories_req], timeout=SEARCH_TIMEOUT)
 
-    ok_response = [200, 204]
+    # If a search is too slow or fails, show what arrived in time and a notice for the rest
+    users_data, users_error = _search_result(users_req, 'users')
+    stories_data, stories_error = _search_result(stories_req, 'stories')
+    for error in (users_error, stories_error):
+        if error is not None:
+            flash(error, 'error')
 
-    # Check if both are succesfull
-    if users_req.status_code == 204 and stories_req.status_code == 204:
+    if users_error is None and stories_error is None and not users_data and not stories_data:
         flash("No match for the searched string", 'error')
-        context_vars = {"list_of_users": users_data, "list_of_stories": stories_data,
-                        "home_url": GATEWAY_URL}
-        return render_template("search.html", **context_vars)
-    elif users_req.status_code not in ok_response or stories_req.status_code not in ok_response:
-        flash(stories_data['description'], 'error')
-        return redirect(url_for('gateway._search'), 304)
-    else:
-        context_vars = {"list_of_users": users_data, "list_of_stories": stories_data,
-                        "home_url": GATEWAY_URL}
-        print(users_data, stories_data)
-        return render_template("search.html", **context_vars)
+
+    context_vars = {"list_of_users": users_data, "list_of_stories": stories_data,
+                    "home_url": GATEWAY_URL}
+    return render_template("search.html", **context_vars)
+
+
+#                   Useful functions
+
+# Results of a search started with client.submit, with an error message if they aren't available.
+# They are decoded a chunk at a time, and at most GATEWAY_MAX_RESPONSE_BYTES of them
+def _search_result(future, name):
+    if not future.done():
+        future.cancel()
+        return [], "The {} search took too long, its results are not shown".format(name)
+
+    try:
+        x = future.result()
+        if x.status_code < 300:
+            return list(client.iter_json(x)), None
+    except ITEM_ERRORS:
+        return [], "The {} search is not available right now".format(name)
+    return [], "The {} search has encountered an error".format(name)
@@ -1,9 +1,11 @@
 import requests
-from flakon import SwaggerBlueprint
 from flask import url_for, redirect, render_template, request, session
 from flask_login import login_required
 from werkzeug.exceptions import BadRequestKeyError
 
+from APIGateway.catalogue import catalogue
+from APIGateway.client import client
+from APIGateway.specs import SwaggerBlueprint
 from APIGateway.urls import *
 
 diceapi = SwaggerBlueprint('dice', '__name__', swagger_spec=os.path.join(YML_PATH, 'dice-api.yaml'))
@@ -13,22 +15,21 @@ diceapi = SwaggerBlueprint('dice', '__name__', swagger_spec=os.path.join(YML_PAT
 @diceapi.operation('getSettingsPage')
 @login_required
 def _get_settings_page():
-    try:
-        x = requests.get(DICE_URL + '/sets')
-    except requests.exceptions.ConnectionError:
-        return service_not_up()
+    # The sets come from the in-memory catalogue, the Dice service is called
+    # only if it has never been reachable since the gateway started
+    sets = catalogue.get()
+    if sets is None:
+        if not catalogue.refresh():
+            return service_not_up()
+        sets = catalogue.sets
 
-    if check_service_up(x):
-        # No dice sets are loaded into the dice microservice
-        if x.status_code == 204:
-            flash("No dice set found. Please contact Jacopo Massa")
-            redirect(url_for('gateway._home'))
-        else:  # status_code < 300 ?
-            sets = x.json()
-            return render_template("settings.html", sets=sets, home_url=GATEWAY_URL)
-    else:
+    # No dice sets are loaded into the dice microservice
+    if not sets:
+        flash("No dice set found. Please contact Jacopo Massa")
         return redirect(url_for('gateway._home'))
 
+    return render_template("settings.html", sets=sets, home_url=GATEWAY_URL)
+
 
 # Renders the Roll page (roll_dice.html) with the rolled dice (set and num of dice previously chosen).
 @diceapi.operation('getRollPage')
@@ -57,7 +58,7 @@ def _get_roll_page():
     # Actually roll the dice
     data = {'dice_number': dice_number}
     try:
-        x = requests.post(DICE_URL + '/sets/{}/roll'.format(id_set), json=data)
+        x = client.post(DICE_URL + '/sets/{}/roll'.format(id_set), json=data)
     except requests.exceptions.ConnectionError:
         return service_not_up()
 
@@ -1,10 +1,14 @@
 import requests
-from flakon import SwaggerBlueprint
-from flask import render_template, request, redirect, url_for, session
+from flask import render_template, request, redirect, url_for, session, jsonify
 from flask_login import login_required, current_user
 
+from APIGateway import loaders
+from APIGateway.pagination import paged, page_links
+from APIGateway.streaming import render_list, peek
+from APIGateway.client import client
 from APIGateway.forms import StoryForm
-from APIGateway.tasks import reaction_task
+from APIGateway.specs import SwaggerBlueprint
+from APIGateway.tasks import queue_reaction
 from APIGateway.urls import *
 
 storiesapi = SwaggerBlueprint('stories', '__name__', swagger_spec=os.path.join(YML_PATH, 'stories-api.yaml'))
@@ -14,31 +18,31 @@ storiesapi = SwaggerBlueprint('stories', '__name__', swagger_spec=os.path.join(Y
 @storiesapi.operation('getAll')
 def _get_all_stories():
     try:
-        x = requests.get(STORY_URL + '/stories')
+        x = client.get(paged(STORY_URL + '/stories'), stream=True)
     except requests.exceptions.ConnectionError:
         return service_not_up()
 
     stories = []
 
     if check_service_up(x):
-        stories = x.json()
+        stories = client.iter_json(x)
 
-    return render_template("stories.html", stories=stories, home_url=GATEWAY_URL)
+    return render_list("stories.html", stories=stories, page=page_links(x), home_url=GATEWAY_URL)
 
 
 # Renders the Stories page (stories.html) with only the last published story for each registered user
 @storiesapi.operation('getLatest')
 def _get_latest():
     try:
-        x = requests.get(STORY_URL + '/stories/latest')
+        x = client.get(STORY_URL + '/stories/latest', stream=True)
     except requests.exceptions.ConnectionError:
         return service_not_up()
     stories = []
 
     if check_service_up(x):
-        stories = x.json()
+        stories = client.iter_json(x)
 
-    return render_template("stories.html", stories=stories, home_url=GATEWAY_URL)
+    return render_list("stories.html", stories=stories, home_url=GATEWAY_URL)
 
 
 # Renders the Stories page (stories.html) with only the stories published in a specified period
@@ -48,17 +52,16 @@ def _get_range():
     begin = request.args.get('begin')
     end = request.args.get('end')
     try:
-        x = requests.get(STORY_URL + '/stories/range?begin={}&end={}'.format(begin, end))
+        x = client.get(paged(STORY_URL + '/stories/range?begin={}&end={}'.format(begin, end)), stream=True)
     except requests.exceptions.ConnectionError:
         return service_not_up()
     if check_service_up(x):
-        body = x.json()
-
         if x.status_code < 300:
-            return render_template("stories.html", stories=body, home_url=GATEWAY_URL)
+            return render_list("stories.html", stories=client.iter_json(x), page=page_links(x),
+                               home_url=GATEWAY_URL)
 
         else:
-            flash(body['description'])
+            flash(x.json()['description'])
             return redirect(url_for('stories._get_all_stories'))
     else:
         return redirect(url_for('gateway._home'))
@@ -69,21 +72,23 @@ def _get_range():
 @login_required
 def _get_drafts():
     try:
-        s = requests.get(STORY_URL + '/stories/drafts?user_id={}'.format(current_user.id))
+        s = client.get(paged(STORY_URL + '/stories/drafts?user_id={}'.format(current_user.id)), stream=True)
     except requests.exceptions.ConnectionError:
         return service_not_up()
     stories = []
     if s.status_code < 300:
-        stories = s.json()
+        stories = client.iter_json(s)
 
-    return render_template("drafts.html", drafts=stories, home_url=GATEWAY_URL)
+    no_drafts, stories = peek(stories)
+    return render_list("drafts.html", drafts=stories, no_drafts=no_drafts, page=page_links(s),
+                       home_url=GATEWAY_URL)
 
 
 # Renders the Story page (story.html) with the specified story
 @storiesapi.operation('getStory')
 def _get_story(id_story):
     try:
-        x = requests.get(STORY_URL + '/stories/{}'.format(id_story))
+        x = client.get(STORY_URL + '/stories/{}'.format(id_story))
     except requests.exceptions.ConnectionError:
         return service_not_up()
 
@@ -98,7 +103,7 @@ def _get_story(id_story):
 @storiesapi.operation('deleteStory')
 def _delete_story(id_story):
     try:
-        x = requests.delete(STORY_URL + '/stories/{}'.format(id_story), json={'user_id': current_user.id})
+        x = client.delete(STORY_URL + '/stories/{}'.format(id_story), json={'user_id': current_user.id})
     except requests.exceptions.ConnectionError:
         return service_not_up()
 
@@ -132,7 +137,7 @@ def _write_new():
     data = {"as_draft": bool(int(form['as_draft'])), "text": form['text'],
             "user_id": current_user.id, "figures": figures}
     try:
-        x = requests.post(STORY_URL + '/stories', json=data)
+        x = client.post(STORY_URL + '/stories', json=data)
     except requests.exceptions.ConnectionError:
         return service_not_up()
 
@@ -162,7 +167,7 @@ def _write_new():
 def _get_draft_page(id_story):
     form = StoryForm()
     try:
-        x = requests.get(STORY_URL + '/stories/{}'.format(id_story))
+        x = client.get(STORY_URL + '/stories/{}'.format(id_story))
     except requests.exceptions.ConnectionError:
         return service_not_up()
 
@@ -195,7 +200,7 @@ def _complete_draft(id_story):
             "user_id": current_user.id, "figures": figures}
 
     try:
-        x = requests.put(STORY_URL + '/stories/{}'.format(id_story), json=data)
+        x = client.put(STORY_URL + '/stories/{}'.format(id_story), json=data)
     except requests.exceptions.ConnectionError:
         return service_not_up()
 
@@ -224,7 +229,7 @@ def _get_random():
         method += '?user_id={}'.format(current_user.id)
 
     try:
-        x = requests.get(STORY_URL + method)
+        x = client.get(STORY_URL + method)
     except requests.exceptions.ConnectionError:
         return service_not_up()
 
@@ -245,20 +250,19 @@ def _get_random():
 @storiesapi.operation('reactStory')
 @login_required
 def _react_story(id_story, reaction_caption):
-    r_task = reaction_task.delay(id_story, reaction_caption, current_user.id)
-
-    try:
-        s = requests.get(STORY_URL + "/stories/{}".format(id_story))
-    except requests.exceptions.ConnectionError:
-        return service_not_up()
+    # The reaction is only queued, no microservice nor the broker is waited for while answering
+    queue_reaction(id_story, reaction_caption, current_user.id)
 
-    if check_service_up(s):
-        if s.status_code < 300:
-            return redirect(url_for('stories._get_story', id_story=id_story))
-        else:
-            flash("Error retrieving story!", 'error')
+    # The cached counters show the reaction at once, the next refresh brings the real ones
+    def add_reaction(reactions):
+        reactions[reaction_caption] = reactions.get(reaction_caption, 0) + 1
+        return reactions
+    client.update_cached(REACTION_URL + '/reactions/stats/{}'.format(id_story), add_reaction)
 
-    return redirect(url_for('gateway._home'))
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or \
+            request.accept_mimetypes.best == 'application/json':
+        return jsonify({"story_id": id_story, "reaction": reaction_caption, "status": "queued"}), 202
+    return redirect(url_for('stories._get_story', id_story=id_story))
 
 
 #                   Useful functions
@@ -267,25 +271,29 @@ def render_story(story=None):
     context_vars = {"home_url": GATEWAY_URL, "react_url": GATEWAY_URL + 'stories/{}/react',
                     "exists": (story is not None)}
     if story:
+        # Author and reactions only depend on the story, so they are requested together
+        # through the loaders of the request. The author call is skipped if the story already embeds it
+        author = story.get('author')
+        if author is None:
+            loaders.users().want(story['author_id'])
+        loaders.reaction_stats().want(story['id'])
+        loaders.dispatch_all(loaders.users(), loaders.reaction_stats())
+
         try:
-            u = requests.get(USER_URL + "/users/{}".format(story['author_id']))
+            if author is None:
+                author = loaders.users().get(story['author_id'])
+            reactions = loaders.reaction_stats().get(story['id'])
         except requests.exceptions.ConnectionError:
             return service_not_up()
 
-        if u.status_code < 300:
-            try:
-                r = requests.get(REACTION_URL + '/reactions/stats/{}'.format(story['id']))
-            except requests.exceptions.ConnectionError:
-                return service_not_up()
-
-            if r.status_code < 300:
-                rolled_dice = story['figures'].split('#')
-                rolled_dice = rolled_dice[1:-1]
-                context_vars.update({"rolled_dice": rolled_dice, "story": story,
-                                     "user": u.json(), "reactions": r.json()})
-
-        else:
+        if author is None:
             flash("Can't find author of this story", "error")
             return redirect(url_for('stories._get_all_stories'))
 
+        if reactions is not None:
+            rolled_dice = story['figures'].split('#')
+            rolled_dice = rolled_dice[1:-1]
+            context_vars.update({"rolled_dice": rolled_dice, "story": story,
+                                 "user": author, "reactions": reactions})
+
     return render_template("story.html", **context_vars)
@@ -0,0 +1,4 @@
+from APIGateway import catalogue
+
+# The apps of the tests don't start the dice catalogue refresher, it would call the faked services
+catalogue.PRELOAD = False
@@ -3,11 +3,16 @@ from http.server import BaseHTTPRequestHandler, HTTPServer
 import json
 import re
 import socket
+import time
+from socketserver import ThreadingMixIn
 from threading import Thread
+from unittest import mock
 
 # Third-party imports...
 import requests
 
+from APIGateway.client import client
+
 
 class MockServerRequestHandler(BaseHTTPRequestHandler):
     
@@ -60,21 +65,22 @@ class MockServerRequestHandler(BaseHTTPRequestHandler):
             self.wfile.write(response_content.encode('utf-8'))
             return
 
-    def clear_body(self):
-        _body_response = json.dumps([])
-        return
+    # The answer is set on the class, the server makes a new handler for every request
+    @classmethod
+    def clear_body(cls):
+        cls._body_response = json.dumps([])
 
-    def set_body(self, body):
-        _body_response = body
-        return
+    @classmethod
+    def set_body(cls, body):
+        cls._body_response = body
 
-    def set_code(self, code):
-        _status_code = code
-        return
+    @classmethod
+    def set_code(cls, code):
+        cls._status_code = code
 
-    def set_pattern(self, pattern):
-        _new_pattern = pattern
-        return
+    @classmethod
+    def set_pattern(cls, pattern):
+        cls._new_pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
 
 
 def get_free_port():
@@ -90,3 +96,49 @@ def start_mock_server(port):
     mock_server_thread = Thread(target=mock_server.serve_forever)
     mock_server_thread.setDaemon(True)
     mock_server_thread.start()
+    return mock_server
+
+
+def make_response(code, body, headers=None):
+    x = requests.Response()
+    x.status_code = code
+    x.headers.update(headers or {})
+    x._content = json.dumps(body).encode('utf-8')
+    return x
+
+
+# Fakes the microservices: routes maps an url to a (code, body[, headers]) tuple, to an exception
+# or to a function returning one of them
+def fake_services(routes):
+    def _request(method, url, **kwargs):
+        route = routes[url]
+        if callable(route):
+            route = route()
+        if isinstance(route, Exception):
+            raise route
+        return make_response(*route)
+    return mock.patch.object(client, 'request', side_effect=_request)
+
+
+# Answers every GET with its own path, keeping the connection alive
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 0
+    paths = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        time.sleep(self.delay)
+        body = json.dumps({'path': self.path}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
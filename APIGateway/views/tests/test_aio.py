@@ -0,0 +1,121 @@
+import asyncio
+import time
+import unittest
+from threading import Thread
+
+import requests
+from aiohttp.test_utils import TestServer, TestClient
+
+from APIGateway.aio import AioRuntime, create_server, greenlet_spawn, await_only
+from APIGateway.app import create_app
+from APIGateway.client import client
+from APIGateway.urls import TEST_DB, USER_URL, STORY_URL
+from APIGateway.views.tests.mock import fake_services, KeepAliveHandler, ThreadingHTTPServer
+
+
+def sleepy(seconds, value):
+    await_only(asyncio.sleep(seconds))
+    return value
+
+
+def failing():
+    await_only(asyncio.sleep(0))
+    raise ValueError('failed')
+
+
+class TestGreenletBridge(unittest.IsolatedAsyncioTestCase):
+
+    async def test_spawn(self):
+        start = time.time()
+        results = await asyncio.gather(*[greenlet_spawn(sleepy, 0.1, i) for i in range(50)])
+        self.assertEqual(results, list(range(50)))
+        # The greenlets wait together, not one after the other
+        self.assertLess(time.time() - start, 1)
+
+        with self.assertRaises(ValueError):
+            await greenlet_spawn(failing)
+
+
+class TestRuntimeRequests(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        KeepAliveHandler.paths = []
+        KeepAliveHandler.delay = 0.2
+        self.server = ThreadingHTTPServer(('localhost', 0), KeepAliveHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://localhost:{}'.format(self.server.server_port)
+        self.runtime = AioRuntime({'stories': self.url})
+        await self.runtime.start()
+
+    async def asyncTearDown(self):
+        KeepAliveHandler.delay = 0
+        await self.runtime.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    async def test_concurrent_requests(self):
+        def get(i):
+            return self.runtime.request('stories', 'GET', self.url + '/stories/{}'.format(i), timeout=(3.05, 10))
+
+        start = time.time()
+        responses = await asyncio.gather(*[greenlet_spawn(get, i) for i in range(20)])
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual([x.json()['path'] for x in responses], ['/stories/{}'.format(i) for i in range(20)])
+        self.assertIsInstance(responses[0], requests.Response)
+
+    async def test_stream(self):
+        def get():
+            x = self.runtime.request('stories', 'GET', self.url + '/stories/1', timeout=(3.05, 10), stream=True)
+            # The body hasn't been read yet
+            self.assertIs(x._content, False)
+            return x.json()
+
+        self.assertEqual(await greenlet_spawn(get), {'path': '/stories/1'})
+
+    async def test_run_blocking(self):
+        # The blocking calls run in threads, the event loop keeps going
+        start = time.time()
+        await asyncio.gather(*[greenlet_spawn(self.runtime.run_blocking, time.sleep, 0.2) for _ in range(4)])
+        self.assertLess(time.time() - start, 0.6)
+
+    async def test_timeout(self):
+        def get():
+            return self.runtime.request('stories', 'GET', self.url + '/stories', timeout=(3.05, 0.05))
+
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            await greenlet_spawn(get)
+
+
+class TestAioServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.app = create_app(TEST_DB)
+        self.server = TestClient(TestServer(create_server(self.app)))
+        await self.server.start_server()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def test_same_responses(self):
+        story = {'id': 1, 'text': 'Once upon a time', 'author_id': 1, 'author': {'firstname': 'Admin', 'lastname': 'Admin'},
+                 'date': '2019-11-05', 'likes': 2, 'dislikes': 0, 'dice_set': ['bike', 'moon'], 'is_draft': False}
+        routes = {STORY_URL + '/stories?limit=50': (200, [story]),
+                  USER_URL + '/search?query=abc': (200, []),
+                  STORY_URL + '/search?query=abc': (200, [])}
+
+        with fake_services(routes):
+            resp = await self.server.get('/stories')
+            body = await resp.text()
+            expected = self.app.test_client().get('/stories')
+            self.assertEqual(resp.status, expected.status_code)
+            self.assertEqual(body, expected.get_data(as_text=True))
+            # The page is sent while it's rendered
+            self.assertEqual(resp.headers['Transfer-Encoding'], 'chunked')
+
+            # The concurrent searches run as greenlets of the runtime
+            resp = await self.server.post('/search', data={'query': 'abc'})
+            self.assertEqual(resp.status, 200)
+            self.assertIn('No match for the searched string', await resp.text())
+
+        self.assertIsNotNone(client.runtime)
+        self.assertEqual((await self.server.get('/not/an/operation')).status, 404)
@@ -0,0 +1,108 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+from flask import render_template
+from werkzeug.test import EnvironBuilder
+
+from APIGateway.app import create_app
+from APIGateway.assets import assets
+from APIGateway.build_assets import build
+from APIGateway.urls import TEST_DB
+
+
+class TestAssets(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # A small dice set, built the same way as the real ones
+        cls.root = tempfile.mkdtemp()
+        for die, faces in (('die0', ('bike', 'moon')), ('die1', ('tree',))):
+            os.makedirs(os.path.join(cls.root, 'tiny', die))
+            for i, face in enumerate(faces):
+                Image.new('RGBA', (320, 320), (i * 100, 50, 200, 255)).save(os.path.join(cls.root, 'tiny', die, face + '.png'))
+        build(cls.root)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def setUp(self):
+        self.app = create_app(TEST_DB)
+        self.requests = []
+        self.app.before_request(lambda: self.requests.append(1))
+        assets.root = self.root
+        assets.load()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        assets.root = self.app.static_folder
+        assets.load()
+
+    def test_fingerprinted(self):
+        url = assets.url('tiny/die0/bike.png')
+        self.assertRegex(url, r'^/static/tiny/die0/bike\.[0-9a-f]{8}\.png$')
+        self.assertEqual(assets.url('not/there.png'), '/static/not/there.png')
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(resp.content_type, 'image/png')
+        with open(os.path.join(self.root, 'tiny/die0/bike.png'), 'rb') as f:
+            self.assertEqual(resp.get_data(), f.read())
+
+        resp = self.client.get(url, headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+
+        # Without the hash, or with the hash of another build, the file can't be kept forever
+        self.assertEqual(self.client.get('/static/tiny/die0/bike.png').headers['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(self.client.get('/static/tiny/die0/bike.00000000.png').headers['Cache-Control'], 'no-cache')
+
+        # The static files never reach the Flask app
+        self.assertEqual(self.requests, [])
+        self.assertEqual(self.client.get('/static/tiny/missing.png').status_code, 404)
+        self.assertEqual(self.requests, [1])
+
+    def test_variants(self):
+        sprite = assets.sprite('tiny')
+        self.assertEqual(sprite['faces'], {'die0/bike': [0, 0], 'die0/moon': [160, 0], 'die1/tree': [0, 160]})
+        self.assertEqual((sprite['width'], sprite['height']), (320, 320))
+        self.assertIsNone(assets.sprite('animal'))
+
+        resp = self.client.get(sprite['url'], headers={'Accept': 'image/webp,*/*'})
+        self.assertEqual(resp.content_type, 'image/webp')
+        self.assertEqual(resp.headers['Vary'], 'Accept')
+        resp = self.client.get(sprite['url'], headers={'Accept': 'image/png'})
+        self.assertEqual(resp.content_type, 'image/png')
+
+        url = assets.url('dist/sprites.json')
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        with open(os.path.join(self.root, 'dist/sprites.json'), 'rb') as f:
+            self.assertEqual(gzip.decompress(resp.get_data()), f.read())
+        self.assertNotIn('Content-Encoding', self.client.get(url).headers)
+
+    def test_file_wrapper(self):
+        environ = EnvironBuilder(path=assets.url('tiny/die1/tree.png')).get_environ()
+        environ['wsgi.file_wrapper'] = lambda f, block_size=8192: ('sendfile', f)
+        body = self.app.wsgi_app(environ, lambda status, headers: None)
+        self.assertEqual(body[0], 'sendfile')
+        body[1].close()
+
+    def test_roll_page(self):
+        with self.app.test_request_context():
+            page = render_template('roll_dice.html', dice_number=2, dice_img_set='tiny', words=['moon', 'tree'],
+                                   dice_indexes=[0, 1], home_url='/')
+            self.assertIn('background-image: url({})'.format(assets.sprite('tiny')['url']), page)
+            self.assertIn('background-position: -160px -0px;', page)
+            self.assertIn('background-position: -0px -160px;', page)
+            self.assertNotIn('<img', page)
+
+            # Without the sprite sheet the single images are used
+            page = render_template('roll_dice.html', dice_number=1, dice_img_set='standard', words=['bike'],
+                                   dice_indexes=[0], home_url='/')
+            self.assertIn('<img src="/static/standard/die0/bike.png"', page)
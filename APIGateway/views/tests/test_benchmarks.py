@@ -0,0 +1,72 @@
+import unittest
+
+import requests
+
+from APIGateway.benchmarks import endpoints, scaling
+from APIGateway.benchmarks.stubs import Latency
+from APIGateway.views.tests.mock import MockServerRequestHandler, get_free_port, start_mock_server
+
+
+class TestMockServer(unittest.TestCase):
+
+    def test_set_answer(self):
+        server = start_mock_server(get_free_port())
+        url = 'http://localhost:{}'.format(server.server_port)
+        try:
+            MockServerRequestHandler.set_code(201)
+            MockServerRequestHandler.set_body('{"id": 1}')
+            x = requests.post(url + '/new')
+            self.assertEqual((x.status_code, x.json()), (201, {'id': 1}))
+
+            MockServerRequestHandler.clear_body()
+            self.assertEqual(requests.get(url + '/delete').json(), [])
+        finally:
+            MockServerRequestHandler.set_code(requests.codes.ok)
+            server.shutdown()
+            server.server_close()
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_latency(self):
+        self.assertEqual(Latency.parse('constant:0.1').sample(), 0.1)
+        self.assertEqual(Latency().sample(), 0)
+        for _ in range(100):
+            self.assertTrue(0.01 <= Latency.parse('uniform:0.01:0.02').sample() <= 0.02)
+            self.assertGreater(Latency.parse('lognormal:0.02:0.5').sample(), 0)
+        self.assertRaises(ValueError, Latency.parse, 'lognormal:0.02')
+        self.assertRaises(ValueError, Latency.parse, 'gamma:1')
+
+    def test_run(self):
+        only = ['gateway.status', 'stories.getAll', 'stories.getStory', 'stories.writeNew']
+        report = endpoints.run(only=only, concurrency=2, requests_count=6,
+                               latencies={None: Latency.parse('constant:0.001')}, list_size=5)
+        self.assertEqual(sorted(report['results']), sorted(only))
+        for name, result in report['results'].items():
+            self.assertEqual(result['requests'], 6, name)
+            self.assertEqual(result['server_errors'] + result['errors'], 0, name)
+            self.assertLessEqual(result['p50'], result['p95'])
+            self.assertLessEqual(result['p95'], result['p99'])
+        self.assertEqual(report['results']['stories.writeNew']['codes'], {'302': 6})
+        self.assertNotIn('404', report['stubs']['stories'])
+        # Without the response cache every GET reaches the stubs
+        self.assertFalse(report['config']['cache'])
+        self.assertGreaterEqual(report['stubs']['stories']['200'], 6 * 2)
+
+        lines = endpoints.compare(report, report)
+        self.assertIn('(+0% req/s, +0% p99)', lines[0])
+
+    def test_scaling(self):
+        report = scaling.run(pages=['stories.html', 'search.html'], sizes=[5, 50], repeat=1)
+        stories = report['results']['stories.html']
+        self.assertEqual(stories['5']['status'], 200)
+        self.assertGreater(stories['50']['response_bytes'], stories['5']['response_bytes'] * 5)
+        self.assertGreater(stories['5']['peak_memory'], 0)
+        self.assertEqual(list(report['scaling']['search.html']['response_bytes']), ['5-50'])
+
+    def test_superlinear(self):
+        results = {str(n): {'time': n ** 1.5 / 10 ** 6} for n in (10, 1000, 10000)}
+        report = {'scaling': {'page.html': {'time': scaling.exponents(results, 'time')}}}
+        self.assertAlmostEqual(report['scaling']['page.html']['time']['10-1000'], 1.5)
+        # The growth between the small sizes isn't checked
+        self.assertEqual([(p, s) for p, s, _ in scaling.superlinear(report)], [('page.html', '1000-10000')])
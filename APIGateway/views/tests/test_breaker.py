@@ -0,0 +1,83 @@
+import time
+import unittest
+
+import flask_testing
+import requests
+
+from APIGateway.app import create_app
+from APIGateway.breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from APIGateway.client import GatewayClient, client
+from APIGateway.urls import TEST_DB
+from APIGateway.views.tests.mock import make_response, get_free_port
+
+
+def refused():
+    raise requests.exceptions.ConnectionError()
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_open_and_half_open(self):
+        breaker = CircuitBreaker('stories', failure_threshold=2, reset_timeout=0.1)
+        self.assertRaises(requests.exceptions.ConnectionError, breaker.call, refused)
+        self.assertEqual(breaker.to_dict()['state'], CLOSED)
+        breaker.call(lambda: make_response(500, {}))
+        self.assertEqual(breaker.to_dict()['state'], OPEN)
+
+        # While open the service isn't called at all
+        self.assertRaises(CircuitOpenError, breaker.call, lambda: self.fail('the service must not be called'))
+        self.assertEqual(breaker.to_dict()['rejected'], 1)
+
+        # A failed probe reopens it, a good one closes it
+        time.sleep(0.1)
+        self.assertEqual(breaker.to_dict()['state'], HALF_OPEN)
+        self.assertRaises(requests.exceptions.ConnectionError, breaker.call, refused)
+        self.assertEqual(breaker.to_dict()['state'], OPEN)
+        time.sleep(0.1)
+        self.assertEqual(breaker.call(lambda: make_response(200, [])).status_code, 200)
+        self.assertEqual(breaker.to_dict(), {'state': CLOSED, 'failures': 0, 'opened_at': None, 'rejected': 1})
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker('stories', failure_threshold=2)
+        self.assertRaises(requests.exceptions.ConnectionError, breaker.call, refused)
+        breaker.call(lambda: make_response(404, {}))
+        self.assertRaises(requests.exceptions.ConnectionError, breaker.call, refused)
+        self.assertEqual(breaker.to_dict()['state'], CLOSED)
+
+    def test_client_fails_fast(self):
+        url = 'http://localhost:{}'.format(get_free_port())
+        c = GatewayClient(services={'stories': url})
+        c.configure_breakers(failure_threshold=2)
+        for _ in range(2):
+            self.assertRaises(requests.exceptions.ConnectionError, c.get, url + '/stories')
+        self.assertRaises(CircuitOpenError, c.get, url + '/stories')
+        self.assertEqual(c.breaker_states()['stories']['state'], OPEN)
+        self.assertEqual(c.stats()['stories']['requests'], 2)
+
+
+class TestBreakerViews(flask_testing.TestCase):
+    app = None
+
+    def create_app(self):
+        global app
+        app = create_app(TEST_DB)
+        return app
+
+    def tearDown(self) -> None:
+        client.configure_breakers()
+
+    def test_open_breaker_redirects(self):
+        client.breakers['stories'].state = OPEN
+        client.breakers['stories'].opened_at = time.time()
+
+        self.client.get('/stories', follow_redirects=False)
+        self.assert_message_flashed('A requested microservice is not up', 'error')
+
+    def test_status(self):
+        client.breakers['users'].state = OPEN
+        client.breakers['users'].opened_at = time.time()
+
+        body = self.client.get('/status').json
+        self.assertEqual(body['breakers']['users']['state'], OPEN)
+        self.assertEqual(body['breakers']['stories']['state'], CLOSED)
+        self.assertIn('dice', body['pools'])
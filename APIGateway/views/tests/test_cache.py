@@ -0,0 +1,208 @@
+import io
+import time
+import unittest
+
+import redis
+
+from APIGateway.cache import ResponseCache, ByteLRU
+from APIGateway.views.tests.mock import make_response
+
+STORY_URL = 'http://stories'
+ROUTES = {'stories': ('stories', r'^/stories$', 10, 30),
+          'story': ('stories', r'^/stories/\d+$', 10, 30)}
+
+
+# Dict based stand-in of the Redis client, shared by the caches of a test like Redis by the workers
+class FakeRedis:
+
+    def __init__(self):
+        self.data = {}
+        self.down = False
+
+    def get(self, key):
+        if self.down:
+            raise redis.ConnectionError()
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        if self.down:
+            raise redis.ConnectionError()
+        self.data[key] = value
+
+    def mget(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def incr(self, key):
+        self.set(key, str(int(self.get(key) or 0) + 1).encode())
+
+
+class Loader:
+
+    def __init__(self, body):
+        self.body = body
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return make_response(200, self.body)
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def new_cache(self, l2=None, **kwargs):
+        cache = ResponseCache({'stories': STORY_URL}, routes=ROUTES, redis_url=None, spawn=lambda f: f(), **kwargs)
+        cache.l2 = l2
+        return cache
+
+    def test_l1_hit(self):
+        cache = self.new_cache()
+        load = Loader([{'id': 1}])
+
+        self.assertEqual(cache.fetch('stories', STORY_URL + '/stories', load).json(), [{'id': 1}])
+        self.assertEqual(cache.fetch('stories', STORY_URL + '/stories', load).json(), [{'id': 1}])
+        self.assertEqual(load.calls, 1)
+        self.assertEqual(cache.stats.to_dict()['stories']['l1_hits'], 1)
+        self.assertEqual(cache.stats.to_dict()['stories']['misses'], 1)
+
+        # Not cached routes always go to the service
+        cache.fetch('stories', STORY_URL + '/stories/latest', load)
+        cache.fetch('stories', STORY_URL + '/stories/latest', load)
+        self.assertEqual(load.calls, 3)
+
+    def test_errors_not_cached(self):
+        cache = self.new_cache()
+        cache.fetch('stories', STORY_URL + '/stories/1', lambda: make_response(404, {'description': 'Not found'}))
+        load = Loader({'id': 1})
+        cache.fetch('stories', STORY_URL + '/stories/1', load)
+        self.assertEqual(load.calls, 1)
+
+    def test_stale_while_revalidate(self):
+        cache = self.new_cache()
+        cache.set_ttls({'stories': (0, 30)})
+        old = Loader(['old'])
+        cache.fetch('stories', STORY_URL + '/stories', old)
+
+        # The stale copy is returned, while the new one is loaded in background
+        new = Loader(['new'])
+        self.assertEqual(cache.fetch('stories', STORY_URL + '/stories', new).json(), ['old'])
+        self.assertEqual(new.calls, 1)
+        self.assertEqual(cache.stats.to_dict()['stories']['stale_hits'], 1)
+
+        cache.set_ttls({'stories': (0, 0)})
+        time.sleep(0.01)
+        self.assertEqual(cache.fetch('stories', STORY_URL + '/stories', new).json(), ['new'])
+        self.assertEqual(new.calls, 2)
+
+    def test_fresh(self):
+        cache = self.new_cache()
+        cache.fetch('stories', STORY_URL + '/stories', Loader(['old']))
+        new = Loader(['new'])
+        self.assertEqual(cache.fetch('stories', STORY_URL + '/stories', new, fresh=True).json(), ['new'])
+        self.assertEqual(cache.fetch('stories', STORY_URL + '/stories', new).json(), ['new'])
+        self.assertEqual(new.calls, 1)
+
+    def test_l2_shared(self):
+        l2 = FakeRedis()
+        load = Loader([{'id': 1}])
+        self.new_cache(l2).fetch('stories', STORY_URL + '/stories', load)
+
+        other = self.new_cache(l2)
+        self.assertEqual(other.fetch('stories', STORY_URL + '/stories', load).json(), [{'id': 1}])
+        self.assertEqual(load.calls, 1)
+        self.assertEqual(other.stats.to_dict()['stories']['l2_hits'], 1)
+
+        other.invalidate('stories')
+        self.new_cache(l2).fetch('stories', STORY_URL + '/stories', load)
+        self.assertEqual(load.calls, 2)
+        other.fetch('stories', STORY_URL + '/stories', load)
+        self.assertEqual(load.calls, 2)
+
+    def test_invalidate_routes(self):
+        l2 = FakeRedis()
+        cache = self.new_cache(l2)
+        stories, story = Loader([{'id': 1}]), Loader({'id': 1})
+        cache.fetch('stories', STORY_URL + '/stories', stories)
+        cache.fetch('stories', STORY_URL + '/stories/1', story)
+
+        # A new story changes the list, not the stories already cached
+        routes = cache.mutated_routes('stories', 'POST', STORY_URL + '/stories')
+        self.assertEqual(routes, ['stories', 'latest_stories'])
+        cache.invalidate('stories', routes)
+        for cache in (cache, self.new_cache(l2)):
+            cache.fetch('stories', STORY_URL + '/stories', stories)
+            cache.fetch('stories', STORY_URL + '/stories/1', story)
+        self.assertEqual((stories.calls, story.calls), (2, 1))
+
+        self.assertEqual(cache.mutated_routes('users', 'POST', 'http://users/users/login'), None)
+        cache.services['users'] = 'http://users'
+        self.assertEqual(cache.mutated_routes('users', 'POST', 'http://users/users/login'), [])
+        self.assertEqual(cache.mutated_routes('users', 'POST', 'http://users/users/2/follow?current_user_id=1'), [])
+        self.assertIsNone(cache.mutated_routes('users', 'PUT', 'http://users/users/2'))
+
+    def test_update(self):
+        l2 = FakeRedis()
+        cache = self.new_cache(l2)
+        load = Loader({'like': 1, 'dislike': 0})
+        cache.fetch('stories', STORY_URL + '/stories/1', load)
+
+        def like(body):
+            body['like'] += 1
+            return body
+
+        self.assertTrue(cache.update('stories', STORY_URL + '/stories/1', like))
+        self.assertEqual(cache.fetch('stories', STORY_URL + '/stories/1', load).json(), {'like': 2, 'dislike': 0})
+        # The other workers see the update through L2
+        self.assertEqual(self.new_cache(l2).fetch('stories', STORY_URL + '/stories/1', load).json()['like'], 2)
+        self.assertEqual(load.calls, 1)
+
+        # Nothing to update if the url isn't cached
+        self.assertFalse(cache.update('stories', STORY_URL + '/stories/2', like))
+
+    def test_l2_down(self):
+        l2 = FakeRedis()
+        l2.down = True
+        cache = self.new_cache(l2)
+        load = Loader([])
+
+        cache.fetch('stories', STORY_URL + '/stories', load)
+        cache.fetch('stories', STORY_URL + '/stories', load)
+        self.assertEqual(load.calls, 1)
+        self.assertEqual(cache.stats.to_dict()['stories']['l2_errors'], 1)
+
+    def test_eviction(self):
+        cache = self.new_cache(l1_max_bytes=200)
+        for i in range(5):
+            cache.fetch('stories', STORY_URL + '/stories/{}'.format(i), Loader({'text': 'x' * 40}))
+
+        self.assertLessEqual(cache.l1.size, 200)
+        self.assertGreater(cache.stats.to_dict()['story']['evictions'], 0)
+
+    def test_max_entry_bytes(self):
+        cache = self.new_cache(max_entry_bytes=100)
+        load = Loader([{'text': 'x' * 200}])
+        cache.fetch('stories', STORY_URL + '/stories', load)
+        cache.fetch('stories', STORY_URL + '/stories', load)
+        self.assertEqual(load.calls, 2)
+
+        # A streamed body is only read to be cached when its declared size is small
+        def streamed(length=None):
+            x = make_response(200, None)
+            x.raw, x._content = io.BytesIO(b'[1, 2]'), False
+            if length is not None:
+                x.headers['Content-Length'] = length
+            return x
+
+        self.assertIs(cache.fetch('stories', STORY_URL + '/stories', streamed)._content, False)
+        self.assertIs(cache.fetch('stories', STORY_URL + '/stories', lambda: streamed('1000'))._content, False)
+        cache.fetch('stories', STORY_URL + '/stories', lambda: streamed('6'))
+        self.assertEqual(cache.fetch('stories', STORY_URL + '/stories', load).json(), [1, 2])
+        self.assertEqual(load.calls, 2)
+
+    def test_lru_order(self):
+        lru = ByteLRU(25)
+        lru.set('a', {'route': 'r', 'content': b'1' * 9})
+        lru.set('b', {'route': 'r', 'content': b'1' * 9})
+        lru.get('a')
+        self.assertEqual(lru.set('c', {'route': 'r', 'content': b'1' * 9}), ['r'])
+        self.assertIsNone(lru.get('b'))
+        self.assertIsNotNone(lru.get('a'))
@@ -0,0 +1,77 @@
+import time
+
+import flask_testing
+import requests
+
+from APIGateway.app import create_app
+from APIGateway.catalogue import DiceCatalogue, catalogue
+from APIGateway.urls import TEST_DB, DICE_URL
+from APIGateway.views.tests.mock import fake_services
+
+SETS = [{'id': 1, 'name': 'Standard'}, {'id': 2, 'name': 'Halloween'}]
+
+
+class TestDiceCatalogue(flask_testing.TestCase):
+    app = None
+
+    def create_app(self):
+        global app
+        app = create_app(TEST_DB, login_disabled=True)
+        return app
+
+    def tearDown(self) -> None:
+        catalogue.sets = None
+
+    def test_refresh(self):
+        c = DiceCatalogue()
+        with fake_services({DICE_URL + '/sets': (200, SETS)}):
+            self.assertTrue(c.refresh())
+        self.assertEqual(c.sets, SETS)
+
+        # The last good catalogue is kept while the service is down
+        with fake_services({DICE_URL + '/sets': requests.exceptions.ConnectionError()}):
+            self.assertFalse(c.refresh())
+        with fake_services({DICE_URL + '/sets': (500, {'description': 'Internal Server Error'})}):
+            self.assertFalse(c.refresh())
+        self.assertEqual(c.sets, SETS)
+
+        with fake_services({DICE_URL + '/sets': (204, None)}):
+            self.assertTrue(c.refresh())
+        self.assertEqual(c.sets, [])
+
+    def test_refresher(self):
+        c = DiceCatalogue()
+        app.config.update(GATEWAY_DICE_PRELOAD=True, GATEWAY_DICE_REFRESH=0.01)
+        with fake_services({DICE_URL + '/sets': (200, SETS)}) as request:
+            c.init_app(app)
+            for _ in range(100):
+                if c.sets is not None:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(c.sets, SETS)
+            # The cached response isn't used
+            self.assertTrue(request.call_args[1]['fresh'])
+
+            app.config['GATEWAY_DICE_PRELOAD'] = False
+            c.init_app(app)
+            c._thread.join(1)
+            self.assertFalse(c._thread.is_alive())
+
+    def test_settings_from_memory(self):
+        catalogue.sets = SETS
+        with fake_services({}) as request:
+            self.client.get('/stories/new/settings')
+            self.assertFalse(request.called)
+
+        self.assert_template_used('settings.html')
+        self.assertEqual(self.get_context_variable('sets'), SETS)
+
+    def test_settings_never_loaded(self):
+        catalogue.sets = None
+        with fake_services({DICE_URL + '/sets': requests.exceptions.ConnectionError()}):
+            self.client.get('/stories/new/settings')
+        self.assert_message_flashed('A requested microservice is not up', 'error')
+
+        with fake_services({DICE_URL + '/sets': (204, None)}):
+            self.client.get('/stories/new/settings')
+        self.assert_message_flashed('No dice set found. Please contact Jacopo Massa')
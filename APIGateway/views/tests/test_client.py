@@ -0,0 +1,137 @@
+import hashlib
+import time
+import unittest
+from threading import Thread
+
+from APIGateway import deadline
+from APIGateway.cache import to_entry, dumps_entry
+from APIGateway.client import GatewayClient
+from APIGateway.singleflight import SingleFlight, KEY_PREFIX
+from APIGateway.views.tests.mock import make_response, KeepAliveHandler, ThreadingHTTPServer
+
+
+class TestClient(unittest.TestCase):
+
+    def setUp(self) -> None:
+        KeepAliveHandler.paths = []
+        self.server = ThreadingHTTPServer(('localhost', 0), KeepAliveHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://localhost:{}'.format(self.server.server_port)
+        self.client = GatewayClient(services={'users': self.url})
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reused(self):
+        for i in range(3):
+            x = self.client.get(self.url + '/users/{}'.format(i))
+            self.assertEqual(x.json()['path'], '/users/{}'.format(i))
+
+        self.assertEqual(self.client.stats()['users'], {'requests': 3, 'hits': 2, 'misses': 1})
+
+    def test_no_keep_alive(self):
+        self.client.configure(keep_alive=False)
+        self.client.get(self.url + '/users')
+        self.client.get(self.url + '/users')
+
+        self.assertEqual(self.client.stats()['users']['misses'], 2)
+
+    def test_service_of(self):
+        self.assertEqual(self.client.service_of(self.url + '/users/1'), 'users')
+        self.assertEqual(self.client.service_of(self.url + '?query=a'), 'users')
+        self.assertIsNone(self.client.service_of('http://example.com/users'))
+        self.assertEqual(self.client.timeouts['users'], (3.05, 10))
+
+    def test_single_flight(self):
+        self.client.flights = SingleFlight()
+        KeepAliveHandler.delay = 0.2
+        try:
+            futures = [self.client.submit('GET', self.url + '/stories/latest') for _ in range(5)]
+            bodies = [f.result().json() for f in futures]
+        finally:
+            KeepAliveHandler.delay = 0
+
+        self.assertEqual(bodies, [{'path': '/stories/latest'}] * 5)
+        self.assertEqual(KeepAliveHandler.paths, ['/stories/latest'])
+        self.assertEqual(self.client.flights.stats()['coalesced'], 4)
+
+        # Different urls, or the same one once the flight is over, aren't coalesced
+        self.client.get(self.url + '/stories/latest')
+        self.client.get(self.url + '/stories/1')
+        self.assertEqual(len(KeepAliveHandler.paths), 3)
+
+    def test_follower_deadline(self):
+        self.client.flights = SingleFlight()
+        KeepAliveHandler.delay = 0.5
+        try:
+            leader = self.client.submit('GET', self.url + '/stories/latest')
+            time.sleep(0.1)
+            # The follower gives up with its own deadline, not the leader's
+            deadline.set_deadline(0.1)
+            start = time.time()
+            self.assertRaises(deadline.DeadlineExceeded, self.client.get, self.url + '/stories/latest')
+            self.assertLess(time.time() - start, 0.3)
+            self.assertEqual(leader.result().json(), {'path': '/stories/latest'})
+        finally:
+            deadline.set_deadline(None)
+            KeepAliveHandler.delay = 0
+        self.assertEqual(self.client.flights.stats()['coalesced'], 1)
+
+
+# Stand-in of Redis where another worker holds the lock of every flight and publishes its result
+class BusyRedis:
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, px=None):
+        if key.endswith(':lock'):
+            return False
+        self.data[key] = value
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def exists(self, key):
+        return key.endswith(':lock')
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class TestRemoteSingleFlight(unittest.TestCase):
+
+    def test_wait_other_worker(self):
+        flights = SingleFlight(lock_ttl=1)
+        flights.redis = BusyRedis()
+        key = flights.key('http://stories/stories/latest')
+
+        def publish():
+            time.sleep(0.05)
+            rkey = KEY_PREFIX + hashlib.sha1(key.encode('utf-8')).hexdigest()
+            flights.redis.data[rkey + ':result'] = dumps_entry(to_entry(make_response(200, ['shared'])))
+
+        Thread(target=publish).start()
+        x = flights.do(key, 'http://stories/stories/latest', lambda: self.fail('the service must not be called'))
+        self.assertEqual(x.json(), ['shared'])
+        self.assertEqual(flights.stats()['remote_coalesced'], 1)
+
+    def test_wait_deadline(self):
+        flights = SingleFlight(lock_ttl=5)
+        flights.redis = BusyRedis()
+        key = flights.key('http://stories/stories/latest')
+
+        # Nothing is published: the wait ends with the deadline, not the lock
+        def func():
+            deadline.limit(None)
+
+        deadline.set_deadline(0.1)
+        start = time.time()
+        try:
+            self.assertRaises(deadline.DeadlineExceeded, flights.do, key, 'http://stories/stories/latest', func)
+        finally:
+            deadline.set_deadline(None)
+        self.assertLess(time.time() - start, 0.5)
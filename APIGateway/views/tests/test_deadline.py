@@ -0,0 +1,101 @@
+import time
+import unittest
+from threading import Thread
+
+import flask_testing
+import requests
+
+from APIGateway import deadline
+from APIGateway.app import create_app
+from APIGateway.client import GatewayClient
+from APIGateway.urls import TEST_DB, STORY_URL
+from APIGateway.views.tests.mock import fake_services, KeepAliveHandler, ThreadingHTTPServer
+
+
+class TestDeadline(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        deadline.set_deadline(None)
+
+    def test_limit(self):
+        self.assertEqual(deadline.limit((3.05, 10)), ((3.05, 10), None))
+
+        deadline.set_deadline(0.5)
+        timeout, headers = deadline.limit((3.05, 10), {'Accept': 'application/json'})
+        self.assertLessEqual(max(timeout), 0.5)
+        self.assertLessEqual(int(headers[deadline.DEADLINE_HEADER]), 500)
+        self.assertEqual(headers['Accept'], 'application/json')
+
+        deadline.set_deadline(-1)
+        self.assertRaises(deadline.DeadlineExceeded, deadline.limit, (3.05, 10))
+
+    def test_client_timeout(self):
+        server = ThreadingHTTPServer(('localhost', 0), KeepAliveHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://localhost:{}'.format(server.server_port)
+        client = GatewayClient(services={'stories': url})
+        KeepAliveHandler.delay = 0.5
+        try:
+            deadline.set_deadline(0.1)
+            start = time.time()
+            # A GatewayTimeout is a ConnectionError, handled by the views with service_not_up()
+            self.assertRaises(requests.exceptions.ConnectionError, client.get, url + '/stories')
+            self.assertLess(time.time() - start, 0.4)
+        finally:
+            KeepAliveHandler.delay = 0
+            client.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_breaker(self):
+        server = ThreadingHTTPServer(('localhost', 0), KeepAliveHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://localhost:{}'.format(server.server_port)
+        client = GatewayClient(services={'stories': url})
+        KeepAliveHandler.delay = 0.5
+        try:
+            # The deadline cut the read timeout: the service isn't at fault
+            deadline.set_deadline(0.1)
+            self.assertRaises(deadline.DeadlineExceeded, client.get, url + '/stories')
+            self.assertEqual(client.breakers['stories'].failures, 0)
+
+            # The service's own read timeout expired
+            deadline.set_deadline(None)
+            self.assertRaises(deadline.GatewayTimeout, client.get, url + '/stories', timeout=(3.05, 0.1))
+            self.assertEqual(client.breakers['stories'].failures, 1)
+        finally:
+            KeepAliveHandler.delay = 0
+            client.close()
+            server.shutdown()
+            server.server_close()
+
+
+class TestDeadlineViews(flask_testing.TestCase):
+    app = None
+
+    def create_app(self):
+        global app
+        app = create_app(TEST_DB)
+        app.config['GATEWAY_REQUEST_BUDGET'] = 8
+        app.config['GATEWAY_OPERATION_BUDGETS'] = {'stories.getLatest': 2}
+        return app
+
+    def budget_of(self, path, **kwargs):
+        left = []
+
+        def stories():
+            left.append(deadline.remaining())
+            return 200, []
+
+        routes = {STORY_URL + '/stories?limit=50': stories, STORY_URL + '/stories/latest': stories}
+        with fake_services(routes):
+            self.client.get(path, **kwargs)
+        return left[0]
+
+    def test_budgets(self):
+        self.assertAlmostEqual(self.budget_of('/stories'), 8, delta=0.5)
+        self.assertAlmostEqual(self.budget_of('/stories/latest'), 2, delta=0.5)
+
+        # A shorter deadline from upstream wins
+        headers = {deadline.DEADLINE_HEADER: '1000'}
+        self.assertAlmostEqual(self.budget_of('/stories', headers=headers), 1, delta=0.5)
@@ -0,0 +1,182 @@
+import time
+from unittest import mock
+
+import flask_testing
+import requests
+
+from APIGateway.app import create_app
+from APIGateway.client import client
+from APIGateway.urls import TEST_DB, USER_URL, STORY_URL, REACTION_URL
+from APIGateway.views import auth
+from APIGateway.views.tests.mock import fake_services
+
+
+class TestWallFanOut(flask_testing.TestCase):
+    app = None
+
+    def create_app(self):
+        global app
+        app = create_app(TEST_DB)
+        return app
+
+    def routes(self):
+        return {USER_URL + '/users/1': (200, {'id': 1, 'firstname': 'Admin', 'lastname': 'Admin',
+                                              'email': 'example@example.com', 'dateofbirth': '05/10/2010'}),
+                USER_URL + '/users/1/stats': (200, {'num_followers': 3, 'followers_last_month': 1}),
+                STORY_URL + '/stories/stats/1': (200, {'num_stories': 2, 'tot_num_dice': 8, 'avg_dice': 4.0}),
+                USER_URL + '/reactions/stats/user/1': (200, {'tot_num_reactions': 5, 'avg_reactions': 2.5})}
+
+    def test_wall(self):
+        with fake_services(self.routes()):
+            self.client.get('/users/1')
+
+        self.assert_template_used('wall.html')
+        stats = self.get_context_variable('stats')
+        self.assertEqual(stats['follower_stats']['num_followers'], 3)
+        self.assertEqual(stats['stories_stats']['num_stories'], 2)
+        self.assertEqual(stats['reactions_stats']['tot_num_reactions'], 5)
+
+    def test_wall_degrades(self):
+        routes = self.routes()
+        routes[USER_URL + '/reactions/stats/user/1'] = requests.exceptions.ConnectionError()
+        routes[STORY_URL + '/stories/stats/1'] = (500, {'description': 'Internal Server Error'})
+
+        with fake_services(routes):
+            self.client.get('/users/1')
+
+        self.assert_template_used('wall.html')
+        self.assert_message_flashed("Can't retrieve stories stats")
+        stats = self.get_context_variable('stats')
+        self.assertEqual(stats['follower_stats']['num_followers'], 3)
+        self.assertEqual(stats['stories_stats']['num_stories'], 0)
+        self.assertEqual(stats['reactions_stats'], {'tot_num_reactions': 0, 'avg_reactions': 0.0})
+
+    def test_user_not_found(self):
+        routes = {USER_URL + '/users/7': (404, {'description': 'User not found'})}
+        with fake_services(routes):
+            self.client.get('/users/7')
+
+        self.assert_template_used('wall.html')
+        self.assertTrue(self.get_context_variable('not_found'))
+
+
+class TestSearchFanOut(flask_testing.TestCase):
+    app = None
+
+    def create_app(self):
+        global app
+        app = create_app(TEST_DB)
+        return app
+
+    def routes(self):
+        return {USER_URL + '/search?query=admin': (200, [{'id': 1, 'firstname': 'Admin', 'lastname': 'Admin'}]),
+                STORY_URL + '/search?query=admin': (200, [{'id': 1, 'text': 'admin story', 'author_id': 1}])}
+
+    def test_search(self):
+        with fake_services(self.routes()):
+            self.client.post('/search', data={'query': 'admin'})
+
+        self.assert_template_used('search.html')
+        self.assertEqual(len(self.get_context_variable('list_of_users')), 1)
+        self.assertEqual(len(self.get_context_variable('list_of_stories')), 1)
+
+    def test_search_partial(self):
+        routes = self.routes()
+        routes[USER_URL + '/search?query=admin'] = requests.exceptions.ConnectionError()
+
+        with fake_services(routes):
+            self.client.post('/search', data={'query': 'admin'})
+
+        self.assert_template_used('search.html')
+        self.assert_message_flashed('The users search is not available right now', 'error')
+        self.assertEqual(self.get_context_variable('list_of_users'), [])
+        self.assertEqual(len(self.get_context_variable('list_of_stories')), 1)
+
+    def test_search_deadline(self):
+        def slow():
+            time.sleep(0.5)
+            return 200, []
+
+        routes = self.routes()
+        routes[STORY_URL + '/search?query=admin'] = slow
+
+        with fake_services(routes), mock.patch.object(auth, 'SEARCH_TIMEOUT', 0.1):
+            start = time.time()
+            self.client.post('/search', data={'query': 'admin'})
+            self.assertLess(time.time() - start, 0.4)
+
+        self.assert_message_flashed('The stories search took too long, its results are not shown', 'error')
+        self.assertEqual(len(self.get_context_variable('list_of_users')), 1)
+        self.assertEqual(self.get_context_variable('list_of_stories'), [])
+
+    def test_search_too_large(self):
+        routes = self.routes()
+        routes[STORY_URL + '/search?query=admin'] = (200, [{'id': i, 'text': 'admin story', 'author_id': 1}
+                                                           for i in range(100)])
+
+        with fake_services(routes), mock.patch.object(client, 'max_response_bytes', 1000):
+            self.client.post('/search', data={'query': 'admin'})
+
+        self.assert_message_flashed('The stories search is not available right now', 'error')
+        self.assertEqual(len(self.get_context_variable('list_of_users')), 1)
+        self.assertEqual(self.get_context_variable('list_of_stories'), [])
+
+    def test_no_match(self):
+        routes = {USER_URL + '/search?query=none': (204, None),
+                  STORY_URL + '/search?query=none': (204, None)}
+        with fake_services(routes):
+            self.client.post('/search', data={'query': 'none'})
+
+        self.assert_message_flashed('No match for the searched string', 'error')
+
+
+class TestStoryFanOut(flask_testing.TestCase):
+    app = None
+
+    def create_app(self):
+        global app
+        app = create_app(TEST_DB)
+        return app
+
+    def routes(self, story):
+        # The Users service has no bulk endpoint, the Reactions one does
+        return {STORY_URL + '/stories/1': (200, story),
+                USER_URL + '/users?ids={}'.format(story['author_id']): (404, {'description': 'Not found'}),
+                REACTION_URL + '/reactions/stats?ids=1': (200, {'1': {'like': 2, 'dislike': 0}}),
+                REACTION_URL + '/reactions/stats/1': (200, {'like': 2, 'dislike': 0})}
+
+    def test_story(self):
+        story = {'id': 1, 'author_id': 1, 'text': 'Trial story', 'figures': '#example#admin#'}
+        routes = self.routes(story)
+        routes[USER_URL + '/users/1'] = (200, {'id': 1, 'firstname': 'Admin', 'lastname': 'Admin'})
+
+        with fake_services(routes):
+            self.client.get('/stories/1')
+
+        self.assert_template_used('story.html')
+        self.assertEqual(self.get_context_variable('user')['firstname'], 'Admin')
+        self.assertEqual(self.get_context_variable('reactions'), {'like': 2, 'dislike': 0})
+        self.assertEqual(self.get_context_variable('rolled_dice'), ['example', 'admin'])
+
+    def test_story_embedded_author(self):
+        # There's no route for the author: it must not be requested
+        story = {'id': 1, 'author_id': 5, 'text': 'Trial story', 'figures': '#example#admin#',
+                 'author': {'id': 5, 'firstname': 'Embedded', 'lastname': 'Admin'}}
+        routes = self.routes(story)
+        del routes[USER_URL + '/users?ids=5']
+
+        with fake_services(routes):
+            self.client.get('/stories/1')
+
+        self.assert_template_used('story.html')
+        self.assertEqual(self.get_context_variable('user')['firstname'], 'Embedded')
+
+    def test_story_author_not_found(self):
+        story = {'id': 1, 'author_id': 9, 'text': 'Trial story', 'figures': '#example#admin#'}
+        routes = self.routes(story)
+        routes[USER_URL + '/users/9'] = (404, {'description': 'User not found'})
+
+        with fake_services(routes):
+            self.client.get('/stories/1')
+
+        self.assert_message_flashed("Can't find author of this story", 'error')
@@ -0,0 +1,106 @@
+from unittest import mock
+
+import flask_testing
+from flask_login import current_user
+
+from APIGateway import auth, deadline
+from APIGateway.app import create_app
+from APIGateway.breaker import CircuitOpenError
+from APIGateway.client import client
+from APIGateway.urls import TEST_DB, USER_URL, STORY_URL
+from APIGateway.views.tests.mock import fake_services
+
+ADMIN = {'id': 1, 'firstname': 'Admin', 'lastname': 'Admin', 'email': 'example@example.com', 'is_admin': True}
+
+
+class TestStatelessIdentity(flask_testing.TestCase):
+    app = None
+
+    def create_app(self):
+        global app
+        app = create_app(TEST_DB, stateless_identity=True)
+        return app
+
+    def routes(self):
+        return {USER_URL + '/users/login': (200, ADMIN),
+                USER_URL + '/users/1': (200, ADMIN),
+                STORY_URL + '/stories/users/1': (200, [])}
+
+    def get_home(self):
+        with fake_services(self.routes()):
+            self.client.get('/')
+            return [c[0][1] for c in client.request.call_args_list]
+
+    def test_user_rebuilt_from_claim(self):
+        with fake_services(self.routes()):
+            self.client.post('/login', data={'email': 'example@example.com', 'password': 'admin'})
+
+        # The Users service isn't called to load the logged user
+        self.assertEqual(self.get_home(), [STORY_URL + '/stories/users/1'])
+        self.assert_template_used('index.html')
+
+        with self.client:
+            self.get_home()
+            self.assertTrue(current_user.is_authenticated)
+            self.assertTrue(current_user.is_admin)
+            self.assertEqual(current_user.email, 'example@example.com')
+
+    def test_home_too_large(self):
+        routes = self.routes()
+        routes[STORY_URL + '/stories/users/1'] = (200, [{'id': i, 'text': 'story', 'author_id': 1} for i in range(100)])
+        with fake_services(routes), mock.patch.object(client, 'max_response_bytes', 1000):
+            self.client.post('/login', data={'email': 'example@example.com', 'password': 'admin'})
+            self.client.get('/')
+
+        self.assert_template_used('index.html')
+        self.assert_message_flashed('A requested microservice is not up', 'error')
+        self.assertEqual(self.get_context_variable('stories'), [])
+
+    def test_home_service_down(self):
+        routes = self.routes()
+        with fake_services(routes):
+            self.client.post('/login', data={'email': 'example@example.com', 'password': 'admin'})
+
+        for error in (CircuitOpenError('stories'), deadline.GatewayTimeout()):
+            routes[STORY_URL + '/stories/users/1'] = error
+            with fake_services(routes):
+                response = self.client.get('/')
+
+            self.assertEqual(response.status_code, 200)
+            self.assert_message_flashed('A requested microservice is not up', 'error')
+            self.assertEqual(self.get_context_variable('stories'), [])
+
+    def test_stale_claim_revalidated(self):
+        with fake_services(self.routes()):
+            self.client.post('/login', data={'email': 'example@example.com', 'password': 'admin'})
+
+        # Expired claim
+        app.config['IDENTITY_REFRESH'] = -1
+        self.assertIn(USER_URL + '/users/1', self.get_home())
+        app.config['IDENTITY_REFRESH'] = 300
+
+        # Claim of an older version
+        auth.IDENTITY_VERSION += 1
+        try:
+            self.assertIn(USER_URL + '/users/1', self.get_home())
+            # The claim has been refreshed with the new version
+            self.assertEqual(self.get_home(), [STORY_URL + '/stories/users/1'])
+        finally:
+            auth.IDENTITY_VERSION -= 1
+
+    def test_tampered_claim(self):
+        with fake_services(self.routes()):
+            self.client.post('/login', data={'email': 'example@example.com', 'password': 'admin'})
+
+        with self.client.session_transaction() as session:
+            session['identity'] = session['identity'][:-2] + 'xx'
+
+        self.assertIn(USER_URL + '/users/1', self.get_home())
+
+    def test_logout(self):
+        with fake_services(self.routes()):
+            self.client.post('/login', data={'email': 'example@example.com', 'password': 'admin'})
+            self.client.post('/logout')
+
+        with self.client.session_transaction() as session:
+            self.assertNotIn('identity', session)
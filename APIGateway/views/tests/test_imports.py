@@ -0,0 +1,44 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Seconds `import APIGateway` may take in a new process, with the specs and the templates cached
+IMPORT_BUDGET = 2.0
+# Imported only by the processes that need them
+LAZY_MODULES = ['celery', 'kombu', 'billiard', 'aiohttp', 'PIL']
+
+
+def import_profile(env):
+    code = 'import sys, APIGateway; print(" ".join(sorted(m for m in sys.modules if "." not in m)))'
+    done = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    # import time: self [us] | cumulative | imported package
+    times = {}
+    for line in done.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$', line)
+        if match is not None:
+            times[match.group(4)] = int(match.group(2)) / 10 ** 6
+    return times, done.stdout.split()
+
+
+class TestImportTime(unittest.TestCase):
+
+    def test_import_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, GATEWAY_SPEC_CACHE_DIR=directory)
+            import_profile(env)
+            times, modules = import_profile(env)
+
+        for name in LAZY_MODULES:
+            self.assertNotIn(name, modules)
+        slowest = sorted(((t, m) for m, t in times.items() if m.startswith('APIGateway.')), reverse=True)[:5]
+        self.assertLess(times['APIGateway'], IMPORT_BUDGET, 'Slowest imports: {}'.format(slowest))
+
+    def test_lazy_celery(self):
+        code = ('import sys; from APIGateway import tasks; assert "celery" not in sys.modules; '
+                'assert tasks.celery is tasks.get_celery(); print(tasks.reaction_task.name)')
+        done = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(done.stdout.split()[-1], 'APIGateway.tasks.reaction_task')
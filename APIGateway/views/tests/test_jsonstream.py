@@ -0,0 +1,80 @@
+import json
+import unittest
+from http.server import BaseHTTPRequestHandler
+from threading import Thread
+
+import requests
+
+from APIGateway.cache import ResponseCache
+from APIGateway.client import GatewayClient
+from APIGateway.jsonstream import iter_array, ResponseTooLarge, MAX_RESPONSE_BYTES
+from APIGateway.views.tests.mock import make_response, ThreadingHTTPServer
+
+ITEMS = [{'id': i, 'text': 'Città {}'.format(i), 'figures': '#bike#moon#', 'likes': i * 1.5, 'draft': i % 2 == 0}
+         for i in range(200)] + [12345678901234567890, 'a, ] string', [], {}, None]
+
+
+class ArrayHandler(BaseHTTPRequestHandler):
+    body = json.dumps(ITEMS, indent=2).encode('utf-8')
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestIterArray(unittest.TestCase):
+
+    def test_chunk_sizes(self):
+        for chunk_size in (1, 3, 50, 4096, 10 ** 6):
+            x = make_response(200, ITEMS)
+            self.assertEqual(list(iter_array(x, chunk_size=chunk_size)), ITEMS)
+
+    def test_one_at_a_time(self):
+        x = make_response(200, ITEMS)
+        items = iter_array(x, chunk_size=64)
+        self.assertEqual(next(items), ITEMS[0])
+        self.assertEqual(next(items), ITEMS[1])
+
+    def test_malformed(self):
+        for body in (b'{"id": 1}', b'[1, 2', b'[1 2]', b''):
+            x = make_response(200, [])
+            x._content = body
+            with self.assertRaises(ValueError):
+                list(iter_array(x, chunk_size=1))
+
+    def test_max_size(self):
+        x = make_response(200, ITEMS)
+        items = iter_array(x, max_bytes=1000, chunk_size=100)
+        with self.assertRaises(ResponseTooLarge):
+            list(items)
+
+    def test_streamed_response(self):
+        server = ThreadingHTTPServer(('localhost', 0), ArrayHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://localhost:{}'.format(server.server_port)
+        client = GatewayClient(services={'stories': url})
+        try:
+            x = client.get(url + '/stories/range', stream=True)
+            self.assertEqual(list(client.iter_json(x)), ITEMS)
+
+            # A declared size over the limit is refused before reading the body
+            client.max_response_bytes = 1000
+            self.assertRaises(requests.exceptions.ConnectionError, client.get, url + '/stories/range', stream=True)
+
+            # Also on a cached route, where a small enough body is kept for the next calls
+            client.cache = ResponseCache(client.services, redis_url=None)
+            self.assertRaises(requests.exceptions.ConnectionError, client.get, url + '/stories', stream=True)
+            client.max_response_bytes = MAX_RESPONSE_BYTES
+            self.assertEqual(list(client.iter_json(client.get(url + '/stories', stream=True))), ITEMS)
+            self.assertEqual(list(client.iter_json(client.get(url + '/stories', stream=True))), ITEMS)
+            self.assertEqual(client.cache_stats()['stories']['l1_hits'], 1)
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,82 @@
+import unittest
+
+import requests
+
+from APIGateway import loaders
+from APIGateway.loaders import BatchLoader, dispatch_all
+from APIGateway.views.tests.mock import fake_services
+
+USER_URL = 'http://users'
+REACTION_URL = 'http://reactions'
+
+
+class TestBatchLoader(unittest.TestCase):
+
+    def setUp(self) -> None:
+        loaders._NO_BULK.clear()
+        self.users = BatchLoader('users', USER_URL + '/users/{}', USER_URL + '/users?ids={}', max_concurrency=2)
+        self.stats = BatchLoader('stats', REACTION_URL + '/stats/{}')
+
+    def test_bulk(self):
+        routes = {USER_URL + '/users?ids=1,2,3': (200, {'1': {'id': 1}, '2': {'id': 2}})}
+        with fake_services(routes) as request:
+            self.users.want(1, 2, 1, 3)
+            self.assertEqual(self.users.get_many([1, 2, 3]), {1: {'id': 1}, 2: {'id': 2}, 3: None})
+            # Already loaded ids aren't requested again
+            self.assertEqual(self.users.get(2), {'id': 2})
+            self.assertEqual(request.call_count, 1)
+
+    def test_no_bulk_endpoint(self):
+        routes = {USER_URL + '/users?ids=1,2,3': (404, {'description': 'Not found'}),
+                  USER_URL + '/users/1': (200, {'id': 1}),
+                  USER_URL + '/users/2': (404, {'description': 'Not found'}),
+                  USER_URL + '/users/3': requests.exceptions.ConnectionError()}
+        with fake_services(routes) as request:
+            self.users.want(1, 2, 3)
+            self.assertEqual(self.users.get(1), {'id': 1})
+            self.assertIsNone(self.users.get(2))
+            self.assertRaises(requests.exceptions.ConnectionError, self.users.get, 3)
+            self.assertEqual(request.call_count, 4)
+
+            # From now on the bulk endpoint is skipped
+            routes[USER_URL + '/users/4'] = (200, {'id': 4})
+            routes[USER_URL + '/users/5'] = (200, {'id': 5})
+            self.assertEqual(self.users.get_many([4, 5]), {4: {'id': 4}, 5: {'id': 5}})
+            self.assertEqual(request.call_count, 6)
+
+            # Until it's tried again
+            loaders._NO_BULK['users'] = 0
+            routes[USER_URL + '/users?ids=4,5'] = (200, {'4': {'id': 4}, '5': {'id': 5}})
+            self.users._results.clear()
+            self.assertEqual(self.users.get_many([4, 5]), {4: {'id': 4}, 5: {'id': 5}})
+            self.assertEqual(request.call_count, 7)
+
+    def test_bulk_ignores_ids(self):
+        # The list of all the users, from a service that doesn't know ids
+        routes = {USER_URL + '/users?ids=1,2': (200, [{'id': 1}, {'id': 2}, {'id': 3}]),
+                  USER_URL + '/users/1': (200, {'id': 1}),
+                  USER_URL + '/users/2': (200, {'id': 2})}
+        with fake_services(routes):
+            self.assertEqual(self.users.get_many([1, 2]), {1: {'id': 1}, 2: {'id': 2}})
+        self.assertIn('users', loaders._NO_BULK)
+
+    def test_bulk_server_error(self):
+        routes = {USER_URL + '/users?ids=1,2': (500, {})}
+        with fake_services(routes):
+            self.users.want(1, 2)
+            self.assertRaises(requests.exceptions.ConnectionError, self.users.get, 1)
+            self.assertRaises(loaders.ServiceError, self.users.get, 2)
+        self.assertNotIn('users', loaders._NO_BULK)
+
+    def test_dispatch_all(self):
+        # A single id uses the single endpoint even if there's a bulk one
+        routes = {USER_URL + '/users/1': (200, {'id': 1}),
+                  REACTION_URL + '/stats/7': (200, {'like': 1})}
+        with fake_services(routes) as request:
+            self.users.want(1)
+            self.stats.want(7)
+            dispatch_all(self.users, self.stats)
+            self.assertEqual(request.call_count, 2)
+            self.assertEqual(self.stats.get(7), {'like': 1})
+            self.assertEqual(self.users.get(1), {'id': 1})
+            self.assertEqual(request.call_count, 2)
@@ -0,0 +1,46 @@
+import flask_testing
+
+from APIGateway.app import create_app
+from APIGateway.pagination import NEXT_HEADER, PREV_HEADER
+from APIGateway.urls import TEST_DB, STORY_URL, USER_URL
+from APIGateway.views.tests.mock import fake_services
+
+STORIES = [{'id': i, 'text': 'Story {}'.format(i), 'date': '2019-11-05', 'author_id': 1} for i in range(10, 20)]
+
+
+class TestPagination(flask_testing.TestCase):
+    app = None
+
+    def create_app(self):
+        global app
+        app = create_app(TEST_DB)
+        return app
+
+    def get(self, path, routes):
+        with fake_services(routes) as request:
+            page = self.client.get(path).get_data(as_text=True)
+            return page, [c[0][1] for c in request.call_args_list]
+
+    def test_limit_and_cursor_passed_on(self):
+        url = STORY_URL + '/stories/range?begin=2019-01-01&end=2019-12-31&limit=10&cursor=abc'
+        page, urls = self.get('/stories/range?begin=2019-01-01&end=2019-12-31&limit=10&cursor=abc',
+                              {url: (200, STORIES, {NEXT_HEADER: 'def', PREV_HEADER: 'xyz'})})
+        self.assertIn(url, urls)
+
+        # The links keep the filters of the page and change only the cursor
+        self.assertIn('href="/stories/range?begin=2019-01-01&amp;end=2019-12-31&amp;limit=10&amp;cursor=def"', page)
+        self.assertIn('cursor=xyz', page)
+
+    def test_page_size(self):
+        _, urls = self.get('/users?limit=100000', {USER_URL + '/users?limit=200': (200, [])})
+        self.assertEqual(urls, [USER_URL + '/users?limit=200'])
+
+        # Without cursors from the service there are no links
+        page, _ = self.get('/users/1/followers', {USER_URL + '/users/1/followers?limit=50': (200, [])})
+        self.assertNotIn('Next', page)
+        self.assertIn('No followers!', page)
+
+    def test_first_page(self):
+        page, _ = self.get('/stories', {STORY_URL + '/stories?limit=50': (200, STORIES, {NEXT_HEADER: '19'})})
+        self.assertIn('href="/stories?cursor=19"', page)
+        self.assertNotIn('Previous', page)
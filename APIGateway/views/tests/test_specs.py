@@ -0,0 +1,78 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from flakon import SwaggerBlueprint as FlakonSwaggerBlueprint
+
+from APIGateway import specs
+from APIGateway.app import create_app
+from APIGateway.specs import SwaggerBlueprint, load_spec
+from APIGateway.urls import TEST_DB, YML_PATH
+
+YAMLS = ['auth-api.yaml', 'users-api.yaml', 'dice-api.yaml', 'stories-api.yaml']
+
+
+class TestSpecs(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached(self):
+        path = os.path.join(YML_PATH, 'dice-api.yaml')
+        spec = load_spec(path, self.directory)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        with mock.patch.object(specs, 'SwaggerParser') as parser:
+            self.assertEqual(load_spec(path, self.directory), spec)
+            parser.assert_not_called()
+
+        # A changed file is parsed and validated again
+        changed = os.path.join(self.directory, 'dice-api.yaml')
+        with open(path) as f, open(changed, 'w') as out:
+            out.write(f.read().replace('version: ', 'version: 2'))
+        with mock.patch.object(specs, 'SwaggerParser', wraps=specs.SwaggerParser) as parser:
+            load_spec(changed, self.directory)
+            parser.assert_called_once()
+
+        with open(changed, 'w') as out:
+            out.write('swagger: "2.0"\npaths: 3\n')
+        with self.assertRaises(ValueError):
+            load_spec(changed, self.directory)
+
+    def test_private_dir(self):
+        path = os.path.join(YML_PATH, 'dice-api.yaml')
+        link = self.directory + '-link'
+        os.symlink(self.directory, link)
+        try:
+            load_spec(path, link)
+            self.assertEqual(os.listdir(self.directory), [])
+        finally:
+            os.remove(link)
+
+    def test_same_operations(self):
+        for name in YAMLS:
+            path = os.path.join(YML_PATH, name)
+            flakon = FlakonSwaggerBlueprint('flakon', __name__, swagger_spec=path)
+            with mock.patch.object(specs, 'SPEC_CACHE_DIR', self.directory):
+                SwaggerBlueprint('parsed', __name__, swagger_spec=path)
+                cached = SwaggerBlueprint('cached', __name__, swagger_spec=path)
+            self.assertEqual(cached.ops, flakon.ops)
+            self.assertEqual(cached.spec, flakon.spec)
+
+    def test_startup_budget(self):
+        app = create_app(TEST_DB)
+        self.assertLess(app.config['GATEWAY_STARTUP_TIME'], app.config['GATEWAY_STARTUP_BUDGET'])
+
+        # A new process with the specs in the cache doesn't parse any of them
+        code = 'from APIGateway.specs import stats; import APIGateway.views; print(stats.to_dict()["misses"])'
+        env = dict(os.environ, GATEWAY_SPEC_CACHE_DIR=self.directory)
+        runs = [subprocess.run([sys.executable, '-c', code], env=env, check=True, stdout=subprocess.PIPE,
+                               universal_newlines=True).stdout.split()[-1] for _ in range(2)]
+        self.assertEqual(runs, [str(len(YAMLS)), '0'])
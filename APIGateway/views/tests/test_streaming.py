@@ -0,0 +1,69 @@
+import flask_testing
+
+from APIGateway.app import create_app
+from APIGateway.client import client
+from APIGateway.streaming import STREAM_ERROR
+from APIGateway.urls import TEST_DB, STORY_URL
+from APIGateway.views.tests.mock import fake_services
+
+STORIES = [{'id': i, 'text': 'Story {}'.format(i), 'date': '2019-11-05', 'author_id': 1} for i in range(300)]
+
+
+class TestStreaming(flask_testing.TestCase):
+    app = None
+
+    def create_app(self):
+        global app
+        app = create_app(TEST_DB)
+        return app
+
+    def get(self, path, routes):
+        with fake_services(routes):
+            resp = self.client.get(path)
+            # A streamed page has no Content-Length, its size isn't known when it starts
+            resp.streamed = 'Content-Length' not in resp.headers
+            # A streamed page is rendered while it's read
+            resp.get_data()
+            return resp
+
+    def test_same_page(self):
+        routes = {STORY_URL + '/stories?limit=50': (200, STORIES)}
+        streamed = self.get('/stories', routes)
+        self.assertTrue(streamed.streamed)
+        self.assert_template_used('stories.html')
+        self.assertIn('Story 299', streamed.get_data(as_text=True))
+
+        app.config['GATEWAY_STREAM_TEMPLATES'] = False
+        rendered = self.get('/stories', routes)
+        self.assertFalse(rendered.streamed)
+        self.assertEqual(streamed.get_data(), rendered.get_data())
+
+    def test_flash_shown_once(self):
+        # The flashed message is removed from the session even if the page is streamed
+        routes = {STORY_URL + '/stories?limit=50': (500, {})}
+        self.assertIn('Internal Server error', self.get('/stories', routes).get_data(as_text=True))
+        routes = {STORY_URL + '/stories?limit=50': (200, [])}
+        self.assertNotIn('Internal Server error', self.get('/stories', routes).get_data(as_text=True))
+
+    def test_user_stories(self):
+        page = self.get('/users/1/stories', {STORY_URL + '/stories/users/1?limit=50': (200, STORIES[:2])})
+        self.assertTrue(page.streamed)
+        self.assertEqual(self.get_context_variable('no_stories'), False)
+
+        self.get('/users/1/stories', {STORY_URL + '/stories/users/1?limit=50': (200, [])})
+        self.assertEqual(self.get_context_variable('no_stories'), True)
+
+    def test_items_error(self):
+        # The items stop coming after the page has started: it ends with an error instead
+        routes = {STORY_URL + '/stories?limit=50': (200, STORIES)}
+        max_bytes, client.max_response_bytes = client.max_response_bytes, 1000
+        try:
+            page = self.get('/stories', routes)
+            self.assertEqual(page.status_code, 200)
+            self.assertTrue(page.get_data(as_text=True).endswith(STREAM_ERROR))
+
+            # When it isn't streamed, the page isn't started before the items are read
+            app.config['GATEWAY_STREAM_TEMPLATES'] = False
+            self.assertEqual(self.get('/stories', routes).status_code, 302)
+        finally:
+            client.max_response_bytes = max_bytes
@@ -0,0 +1,277 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import flask_testing
+import requests
+from kombu.exceptions import OperationalError
+
+from APIGateway.app import create_app
+from APIGateway.client import client
+from APIGateway import tasks
+from APIGateway.tasks import ReactionBuffer, BATCH_URL
+from APIGateway.urls import TEST_DB, USER_URL, REACTION_URL
+from APIGateway.views import stories
+from APIGateway.views.tests.mock import fake_services, make_response
+
+
+def reaction(story, user, caption='like'):
+    return {"story_id": story, "reaction_caption": caption, "current_user": user}
+
+
+class TestReactionBuffer(unittest.TestCase):
+
+    def routes(self, batch_code=200):
+        return {BATCH_URL: (batch_code, {'description': 'ok'}),
+                REACTION_URL + '/react': (200, {'description': 'Reaction created'})}
+
+    def test_flush_by_size(self):
+        buffer = ReactionBuffer(size=3, window=10)
+        with fake_services(self.routes()) as request:
+            buffer.add(reaction(1, 1))
+            buffer.add(reaction(1, 1))
+            buffer.add(reaction(1, 2))
+            self.assertEqual(request.call_count, 0)
+            buffer.add(reaction(1, 3, 'dislike'))
+
+        # One batch, with the duplicate reaction sent once
+        request.assert_called_once_with('POST', BATCH_URL, json={'reactions': [
+            reaction(1, 1), reaction(1, 2), reaction(1, 3, 'dislike')]})
+        self.assertEqual(buffer.stats['duplicates'], 1)
+
+    def test_flush_by_window(self):
+        buffer = ReactionBuffer(size=100, window=0.05)
+        with fake_services(self.routes()) as request:
+            buffer.add(reaction(1, 1))
+            buffer.add(reaction(2, 1))
+            time.sleep(0.2)
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(buffer.stats['batches'], 1)
+
+    def test_no_batch_endpoint(self):
+        buffer = ReactionBuffer(size=2, window=10)
+        with fake_services(self.routes(404)) as request:
+            buffer.add(reaction(1, 1))
+            buffer.add(reaction(1, 2))
+            buffer.add(reaction(1, 3))
+            buffer.flush()
+
+        self.assertFalse(buffer.batch_supported)
+        urls = [c[0][1] for c in request.call_args_list]
+        self.assertEqual(urls, [BATCH_URL] + [REACTION_URL + '/react'] * 3)
+        self.assertEqual(buffer.stats['single'], 3)
+
+    def test_batch_refused(self):
+        buffer = ReactionBuffer(size=2, window=10)
+        with fake_services(self.routes(422)) as request, self.assertLogs(tasks.logger, 'WARNING'):
+            buffer.add(reaction(1, 1))
+            buffer.add(reaction(1, 2))
+
+        # Sent again one by one, the next batches are still tried
+        self.assertTrue(buffer.batch_supported)
+        urls = [c[0][1] for c in request.call_args_list]
+        self.assertEqual(urls, [BATCH_URL] + [REACTION_URL + '/react'] * 2)
+        self.assertEqual(buffer.stats['single'], 2)
+        self.assertEqual(buffer.stats['batches'], 0)
+
+    def test_batch_retried(self):
+        buffer = ReactionBuffer(size=2, window=10)
+        with fake_services(self.routes(503)), mock.patch.object(tasks.publisher, 'enqueue') as enqueue:
+            buffer.add(reaction(1, 1))
+            buffer.add(reaction(1, 2), attempt=2)
+
+        # Every reaction of the failed batch is queued again, one attempt later
+        self.assertEqual([c[0] for c in enqueue.call_args_list],
+                         [((1, 'like', 1), {'attempt': 1}), ((1, 'like', 2), {'attempt': 3})])
+        countdowns = [c[1]['countdown'] for c in enqueue.call_args_list]
+        self.assertLessEqual(countdowns[0], tasks.RETRY_BACKOFF)
+        self.assertLessEqual(countdowns[1], tasks.RETRY_BACKOFF * 4)
+
+
+class TestReactionTask(unittest.TestCase):
+
+    def test_backoff(self):
+        for retry in range(10):
+            self.assertLessEqual(tasks.backoff(retry), min(tasks.RETRY_BACKOFF_MAX, tasks.RETRY_BACKOFF * 2 ** retry))
+
+    def test_dropped_logged(self):
+        with mock.patch.object(tasks.publisher, 'enqueue') as enqueue, self.assertLogs(tasks.logger, 'ERROR') as logs:
+            tasks.retry_later(reaction(1, 1), tasks.MAX_RETRIES, RuntimeError('down'))
+        self.assertFalse(enqueue.called)
+        self.assertIn('dropped after {} attempts: down'.format(tasks.MAX_RETRIES + 1), logs.output[0])
+
+    def test_retry(self):
+        answers = [(503, {}), requests.exceptions.ConnectionError(), (200, {'description': 'Reaction created'})]
+        routes = {REACTION_URL + '/react': lambda: answers.pop(0)}
+        with fake_services(routes) as request, mock.patch.object(tasks.reactions, 'size', 1):
+            result = tasks.reaction_task.apply((1, 'like', 1))
+        self.assertEqual(result.get(), 'Reaction created')
+        self.assertEqual(request.call_count, 3)
+
+    def test_options(self):
+        self.assertTrue(tasks.reaction_task.ignore_result)
+        self.assertEqual(tasks.reaction_task.expires, tasks.TASK_EXPIRES)
+
+
+class TestReactionPublisher(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.publisher = tasks.ReactionPublisher(os.path.join(self.dir.name, 'reactions.spool'), retry_after=10)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_spool_and_replay(self):
+        with mock.patch.object(tasks.reaction_task, 'apply_async', side_effect=OperationalError()) as apply_async:
+            self.assertFalse(self.publisher.publish((1, 'like', 1), {}))
+            # While the broker is down it isn't tried at all
+            self.assertFalse(self.publisher.publish((2, 'like', 1), {'attempt': 1}))
+            self.assertEqual(apply_async.call_count, 1)
+        self.assertEqual(self.publisher.stats['spooled'], 2)
+
+        self.publisher.broker_down_until = 0
+        with mock.patch.object(tasks.reaction_task, 'apply_async') as apply_async:
+            self.assertEqual(self.publisher.replay(), 2)
+        self.assertEqual([c[0][:2] for c in apply_async.call_args_list],
+                         [([1, 'like', 1], {}), ([2, 'like', 1], {'attempt': 1})])
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def test_replay_expires(self):
+        spooled_at = time.time() - tasks.TASK_EXPIRES + 60
+        self.publisher._spool((1, 'like', 1), {}, spooled_at)
+        self.publisher._spool((2, 'like', 1), {}, time.time() - tasks.TASK_EXPIRES - 1)
+        with mock.patch.object(tasks.reaction_task, 'apply_async') as apply_async:
+            self.assertEqual(self.publisher.replay(), 1)
+        # The reaction still expires TASK_EXPIRES seconds after it was queued
+        self.assertEqual(apply_async.call_args[0][0], [1, 'like', 1])
+        self.assertAlmostEqual(apply_async.call_args[1]['expires'].timestamp(), spooled_at + tasks.TASK_EXPIRES, places=3)
+        self.assertEqual(self.publisher.stats['expired'], 1)
+
+    def test_recover(self):
+        # Left by processes that stopped while replaying: a running one keeps its own
+        self.publisher._spool((1, 'like', 1), {}, time.time())
+        os.rename(self.publisher.spool_path, self.publisher.spool_path + '.{}.replay'.format(os.getpid()))
+        self.publisher._spool((2, 'like', 1), {}, time.time())
+        os.rename(self.publisher.spool_path, self.publisher.spool_path + '.{}.replay'.format(os.getppid()))
+        with mock.patch.object(tasks.reaction_task, 'apply_async') as apply_async:
+            self.assertEqual(self.publisher.recover(), 1)
+        self.assertEqual(apply_async.call_args[0][0], [1, 'like', 1])
+        self.assertEqual(os.listdir(self.dir.name), ['reactions.spool.{}.replay'.format(os.getppid())])
+
+    def test_private_spool(self):
+        self.publisher._spool((1, 'like', 1), {}, time.time())
+        self.assertEqual(os.stat(self.publisher.spool_path).st_mode & 0o777, 0o600)
+
+    def test_shared_spool(self):
+        # A directory that may belong to someone else is neither written nor replayed
+        link = os.path.join(self.dir.name, 'link')
+        os.symlink(self.dir.name, link)
+        publisher = tasks.ReactionPublisher(os.path.join(link, 'reactions.spool'))
+        with open(os.path.join(link, 'reactions.spool.{}-planted.replay'.format(os.getpid())), 'w') as f:
+            f.write('[[1, "like", 1], {}, null]\n')
+        with self.assertLogs(tasks.logger, 'ERROR') as logs:
+            publisher._spool((1, 'like', 1), {}, time.time())
+        self.assertIn('not private', logs.output[0])
+        self.assertEqual(publisher.stats['dropped'], 1)
+        self.assertFalse(os.path.exists(publisher.spool_path))
+        with mock.patch.object(tasks.reaction_task, 'apply_async') as apply_async:
+            self.assertEqual(publisher.recover(), 0)
+            self.assertEqual(publisher.replay(), 0)
+        self.assertFalse(apply_async.called)
+
+    def test_truncated_spool(self):
+        self.publisher._spool((1, 'like', 1), {}, time.time())
+        with open(self.publisher.spool_path, 'a') as f:
+            f.write('[[2, "like"')
+        with mock.patch.object(tasks.reaction_task, 'apply_async') as apply_async, \
+                self.assertLogs(tasks.logger, 'ERROR') as logs:
+            self.assertEqual(self.publisher.replay(), 1)
+        self.assertEqual(apply_async.call_args[0][0], [1, 'like', 1])
+        self.assertIn('could not be read', logs.output[0])
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def test_thread_survives_errors(self):
+        published = []
+
+        def apply_async(args, *a, **k):
+            if args[0] == 1:
+                raise RuntimeError('not a broker error')
+            published.append(args)
+
+        with mock.patch.object(tasks.reaction_task, 'apply_async', side_effect=apply_async), \
+                self.assertLogs(tasks.logger, 'ERROR'):
+            self.publisher.enqueue((1, 'like', 1))
+            self.publisher.enqueue((2, 'like', 1))
+            for _ in range(50):
+                if published:
+                    break
+                time.sleep(0.02)
+        self.assertEqual(published, [(2, 'like', 1)])
+        self.assertTrue(self.publisher._thread.is_alive())
+
+    def test_restart(self):
+        with mock.patch.object(tasks.ReactionPublisher, '_run', lambda self: None):
+            self.publisher.start()
+            self.publisher._thread.join()
+        with mock.patch.object(tasks.reaction_task, 'apply_async') as apply_async:
+            self.publisher.enqueue((1, 'like', 1))
+            for _ in range(50):
+                if apply_async.called:
+                    break
+                time.sleep(0.02)
+        self.assertTrue(apply_async.called)
+
+    def test_enqueue_does_not_block(self):
+        with mock.patch.object(tasks.reaction_task, 'apply_async', side_effect=lambda *a, **k: time.sleep(0.5)):
+            start = time.time()
+            for i in range(10):
+                self.publisher.enqueue((i, 'like', 1))
+            self.assertLess(time.time() - start, 0.1)
+
+
+ADMIN = {'id': 1, 'firstname': 'Admin', 'lastname': 'Admin', 'email': 'example@example.com', 'is_admin': True}
+
+
+class TestReactView(flask_testing.TestCase):
+    app = None
+
+    def create_app(self):
+        global app
+        app = create_app(TEST_DB)
+        return app
+
+    def setUp(self) -> None:
+        client.cache.l2 = None
+        client.cache.clear()
+        with fake_services({USER_URL + '/users/login': (200, ADMIN),
+                            USER_URL + '/users/1': (200, ADMIN)}):
+            self.client.post('/login', data={'email': 'example@example.com', 'password': 'admin'})
+
+    def react(self, stats=None, **kwargs):
+        stats_url = REACTION_URL + '/reactions/stats/3'
+        stats = {'like': 4, 'dislike': 1} if stats is None else stats
+        client.cache.fetch('reactions', stats_url, lambda: make_response(200, stats))
+        # Only the logged user is loaded, the story isn't fetched
+        with fake_services({USER_URL + '/users/1': (200, ADMIN)}) as request, \
+                mock.patch.object(stories, 'queue_reaction') as queue_reaction:
+            resp = self.client.get('/stories/3/react/like', **kwargs)
+        self.assertNotIn(mock.call('GET', stories.STORY_URL + '/stories/3'), request.call_args_list)
+        queue_reaction.assert_called_once_with('3', 'like', 1)
+        return resp, client.cache.fetch('reactions', stats_url, lambda: self.fail('must be cached')).json()
+
+    def test_redirect(self):
+        resp, reactions = self.react()
+        self.assertRedirects(resp, '/stories/3')
+        self.assertEqual(reactions, {'like': 5, 'dislike': 1})
+
+    def test_first_of_its_kind(self):
+        _, reactions = self.react(stats={'dislike': 1})
+        self.assertEqual(reactions, {'like': 1, 'dislike': 1})
+
+    def test_ajax(self):
+        resp, _ = self.react(headers={'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json, {'story_id': '3', 'reaction': 'like', 'status': 'queued'})
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+
+from APIGateway import templating
+from APIGateway.app import create_app
+from APIGateway.urls import TEST_DB
+
+
+class TestTemplating(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        templating.stats.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_app(self):
+        app = Flask('APIGateway.app')
+        app.config['GATEWAY_TEMPLATE_CACHE_DIR'] = self.directory
+        templating.init_app(app)
+        return app
+
+    def test_bytecode_cache(self):
+        names = templating.precompile(self.new_app())
+        self.assertIn('navbar.html', names)
+        compiled = templating.stats.to_dict()
+        self.assertEqual(set(compiled), set(names))
+        self.assertTrue(all(s['compiles'] == 1 and s['compile_time'] > 0 for s in compiled.values()))
+        self.assertEqual(len([f for f in os.listdir(self.directory) if f.endswith('.cache')]), len(names))
+
+        # A new worker loads the bytecode written by the first one
+        templating.stats.clear()
+        self.new_app()
+        loaded = templating.stats.to_dict()
+        self.assertEqual({s['compiles'] for s in loaded.values()}, {0})
+        self.assertEqual({s['bytecode_hits'] for s in loaded.values()}, {1})
+
+        # A change of the source is compiled again
+        app = Flask('APIGateway.app', template_folder=self.directory)
+        with open(os.path.join(self.directory, 'page.html'), 'w') as f:
+            f.write('{{ 1 + 1 }}')
+        app.config.update(GATEWAY_TEMPLATE_CACHE_DIR=self.directory, GATEWAY_TEMPLATE_PRECOMPILE=False)
+        templating.init_app(app)
+        self.assertEqual(app.jinja_env.get_template('page.html').render(), '2')
+        self.assertEqual(templating.stats.to_dict()['page.html']['compiles'], 1)
+
+    def test_render_time(self):
+        app = create_app(TEST_DB)
+        self.assertEqual(app.test_client().get('/search').status_code, 200)
+        search = templating.stats.to_dict()['search.html']
+        self.assertEqual(search['renders'], 1)
+        self.assertGreater(search['render_time'], 0)
+
+        status = app.test_client().get('/status').get_json()
+        self.assertEqual(status['templates']['search.html']['renders'], 1)
+
+    def test_private_dir(self):
+        # A directory others can write to is made private, a symlink isn't used at all
+        os.chmod(self.directory, 0o777)
+        self.assertIsNotNone(self.new_app().jinja_env.bytecode_cache)
+        self.assertEqual(os.stat(self.directory).st_mode & 0o777, 0o700)
+
+        link = self.directory + '-link'
+        os.symlink(self.directory, link)
+        try:
+            app = Flask('APIGateway.app')
+            app.config.update(GATEWAY_TEMPLATE_CACHE_DIR=link, GATEWAY_TEMPLATE_PRECOMPILE=False)
+            with self.assertLogs(app.logger, 'WARNING'):
+                templating.init_app(app)
+            self.assertIsNone(app.jinja_env.bytecode_cache)
+        finally:
+            os.remove(link)
+
+        self.assertTrue(templating.user_dir('gateway-templates').startswith(tempfile.gettempdir()))
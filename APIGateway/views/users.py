@@ -1,8 +1,11 @@
 import requests
-from flakon import SwaggerBlueprint
 from flask import render_template, redirect, url_for
 from flask_login import current_user, login_required
 
+from APIGateway.client import client
+from APIGateway.pagination import paged, page_links
+from APIGateway.specs import SwaggerBlueprint
+from APIGateway.streaming import render_list, peek
 from APIGateway.urls import *
 
 usersapi = SwaggerBlueprint('users', '__name__', swagger_spec=os.path.join(YML_PATH, 'users-api.yaml'))
@@ -12,59 +15,53 @@ usersapi = SwaggerBlueprint('users', '__name__', swagger_spec=os.path.join(YML_P
 @usersapi.operation('getAll')
 def _get_all_users():
     try:
-        x = requests.get(USER_URL + '/users')
+        x = client.get(paged(USER_URL + '/users'), stream=True)
     except requests.exceptions.ConnectionError:
         return service_not_up()
     users = []
 
     if check_service_up(x):
-        users = x.json()
+        users = client.iter_json(x)
 
-    return render_template("users.html", users=users, home_url=GATEWAY_URL)
+    return render_list("users.html", users=users, page=page_links(x), home_url=GATEWAY_URL)
 
 
 # Renders a page (wall.html) with the wall of a specified user
 @usersapi.operation('getUser')
 def _get_user(id_user):
     try:
-        u = requests.get(USER_URL + '/users/{}'.format(id_user))
+        u = client.get(USER_URL + '/users/{}'.format(id_user))
     except requests.exceptions.ConnectionError:
         return service_not_up()
 
     if u.status_code < 300:
         user = u.json()
-        try:
-            fs = requests.get(USER_URL + '/users/{}/stats'.format(id_user))
-            followers_stats = fs.json()
-        except requests.exceptions.ConnectionError:
-            return service_not_up()
-
-        if fs.status_code < 300:
-            try:
-                ss = requests.get(STORY_URL + '/stories/stats/{}'.format(id_user))
-            except requests.exceptions.ConnectionError:
-                return service_not_up()
-            if ss.status_code < 300:
-                stories_stats = ss.json()
-                try:
-                    rs = requests.get(USER_URL + '/reactions/stats/user/{}'.format(id_user))
-                except requests.exceptions.ConnectionError:
-                    return service_not_up()
-                if rs.status_code < 300:
-                    reactions_stats = rs.json()
-                else:
-                    reactions_stats = {"tot_num_reactions": 0, "avg_reactions": 0.0}
-
-                stats = {'follower_stats': followers_stats, 'stories_stats': stories_stats,
-                         'reactions_stats': reactions_stats}
-                if current_user is None or not hasattr(current_user, 'id'):
-                    return render_template("wall.html", my_wall=False, not_foudn=False, user_info=user,
-                                           stats=stats, home_url=GATEWAY_URL)
-                return render_template("wall.html", my_wall=(current_user.id == user['id']), not_found=False,
-                                       user_info=user, stats=stats, home_url=GATEWAY_URL)
-
-        flash("Can't retrieve stories stats")
-        return redirect(url_for('gateway._home'))
+
+        # The stats only depend on the user, so they are requested all together
+        fs = client.submit('GET', USER_URL + '/users/{}/stats'.format(id_user))
+        ss = client.submit('GET', STORY_URL + '/stories/stats/{}'.format(id_user))
+        rs = client.submit('GET', USER_URL + '/reactions/stats/user/{}'.format(id_user))
+
+        # Each one fails on its own: the wall is shown anyway, with the default values
+        followers_stats = _stats_result(fs)
+        if followers_stats is None:
+            flash("Can't retrieve followers stats")
+            followers_stats = {"num_followers": 0, "followers_last_month": 0}
+        stories_stats = _stats_result(ss)
+        if stories_stats is None:
+            flash("Can't retrieve stories stats")
+            stories_stats = {"num_stories": 0, "tot_num_dice": 0, "avg_dice": 0.0}
+        reactions_stats = _stats_result(rs)
+        if reactions_stats is None:
+            reactions_stats = {"tot_num_reactions": 0, "avg_reactions": 0.0}
+
+        stats = {'follower_stats': followers_stats, 'stories_stats': stories_stats,
+                 'reactions_stats': reactions_stats}
+        if current_user is None or not hasattr(current_user, 'id'):
+            return render_template("wall.html", my_wall=False, not_foudn=False, user_info=user,
+                                   stats=stats, home_url=GATEWAY_URL)
+        return render_template("wall.html", my_wall=(current_user.id == user['id']), not_found=False,
+                               user_info=user, stats=stats, home_url=GATEWAY_URL)
     else:
         return render_template("wall.html", not_found=True, home_url=GATEWAY_URL)
 
@@ -74,7 +71,7 @@ def _get_user(id_user):
 @login_required
 def _follow_user(id_user):
     try:
-        x = requests.post(USER_URL + '/users/{}/follow?current_user_id={}'.format(id_user, current_user.id))
+        x = client.post(USER_URL + '/users/{}/follow?current_user_id={}'.format(id_user, current_user.id))
     except requests.exceptions.ConnectionError:
         return service_not_up()
     if check_service_up(x):
@@ -90,7 +87,7 @@ def _follow_user(id_user):
 @login_required
 def _unfollow_user(id_user):
     try:
-        x = requests.post(USER_URL + '/users/{}/unfollow?current_user_id={}'.format(id_user, current_user.id))
+        x = client.post(USER_URL + '/users/{}/unfollow?current_user_id={}'.format(id_user, current_user.id))
     except requests.exceptions.ConnectionError:
         return service_not_up()
 
@@ -106,26 +103,45 @@ def _unfollow_user(id_user):
 @usersapi.operation('getFollowers')
 def _get_followers(id_user):
     try:
-        x = requests.get(USER_URL + '/users/' + id_user + '/followers')
+        x = client.get(paged(USER_URL + '/users/' + id_user + '/followers'), stream=True)
     except requests.exceptions.ConnectionError:
         return service_not_up()
     followers = []
 
     if check_service_up(x):
-        followers = x.json()
+        followers = client.iter_json(x)
 
-    return render_template("followers.html", users=followers, home_url=GATEWAY_URL)
+    no_users, followers = peek(followers)
+    return render_list("followers.html", users=followers, no_users=no_users, page=page_links(x),
+                       home_url=GATEWAY_URL)
 
 
 # Get all the posted stories of a specified user
 @usersapi.operation('getStoriesOfUser')
 def _get_stories_of_user(id_user):
     try:
-        s = requests.get(STORY_URL + '/stories/users/{}'.format(id_user))
+        s = client.get(paged(STORY_URL + '/stories/users/{}'.format(id_user)), stream=True)
     except requests.exceptions.ConnectionError:
         return service_not_up()
     stories = []
     if s.status_code < 300:
-        stories = s.json()
+        stories = client.iter_json(s)
+
+    # The page header depends on whether there are stories, before the list is written
+    no_stories, stories = peek(stories)
+    return render_list("user_stories.html", stories=stories, no_stories=no_stories, page=page_links(s),
+                       home_url=GATEWAY_URL)
+
+
+#                   Useful functions
+
+# Body of a stats call started with client.submit, None if the call failed
+def _stats_result(future):
+    try:
+        x = future.result()
+    except requests.exceptions.RequestException:
+        return None
 
-    return render_template("user_stories.html", stories=stories, home_url=GATEWAY_URL)
+    if x.status_code < 300:
+        return x.json()
+    return None